@@ -0,0 +1,183 @@
+"""Time-bucketed aggregation of observation metrics."""
+
+from types import SimpleNamespace
+
+from sqlalchemy import func
+
+from models import Observation, db
+
+# The numeric observation fields that can be aggregated.
+AGGREGATE_METRICS = (
+    "water_temp",
+    "air_temp",
+    "wind_speed",
+    "wind_direction",
+    "humidity",
+    "haze_percent",
+    "precipitation_mm",
+    "radiation_bq",
+)
+
+BUCKETS = ("hour", "day", "month")
+
+# Formats that truncate a timestamp to the start of its bucket, rendered as an
+# ISO 8601 string. SQLite's strftime and MySQL's DATE_FORMAT happen to share
+# the same format codes for these.
+_BUCKET_FORMATS = {
+    "hour": "%Y-%m-%dT%H:00:00",
+    "day": "%Y-%m-%dT00:00:00",
+    "month": "%Y-%m-01T00:00:00",
+}
+
+
+def bucket_expression(column, bucket, dialect_name):
+    """Builds a SQL expression truncating a timestamp column to a bucket.
+
+    Args:
+        column: The timestamp column to truncate.
+        bucket (str): One of BUCKETS.
+        dialect_name (str): The name of the database dialect in use.
+
+    Raises:
+        NotImplementedError: If the database is not supported.
+
+    Returns:
+        The SQL expression, which evaluates to an ISO 8601 string.
+    """
+
+    bucket_format = _BUCKET_FORMATS[bucket]
+
+    if dialect_name == "sqlite":
+        return func.strftime(bucket_format, column)
+    if dialect_name in ("mysql", "mariadb"):
+        return func.date_format(column, bucket_format)
+    if dialect_name == "postgresql":
+        return func.to_char(
+            func.date_trunc(bucket, column), 'YYYY-MM-DD"T"HH24:MI:SS'
+        )
+
+    raise NotImplementedError(
+        f"Aggregation is not supported for {dialect_name} databases"
+    )
+
+
+def aggregate_query(bucket, metrics, group_by_device=False, dialect_name=None):
+    """Builds a query computing the count and min/max/avg of each metric per
+    bucket, and optionally per device.
+
+    The whole aggregation runs as a single GROUP BY in the database, so only
+    one row per bucket is transferred.
+
+    Args:
+        bucket (str): One of BUCKETS.
+        metrics (list): The names of the metrics to aggregate.
+        group_by_device (bool): Whether to aggregate each device separately.
+        dialect_name (str, optional): The name of the database dialect the
+            query will run on. Defaults to that of the database in use.
+
+    Returns:
+        Query: The aggregate query, to which observation filters can be
+        applied.
+    """
+
+    if dialect_name is None:
+        dialect_name = db.session.get_bind().dialect.name
+    bucket_column = bucket_expression(
+        Observation.observed_at_utc, bucket, dialect_name
+    ).label("bucket")
+
+    group_by = [bucket_column]
+    if group_by_device:
+        group_by.append(Observation.device_id)
+
+    columns = [*group_by, func.count().label("count")]
+    for metric in metrics:
+        column = getattr(Observation, metric)
+        columns += [
+            func.min(column).label(f"{metric}_min"),
+            func.max(column).label(f"{metric}_max"),
+            func.avg(column).label(f"{metric}_avg"),
+        ]
+
+    return (
+        db.session.query(*columns)
+        .select_from(Observation)
+        .group_by(*group_by)
+        .order_by(*group_by)
+    )
+
+
+def combine_aggregates(row_sets, metrics, group_by_device=False):
+    """Combines aggregate query rows computed over separate sets of
+    observations, e.g. archived months and the observation table.
+
+    Args:
+        row_sets (iterable): Lists of rows returned by aggregate queries.
+        metrics (list): The names of the aggregated metrics.
+        group_by_device (bool): Whether rows were aggregated per device.
+
+    Returns:
+        list: A row per bucket, ordered as the aggregate query orders them.
+    """
+
+    combined = {}
+
+    for rows in row_sets:
+        for row in rows:
+            values = row._mapping
+            key = (row.bucket, row.device_id) if group_by_device else row.bucket
+            current = combined.get(key)
+
+            if current is None:
+                combined[key] = dict(values)
+                continue
+
+            count = current["count"] + row.count
+            for metric in metrics:
+                minimum, maximum, average = (
+                    f"{metric}_min",
+                    f"{metric}_max",
+                    f"{metric}_avg",
+                )
+                current[minimum] = min(current[minimum], values[minimum])
+                current[maximum] = max(current[maximum], values[maximum])
+                current[average] = (
+                    float(current[average]) * current["count"]
+                    + float(values[average]) * row.count
+                ) / count
+            current["count"] = count
+
+    return [SimpleNamespace(**combined[key]) for key in sorted(combined)]
+
+
+def format_aggregates(rows, metrics, group_by_device=False):
+    """Converts aggregate query rows to JSON-serialisable dictionaries.
+
+    Args:
+        rows (list): The rows returned by the aggregate query.
+        metrics (list): The names of the aggregated metrics.
+        group_by_device (bool): Whether rows were aggregated per device.
+
+    Returns:
+        list: A dictionary per bucket.
+    """
+
+    results = []
+
+    for row in rows:
+        result = {"bucket": row.bucket}
+        if group_by_device:
+            result["device_id"] = row.device_id
+        result["count"] = row.count
+
+        for metric in metrics:
+            average = getattr(row, f"{metric}_avg")
+            result[metric] = {
+                "min": getattr(row, f"{metric}_min"),
+                "max": getattr(row, f"{metric}_max"),
+                "avg": float(average) if average is not None else None,
+            }
+
+        results.append(result)
+
+    return results
@@ -2,31 +2,14 @@
 
 from flask import Flask
 from flask_swagger_ui import get_swaggerui_blueprint
+from sqlalchemy import event
 
 from config import config
 from models import db
+from replicas import configure_replicas
 from routes import api as api_blueprint
 from schemas import ma
 
-app = Flask(__name__)
-
-# Configure the app from the loaded configuration
-app.config["SQLALCHEMY_DATABASE_URI"] = config.database_uri
-app.config["SQLALCHEMY_ECHO"] = config.database_echo
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = (
-    config.database_track_modifications
-)
-
-# Ensure that JSON responses are ordered according to our specified field order
-app.json.sort_keys = False
-
-# Initialise the database and Marshmallow
-db.init_app(app)
-ma.init_app(app)
-
-# Register the API blueprint for our route handlers
-app.register_blueprint(api_blueprint)
-
 SWAGGER_URL = "/api/docs"  # URL for exposing Swagger UI (without trailing '/')
 API_URL = "/static/openapi.json"
 
@@ -36,4 +19,77 @@ swaggerui_blueprint = get_swaggerui_blueprint(
     API_URL,
     config={"app_name": "CleanSMRs"},  # Swagger UI config overrides
 )
-app.register_blueprint(swaggerui_blueprint)
+
+
+def _configure_sqlite(engine, app_config):
+    """Sets the SQLite pragmas on each new connection to a database.
+
+    WAL mode lets readers carry on while a write is in progress, rather than
+    blocking behind it, and with synchronous=NORMAL a commit doesn't need to
+    wait for the disk. The busy timeout makes writers wait for each other
+    rather than failing straight away.
+
+    Args:
+        engine (Engine): The SQLite engine.
+        app_config (Config): The configuration with the pragma values.
+    """
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={app_config.sqlite_journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={app_config.sqlite_synchronous}")
+        cursor.execute(
+            f"PRAGMA busy_timeout={app_config.sqlite_busy_timeout_ms:d}"
+        )
+        cursor.close()
+
+
+def create_app(app_config=config):
+    """Creates and configures the Flask app.
+
+    Args:
+        app_config (Config, optional): The configuration to use. Defaults to
+            the configuration loaded from .env.
+
+    Returns:
+        Flask: The app.
+    """
+
+    app = Flask(__name__)
+
+    # Keep the configuration on the app, where the extensions read it from,
+    # so that apps created with different configurations don't share settings
+    app.extensions["config"] = app_config
+
+    # Configure the app from the loaded configuration
+    app.config["SQLALCHEMY_DATABASE_URI"] = app_config.database_uri
+    app.config["SQLALCHEMY_ECHO"] = app_config.database_echo
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = (
+        app_config.database_track_modifications
+    )
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = app_config.engine_options()
+
+    # Ensure that JSON responses are ordered according to our specified field
+    # order
+    app.json.sort_keys = False
+
+    # Initialise the database, with any replicas, and Marshmallow
+    db.init_app(app)
+    ma.init_app(app)
+    replicas = configure_replicas(app, app_config)
+
+    with app.app_context():
+        engines = [db.engine, *(replicas.engines if replicas else ())]
+        for engine in engines:
+            if engine.dialect.name == "sqlite":
+                _configure_sqlite(engine, app_config)
+
+    # Register the API blueprint for our route handlers
+    app.register_blueprint(api_blueprint)
+    app.register_blueprint(swaggerui_blueprint)
+
+    return app
+
+
+app = create_app()
@@ -0,0 +1,685 @@
+"""Cold-tier storage of old observations, partitioned by month.
+
+Observations are partitioned by the month they were logged in. Months older
+than a configurable age are compacted out of the observation table into a
+compressed, column-oriented file per month in a local directory, listed in a
+catalog file alongside them. The observation table then only holds recent
+months, so queries over recent data cost the same however much history has
+accumulated.
+
+Read paths prune the catalog to the months overlapping the requested date
+range and run the same query against each of those months, loaded into an
+in-memory SQLite database with only the columns the query uses, then combine
+the results with those from the observation table.
+
+The rollup tables keep covering archived months, so aggregates served from
+the rollups never need to read the archive.
+"""
+
+import copy
+import heapq
+import itertools
+import json
+import os
+import struct
+import threading
+import uuid
+import zlib
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
+
+from flask import current_app
+from sqlalchemy import (
+    Column,
+    MetaData,
+    Table,
+    and_,
+    create_engine,
+    delete,
+    func,
+    select,
+)
+from sqlalchemy.sql import visitors
+from sqlalchemy.sql.elements import ColumnClause
+
+from config import get_config
+from devices import update_latest_observations
+from models import Observation, db
+from pagination import KEYSET_ORDER
+
+ARCHIVE_MAGIC = b"CSMRARC1"
+CATALOG_FILE = "catalog.json"
+
+# zlib's default trade-off between compression ratio and speed.
+ARCHIVE_COMPRESSION_LEVEL = 6
+
+_HEADER_LENGTH = struct.Struct(">I")
+
+# Functions restoring values that are stored as ISO 8601 strings.
+_DECODERS = {
+    date: date.fromisoformat,
+    time: time.fromisoformat,
+    datetime: datetime.fromisoformat,
+}
+
+# The observation table as created in the in-memory databases archived months
+# are queried in, without the indexes and constraints of the real table as
+# most columns are left empty.
+_ARCHIVE_TABLE = Table(
+    Observation.__tablename__,
+    MetaData(),
+    *(Column(c.name, c.type) for c in Observation.__table__.columns),
+)
+
+_extension_lock = threading.Lock()
+
+
+def month_start(day):
+    """Gets the first day of the month a date falls in."""
+
+    return day.replace(day=1)
+
+
+def next_month(month):
+    """Gets the first day of the month after the given one."""
+
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _encode(value):
+    """Converts a value to one that can be stored as JSON."""
+
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+
+    return value
+
+
+def write_archive(path, columns):
+    """Writes observations to a column-oriented archive file.
+
+    Each column is compressed separately, so that reading a column only
+    needs decompressing that column.
+
+    Args:
+        path (str): The path of the file to write.
+        columns (dict): Lists of values keyed by column name, all of the same
+            length.
+    """
+
+    blocks = []
+    offsets = {}
+    position = 0
+
+    for name, values in columns.items():
+        block = zlib.compress(
+            json.dumps(
+                [_encode(value) for value in values], separators=(",", ":")
+            ).encode("utf-8"),
+            ARCHIVE_COMPRESSION_LEVEL,
+        )
+        offsets[name] = [position, len(block)]
+        position += len(block)
+        blocks.append(block)
+
+    header = json.dumps(
+        {"rows": len(next(iter(columns.values()), [])), "columns": offsets}
+    ).encode("utf-8")
+
+    # Write to a temporary file first so that a partly written archive is
+    # never read.
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(ARCHIVE_MAGIC)
+        file.write(_HEADER_LENGTH.pack(len(header)))
+        file.write(header)
+        for block in blocks:
+            file.write(block)
+
+    os.replace(temporary_path, path)
+
+
+@lru_cache(maxsize=64)
+def read_column(path, name):
+    """Reads a column of an archive file.
+
+    Archive files are never modified once written, so recently read columns
+    are cached.
+
+    Args:
+        path (str): The path of the archive file.
+        name (str): The name of the column.
+
+    Raises:
+        ValueError: If the file isn't an observation archive.
+
+    Returns:
+        tuple: The column's values in row order.
+    """
+
+    with open(path, "rb") as file:
+        if file.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+            raise ValueError(f"{path} is not an observation archive")
+
+        (header_length,) = _HEADER_LENGTH.unpack(file.read(_HEADER_LENGTH.size))
+        header = json.loads(file.read(header_length))
+        offset, length = header["columns"][name]
+
+        file.seek(len(ARCHIVE_MAGIC) + _HEADER_LENGTH.size + header_length)
+        file.seek(offset, os.SEEK_CUR)
+        values = json.loads(zlib.decompress(file.read(length)))
+
+    decode = _DECODERS.get(Observation.__table__.c[name].type.python_type)
+    if decode is not None:
+        values = [None if value is None else decode(value) for value in values]
+
+    return tuple(values)
+
+
+class ArchivedMonth:
+    """A month of observations held in an archive file."""
+
+    def __init__(
+        self,
+        month,
+        path,
+        rows,
+        min_date_logged,
+        max_date_logged,
+        min_observed_at_utc,
+        max_observed_at_utc,
+    ):
+        """Initialises the catalog entry.
+
+        Args:
+            month (date): The first day of the month.
+            path (str): The path of the archive file.
+            rows (int): The number of observations in the file.
+            min_date_logged (date): The earliest date logged.
+            max_date_logged (date): The latest date logged.
+            min_observed_at_utc (datetime): The earliest UTC time observed.
+            max_observed_at_utc (datetime): The latest UTC time observed.
+        """
+
+        self.month = month
+        self.path = path
+        self.rows = rows
+        self.min_date_logged = min_date_logged
+        self.max_date_logged = max_date_logged
+        self.min_observed_at_utc = min_observed_at_utc
+        self.max_observed_at_utc = max_observed_at_utc
+
+        # The range that queries of the month are known to be restricted to,
+        # so that observations outside it needn't be loaded.
+        self.bounds = {}
+
+    @classmethod
+    def from_json(cls, data, directory):
+        """Creates an entry from its representation in the catalog file."""
+
+        return cls(
+            date.fromisoformat(data["month"]),
+            os.path.join(directory, data["file"]),
+            data["rows"],
+            date.fromisoformat(data["min_date_logged"]),
+            date.fromisoformat(data["max_date_logged"]),
+            datetime.fromisoformat(data["min_observed_at_utc"]),
+            datetime.fromisoformat(data["max_observed_at_utc"]),
+        )
+
+    def to_json(self):
+        """Gets the entry's representation in the catalog file."""
+
+        return {
+            "month": self.month.isoformat(),
+            "file": os.path.basename(self.path),
+            "rows": self.rows,
+            "min_date_logged": self.min_date_logged.isoformat(),
+            "max_date_logged": self.max_date_logged.isoformat(),
+            "min_observed_at_utc": self.min_observed_at_utc.isoformat(),
+            "max_observed_at_utc": self.max_observed_at_utc.isoformat(),
+        }
+
+    def within(self, **bounds):
+        """Gets a copy of the entry for queries restricted to a range.
+
+        Args:
+            bounds: The range, as accepted by overlaps.
+
+        Returns:
+            ArchivedMonth: The copy.
+        """
+
+        entry = copy.copy(self)
+        entry.bounds = bounds
+
+        return entry
+
+    def overlaps(
+        self, date_from=None, date_to=None, observed_from=None, observed_to=None
+    ):
+        """Checks whether the month may hold observations in a range.
+
+        Args:
+            date_from (date, optional): The earliest date logged.
+            date_to (date, optional): The latest date logged.
+            observed_from (datetime, optional): The earliest UTC time.
+            observed_to (datetime, optional): The latest UTC time.
+
+        Returns:
+            bool: False if none of the month's observations can be in range.
+        """
+
+        return not (
+            (date_from is not None and date_from > self.max_date_logged)
+            or (date_to is not None and date_to < self.min_date_logged)
+            or (
+                observed_from is not None
+                and observed_from > self.max_observed_at_utc
+            )
+            or (
+                observed_to is not None
+                and observed_to < self.min_observed_at_utc
+            )
+        )
+
+
+class ArchiveCatalog:
+    """The archived months in a directory, as listed in its catalog file."""
+
+    def __init__(self, directory):
+        """Initialises the catalog.
+
+        Args:
+            directory (str): The directory holding the archive files.
+        """
+
+        self.directory = directory
+        self.path = os.path.join(directory, CATALOG_FILE)
+        self._entries = []
+        self._version = None
+        self._lock = threading.Lock()
+
+    def entries(self):
+        """Gets every archived month.
+
+        The catalog file is only re-read when it has changed, which costs a
+        stat per call rather than a database query.
+
+        Returns:
+            list: ArchivedMonth entries ordered by month.
+        """
+
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return []
+
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            if version != self._version:
+                with open(self.path, encoding="utf-8") as file:
+                    self._entries = [
+                        ArchivedMonth.from_json(data, self.directory)
+                        for data in json.load(file)
+                    ]
+                self._version = version
+
+            return self._entries
+
+    def months(self, **bounds):
+        """Gets the archived months that may hold observations in a range.
+
+        Args:
+            bounds: The range, as accepted by ArchivedMonth.overlaps.
+
+        Returns:
+            list: ArchivedMonth entries restricted to the range, ordered by
+            month.
+        """
+
+        return [
+            entry.within(**bounds)
+            for entry in self.entries()
+            if entry.overlaps(**bounds)
+        ]
+
+    def save(self, entries):
+        """Replaces the catalog file.
+
+        Args:
+            entries (list): Every archived month.
+        """
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(
+                [
+                    entry.to_json()
+                    for entry in sorted(entries, key=lambda e: e.month)
+                ],
+                file,
+                indent=2,
+            )
+
+        os.replace(temporary_path, self.path)
+
+
+def get_archive_catalog():
+    """Gets the archive catalog for the current app.
+
+    Returns:
+        ArchiveCatalog: The catalog of the configured archive directory.
+    """
+
+    with _extension_lock:
+        catalog = current_app.extensions.get("archive_catalog")
+
+        if catalog is None:
+            catalog = current_app.extensions["archive_catalog"] = (
+                ArchiveCatalog(get_config().archive_directory)
+            )
+
+        return catalog
+
+
+def archived_observations(names):
+    """Reads columns of every archived observation, e.g. to rebuild the
+    tables derived from the observations.
+
+    Args:
+        names (iterable): The names of the columns.
+
+    Yields:
+        dict: The values of each observation, month by month.
+    """
+
+    names = list(names)
+
+    for month in get_archive_catalog().entries():
+        columns = [read_column(month.path, name) for name in names]
+
+        for values in zip(*columns):
+            yield dict(zip(names, values))
+
+
+def _referenced_columns(statement):
+    """Gets the names of the observation columns a statement uses."""
+
+    names = {
+        element.name
+        for element in visitors.iterate(statement)
+        if isinstance(element, ColumnClause)
+    }
+
+    return [
+        column.name
+        for column in _ARCHIVE_TABLE.columns
+        if column.name in names or column.primary_key
+    ]
+
+
+def _rows_in_bounds(month):
+    """Gets the positions of the rows in an archived month that fall within
+    the range it's restricted to.
+
+    Rows are stored in order of the date logged, so a range of dates can be
+    found by bisection.
+
+    Args:
+        month (ArchivedMonth): The month.
+
+    Returns:
+        iterable: The row positions, or None if the month isn't restricted.
+    """
+
+    date_from = month.bounds.get("date_from")
+    date_to = month.bounds.get("date_to")
+    observed_from = month.bounds.get("observed_from")
+    observed_to = month.bounds.get("observed_to")
+
+    if all(value is None for value in month.bounds.values()):
+        return None
+
+    dates = read_column(month.path, "date_logged")
+    positions = range(
+        bisect_left(dates, date_from) if date_from is not None else 0,
+        bisect_right(dates, date_to) if date_to is not None else len(dates),
+    )
+
+    if observed_from is None and observed_to is None:
+        return positions
+
+    observed = read_column(month.path, "observed_at_utc")
+
+    return [
+        position
+        for position in positions
+        if (observed_from is None or observed[position] >= observed_from)
+        and (observed_to is None or observed[position] <= observed_to)
+    ]
+
+
+def query_month(statement, month):
+    """Runs a query against an archived month.
+
+    Args:
+        statement (Select): The query, selecting from the observation table.
+        month (ArchivedMonth): The month to query.
+
+    Returns:
+        list: The rows returned.
+    """
+
+    names = _referenced_columns(statement)
+    columns = [read_column(month.path, name) for name in names]
+
+    positions = _rows_in_bounds(month)
+    if positions is not None:
+        columns = [[column[p] for p in positions] for column in columns]
+
+    engine = create_engine("sqlite://")
+
+    try:
+        with engine.connect() as connection:
+            _ARCHIVE_TABLE.create(connection)
+            connection.execute(
+                _ARCHIVE_TABLE.insert(),
+                [dict(zip(names, values)) for values in zip(*columns)],
+            )
+
+            return connection.execute(statement).all()
+    finally:
+        engine.dispose()
+
+
+def fetch_all(query, months, key=None):
+    """Runs a query against archived months and the observation table.
+
+    Args:
+        query: The Observation query.
+        months (list): The archived months to include.
+        key (callable, optional): Sorts the combined rows by this key when
+            given.
+
+    Returns:
+        list: The rows from the archived months followed by those from the
+        observation table, unless sorted.
+    """
+
+    if not months:
+        return query.all()
+
+    statement = query.statement
+    rows = [row for month in months for row in query_month(statement, month)]
+    rows.extend(query.all())
+
+    if key is not None:
+        rows.sort(key=key)
+
+    return rows
+
+
+def _iterate_month(statement, month):
+    """Lazily runs a query against an archived month."""
+
+    yield from query_month(statement, month)
+
+
+def stream_all(query, months, key):
+    """Iterates over the results of a query across archived months and the
+    observation table, merged in order.
+
+    Archived months are only loaded once the rows before them have been
+    consumed, so only one is held in memory at a time.
+
+    Args:
+        query: The Observation query, ordered by the month observations were
+            logged in and then by key, e.g. in keyset order.
+        months (list): The archived months to include, ordered by month.
+        key (callable): Gets the sort key of a row.
+
+    Returns:
+        iterable: The rows in order.
+    """
+
+    if not months:
+        return iter(query)
+
+    statement = query.statement
+    archived = itertools.chain.from_iterable(
+        _iterate_month(statement, month) for month in months
+    )
+
+    return heapq.merge(archived, query, key=key)
+
+
+def archive_month(month, catalog):
+    """Moves a month of observations from the observation table into its
+    archive file.
+
+    Any observations already archived for the month are combined with those
+    in the table into a new file, which replaces the old one.
+
+    Args:
+        month (date): The first day of the month.
+        catalog (ArchiveCatalog): The catalog to archive into.
+
+    Returns:
+        int: The number of observations moved out of the table.
+    """
+
+    table = Observation.__table__
+    names = [column.name for column in table.columns]
+    in_month = and_(
+        table.c.date_logged >= month, table.c.date_logged < next_month(month)
+    )
+
+    rows = db.session.execute(select(table).where(in_month)).all()
+    if not rows:
+        return 0
+
+    moved = len(rows)
+    max_id = max(row.id for row in rows)
+    device_ids = {row.device_id for row in rows}
+
+    entries = {entry.month: entry for entry in catalog.entries()}
+    previous = entries.get(month)
+    if previous is not None:
+        rows.extend(zip(*(read_column(previous.path, name) for name in names)))
+
+    # Store rows in keyset order, which is the order most reads want them.
+    key_indexes = [names.index(c.key) for c in KEYSET_ORDER]
+    rows.sort(key=lambda row: [row[index] for index in key_indexes])
+    columns = {
+        name: [row[index] for row in rows] for index, name in enumerate(names)
+    }
+
+    os.makedirs(catalog.directory, exist_ok=True)
+    path = os.path.join(
+        catalog.directory,
+        f"observations-{month:%Y-%m}-{uuid.uuid4().hex[:8]}.arc",
+    )
+    write_archive(path, columns)
+
+    entries[month] = ArchivedMonth(
+        month,
+        path,
+        len(rows),
+        min(columns["date_logged"]),
+        max(columns["date_logged"]),
+        min(columns["observed_at_utc"]),
+        max(columns["observed_at_utc"]),
+    )
+
+    # Rows are deleted up to the greatest id read, so that any inserted for
+    # the month since stay in the table until the next run. Readers may see
+    # a month both in the table and the archive between the catalog being
+    # saved and the deletion being committed.
+    try:
+        db.session.execute(delete(table).where(in_month, table.c.id <= max_id))
+        update_latest_observations(device_ids)
+        catalog.save(entries.values())
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        if previous is not None:
+            entries[month] = previous
+        else:
+            del entries[month]
+        catalog.save(entries.values())
+        os.remove(path)
+        raise
+
+    if previous is not None:
+        os.remove(previous.path)
+
+    return moved
+
+
+def archive_old_months(catalog, age_months=None, today=None):
+    """Archives every month of observations older than the configured age.
+
+    Args:
+        catalog (ArchiveCatalog): The catalog to archive into.
+        age_months (int, optional): The number of whole months to keep in the
+            observation table before the current one. Defaults to the
+            configured ARCHIVE_AFTER_MONTHS.
+        today (date, optional): The current UTC date.
+
+    Returns:
+        dict: The number of observations archived, keyed by month.
+    """
+
+    if age_months is None:
+        age_months = get_config().archive_after_months
+    if today is None:
+        today = datetime.now(timezone.utc).date()
+
+    # Step back from the start of the current month a month at a time.
+    cutoff = month_start(today)
+    for _ in range(age_months):
+        cutoff = month_start(cutoff - timedelta(days=1))
+
+    oldest = (
+        db.session.query(func.min(Observation.date_logged))
+        .filter(Observation.date_logged < cutoff)
+        .scalar()
+    )
+
+    archived = {}
+    if oldest is None:
+        return archived
+
+    month = month_start(oldest)
+    while month < cutoff:
+        moved = archive_month(month, catalog)
+        if moved:
+            archived[month] = moved
+        month = next_month(month)
+
+    return archived
@@ -1,15 +1,142 @@
 """Authentication-related functionality."""
 
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
 
 import jwt
-from flask import jsonify, request
+from flask import current_app, g, jsonify, request
 
-from config import config
+from config import get_config
+from ratelimit import check_rate_limit
+
+_extension_lock = threading.Lock()
+
+
+class TokenCache:
+    """A bounded, thread-safe LRU cache of the claims of verified JWTs.
+
+    Clients tend to reuse the same token for many requests, so caching the
+    result of verifying it saves repeating the signature check and claim
+    parsing every time. Entries expire at the token's own expiry time so that
+    expired tokens are still rejected.
+    """
+
+    def __init__(self, max_size):
+        """Initialises the cache.
+
+        Args:
+            max_size (int): The maximum number of tokens to cache. A size of 0
+                disables caching.
+        """
+
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token, secret_key):
+        """Builds the cache key for a token.
+
+        The key is a hash of the token and the signing secret, so that raw
+        tokens aren't held in memory and changing the secret invalidates
+        cached tokens.
+
+        Args:
+            token (str): The encoded JWT.
+            secret_key (str): The secret tokens are signed with.
+
+        Returns:
+            str: The cache key.
+        """
+
+        material = f"{secret_key}\0{token}".encode("utf-8")
+
+        return hashlib.sha256(material).hexdigest()
+
+    def get(self, key):
+        """Gets the claims of a cached token if it hasn't expired.
+
+        Args:
+            key (str): The cache key for the token.
+
+        Returns:
+            dict: The token's claims, or None if it isn't cached.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None:
+                claims, expires_at = entry
+
+                if expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return claims
+
+                del self._entries[key]
+
+            self.misses += 1
+            return None
+
+    def put(self, key, claims):
+        """Caches the claims of a verified token until it expires.
+
+        Tokens without an expiry time are not cached.
+
+        Args:
+            key (str): The cache key for the token.
+            claims (dict): The verified claims.
+        """
+
+        expires_at = claims.get("exp")
+
+        if self.max_size <= 0 or not isinstance(expires_at, (int, float)):
+            return
+
+        with self._lock:
+            self._entries[key] = (claims, expires_at)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Removes every cached token and resets the counters."""
+
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def get_token_cache():
+    """Gets the verified token cache for the current app, creating it if
+    needed.
+
+    Returns:
+        TokenCache: The app's token cache.
+    """
+
+    with _extension_lock:
+        cache = current_app.extensions.get("token_cache")
+
+        if cache is None:
+            cache = current_app.extensions["token_cache"] = TokenCache(
+                get_config().jwt_cache_size
+            )
+
+        return cache
 
 
 def token_required(f):
-    """Decorator to require a valid JWT for a route."""
+    """Decorator to require a valid JWT for a route, and charge the request
+    to the rate limit of the token's user."""
 
     @wraps(f)
     def decorator(*args, **kwargs):
@@ -22,12 +149,27 @@ def token_required(f):
         if not token:
             return jsonify(message="Token is missing"), 401
 
-        try:
-            jwt.decode(token, config.secret_key, algorithms=["HS256"])
-        except jwt.ExpiredSignatureError:
-            return jsonify(message="Token has expired"), 401
-        except jwt.InvalidTokenError:
-            return jsonify(message="Token is invalid"), 401
+        secret_key = get_config().secret_key
+        token_cache = get_token_cache()
+        key = TokenCache.key(token, secret_key)
+        claims = token_cache.get(key)
+
+        if claims is None:
+            try:
+                claims = jwt.decode(token, secret_key, algorithms=["HS256"])
+            except jwt.ExpiredSignatureError:
+                return jsonify(message="Token has expired"), 401
+            except jwt.InvalidTokenError:
+                return jsonify(message="Token is invalid"), 401
+
+            token_cache.put(key, claims)
+
+        # Tokens without a user claim are treated as a user of their own.
+        g.user = claims.get("user") or key
+
+        limited = check_rate_limit(g.user)
+        if limited is not None:
+            return limited
 
         return f(*args, **kwargs)
 
@@ -0,0 +1,117 @@
+"""Measures queries over recent observations as history accumulates, with and
+without older months archived, along with queries reaching into the archive
+and the archive's size on disk.
+
+Usage:
+    python benchmarks/bench_archive.py [observations per year]
+"""
+
+import datetime
+import os
+import statistics
+import sys
+import tempfile
+
+from common import auth_headers, create_benchmark_app, timed
+
+from archive import archive_old_months, get_archive_catalog
+from models import db
+from utils.seed_data import seed_data
+
+HISTORY_YEARS = (1, 4)
+REPEATS = 5
+
+# The end of the seeded history, and the date the archive is run as of, which
+# keeps December in the observation table.
+END = datetime.date(2025, 1, 1)
+TODAY = datetime.date(2025, 1, 15)
+
+QUERIES = {
+    "recent week": (
+        "/observations",
+        {"date_from": "2024-12-20", "date_to": "2024-12-26"},
+    ),
+    "recent month daily": (
+        "/observations/aggregate",
+        {"bucket": "day", "observed_from": "2024-12-01T00:00:30"},
+    ),
+    "archived week": (
+        "/observations",
+        {"date_from": "2024-06-10", "date_to": "2024-06-16"},
+    ),
+}
+
+
+def _time_queries(client, headers):
+    """Gets the median time of each query in milliseconds."""
+
+    return {
+        name: statistics.median(
+            timed(client.get, path, query_string=args, headers=headers)[1]
+            for _ in range(REPEATS)
+        )
+        * 1000
+        for name, (path, args) in QUERIES.items()
+    }
+
+
+def run(observations_per_year=200000):
+    """Seeds histories of increasing length and prints the query times before
+    and after archiving all but the last month.
+
+    Args:
+        observations_per_year (int): The number of observations to seed for
+            each year of history.
+    """
+
+    headers = auth_headers()
+
+    print(
+        f"{'years':>6}{'archived':>10}"
+        + "".join(f"{name + ' (ms)':>24}" for name in QUERIES)
+        + f"{'database (MB)':>15}{'archive (MB)':>14}"
+    )
+
+    for years in HISTORY_YEARS:
+        with tempfile.TemporaryDirectory() as directory:
+            database_path = os.path.join(directory, "bench.db")
+            app = create_benchmark_app(
+                f"sqlite:///{database_path}",
+                RESPONSE_CACHE_SIZE="0",
+                ARCHIVE_DIRECTORY=os.path.join(directory, "archive"),
+            )
+            with app.app_context():
+                catalog = get_archive_catalog()
+            seed_data(
+                100,
+                years * observations_per_year,
+                target_app=app,
+                start=END - datetime.timedelta(days=365 * years),
+                days=365 * years,
+            )
+            client = app.test_client()
+
+            for archived in (False, True):
+                if archived:
+                    with app.app_context():
+                        archive_old_months(catalog, 1, TODAY)
+                        db.session.execute(db.text("VACUUM"))
+
+                timings = _time_queries(client, headers)
+                archive_size = sum(
+                    os.path.getsize(entry.path) for entry in catalog.entries()
+                )
+
+                print(
+                    f"{years:>6}{'yes' if archived else 'no':>10}"
+                    + "".join(f"{timings[name]:>24.1f}" for name in QUERIES)
+                    + f"{os.path.getsize(database_path) / 1e6:>15.1f}"
+                    + f"{archive_size / 1e6:>14.1f}"
+                )
+
+            with app.app_context():
+                db.engine.dispose()
+
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,65 @@
+"""Compares the throughput of the regular and bulk create-many routes.
+
+Usage:
+    python benchmarks/bench_bulk_ingest.py [batch size] [batches]
+"""
+
+import os
+import sys
+import tempfile
+
+from common import (
+    auth_headers,
+    create_benchmark_app,
+    make_observations,
+    reset_database,
+    timed,
+)
+
+
+def run(batch_size=5000, batches=3):
+    """Posts batches to both create-many modes and prints the throughput of
+    each.
+
+    Args:
+        batch_size (int): The number of observations in each request.
+        batches (int): The number of requests to time for each mode.
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_benchmark_app(
+            f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        )
+        client = app.test_client()
+        headers = auth_headers()
+        # Each batch is distinct, as repeated observations would be skipped
+        # as duplicates.
+        observations = make_observations(batch_size * batches)
+        results = {}
+
+        for mode in ("default", "bulk"):
+            reset_database(app)
+            query_string = {"mode": mode} if mode == "bulk" else {}
+            elapsed = 0
+
+            for batch in range(batches):
+                response, seconds = timed(
+                    client.post,
+                    "/observations/create-many",
+                    json=observations[
+                        batch * batch_size : (batch + 1) * batch_size
+                    ],
+                    query_string=query_string,
+                    headers=headers,
+                )
+                assert response.status_code == 201, response.text
+                elapsed += seconds
+
+            results[mode] = batch_size * batches / elapsed
+            print(f"{mode:>8}: {results[mode]:>10.0f} rows/s")
+
+        print(f" speedup: {results['bulk'] / results['default']:>10.1f}x")
+
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,213 @@
+"""Compares mixed read/write throughput from several concurrent workers on
+SQLite with its default rollback journal, with the WAL settings used by
+create_app, and with reads sent to a replica.
+
+The replica is a copy of the seeded database, as there's no replication
+between SQLite files, so it shows the best case of reads not competing with
+writes for the primary at all.
+
+Each worker is a separate process with its own app and connection pool, as
+when the API is served by several worker processes. Worker threads within a
+single process would mostly measure contention for the GIL instead.
+
+Usage:
+    python benchmarks/bench_concurrency.py [readers] [writers] [seconds]
+"""
+
+import datetime
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from common import auth_headers, benchmark_config, make_observations, timed
+
+from app import create_app
+from utils.seed_data import seed_data
+
+# The number of observations in each write, so that writes hold the database
+# lock for a realistic time.
+WRITE_BATCH_SIZE = 500
+
+# The time allowed for the worker processes to start before timing begins.
+STARTUP_SECONDS = 2
+
+MODES = {
+    # SQLite's defaults, as before the pragmas were configured.
+    "rollback journal": {
+        "SQLITE_JOURNAL_MODE": "DELETE",
+        "SQLITE_SYNCHRONOUS": "FULL",
+    },
+    "WAL": {
+        "SQLITE_JOURNAL_MODE": "WAL",
+        "SQLITE_SYNCHRONOUS": "NORMAL",
+    },
+    "WAL + replica": {
+        "SQLITE_JOURNAL_MODE": "WAL",
+        "SQLITE_SYNCHRONOUS": "NORMAL",
+        "DATABASE_REPLICA_URIS": "sqlite:///{replica_path}",
+    },
+}
+
+
+def _create_app(database_path, settings):
+    """Creates an app for the benchmark database with the given settings."""
+
+    # Reads would otherwise mostly be served from the cache.
+    return create_app(
+        benchmark_config(
+            f"sqlite:///{database_path}", RESPONSE_CACHE_SIZE="0", **settings
+        )
+    )
+
+
+def _percentile(values, percent):
+    """Gets a percentile of a sorted list of values."""
+
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def _reader(database_path, settings, start, end, seed, results):
+    """Reads a random device's observations for a day until the time is up,
+    then reports the latency of each read."""
+
+    client = _create_app(database_path, settings).test_client()
+    headers = auth_headers()
+    rng = random.Random(seed)
+    latencies, errors = [], 0
+
+    time.sleep(max(0, start - time.time()))
+    while time.time() < end:
+        day = datetime.datetime(2024, 1, 1) + datetime.timedelta(
+            days=rng.randrange(365)
+        )
+        response, seconds = timed(
+            client.get,
+            "/observations",
+            query_string={
+                "device_id": rng.randint(1, 10),
+                "observed_from": day.isoformat(),
+                "observed_to": (day + datetime.timedelta(days=1)).isoformat(),
+            },
+            headers=headers,
+        )
+
+        if response.status_code == 200:
+            latencies.append(seconds * 1000)
+        else:
+            errors += 1
+
+    results.put(("read", latencies, errors))
+
+
+def _writer(database_path, settings, start, end, index, results):
+    """Bulk inserts batches of new observations until the time is up, then
+    reports the number of rows written."""
+
+    client = _create_app(database_path, settings).test_client()
+    headers = auth_headers()
+    rows, errors = 0, 0
+
+    # Each writer's batches start in a different year, after the seeded
+    # observations, so that none of them are skipped as duplicates.
+    batch_start = datetime.datetime(2030 + index, 1, 1)
+
+    time.sleep(max(0, start - time.time()))
+    while time.time() < end:
+        batch = make_observations(WRITE_BATCH_SIZE, 10, batch_start)
+        batch_start += datetime.timedelta(minutes=WRITE_BATCH_SIZE)
+        response = client.post(
+            "/observations/create-many",
+            json=batch,
+            query_string={"mode": "bulk"},
+            headers=headers,
+        )
+
+        if response.status_code == 201:
+            rows += len(batch)
+        else:
+            errors += 1
+
+    results.put(("write", rows, errors))
+
+
+def run(readers=4, writers=1, seconds=10):
+    """Runs reader and writer processes against a seeded database in each
+    mode and prints the throughput and read latency.
+
+    Args:
+        readers (int): The number of processes reading observations.
+        writers (int): The number of processes writing observations.
+        seconds (int): How long to run each mode for.
+    """
+
+    print(
+        f"{'mode':>16}{'reads/s':>10}{'p50 ms':>9}{'p99 ms':>9}"
+        f"{'rows written/s':>16}{'errors':>8}"
+    )
+
+    for mode, settings in MODES.items():
+        with tempfile.TemporaryDirectory() as directory:
+            database_path = os.path.join(directory, "bench.db")
+            replica_path = os.path.join(directory, "replica.db")
+            settings = {
+                name: value.format(replica_path=replica_path)
+                for name, value in settings.items()
+            }
+            seed_data(
+                10, 100000, target_app=_create_app(database_path, settings)
+            )
+
+            # The backup includes anything not yet checkpointed from the WAL.
+            if "DATABASE_REPLICA_URIS" in settings:
+                primary = sqlite3.connect(database_path)
+                replica = sqlite3.connect(replica_path)
+                primary.backup(replica)
+                replica.close()
+                primary.close()
+
+            start = time.time() + STARTUP_SECONDS
+            end = start + seconds
+            results = multiprocessing.Queue()
+            processes = [
+                multiprocessing.Process(
+                    target=_reader,
+                    args=(database_path, settings, start, end, i, results),
+                )
+                for i in range(readers)
+            ] + [
+                multiprocessing.Process(
+                    target=_writer,
+                    args=(database_path, settings, start, end, i, results),
+                )
+                for i in range(writers)
+            ]
+            for process in processes:
+                process.start()
+
+            latencies, rows, errors = [], 0, 0
+            for _ in processes:
+                kind, values, process_errors = results.get()
+                errors += process_errors
+                if kind == "read":
+                    latencies.extend(values)
+                else:
+                    rows += values
+
+            for process in processes:
+                process.join()
+
+            latencies.sort()
+            print(
+                f"{mode:>16}{len(latencies) / seconds:>10.0f}"
+                f"{_percentile(latencies, 50):>9.1f}"
+                f"{_percentile(latencies, 99):>9.1f}"
+                f"{rows / seconds:>16.0f}{errors:>8}"
+            )
+
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:]))
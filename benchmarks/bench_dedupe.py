@@ -0,0 +1,98 @@
+"""Measures the cost of deduplicating bulk uploads. New observations are
+uploaded with keys ruled out by the recent keys filter, as normal, and with
+every key looked up in the database, as without the filter. The same batches
+are then uploaded again, so that every row is a duplicate.
+
+Usage:
+    python benchmarks/bench_dedupe.py [batch size] [batches]
+"""
+
+import os
+import sys
+import tempfile
+from functools import partial
+from unittest import mock
+
+from common import (
+    auth_headers,
+    create_benchmark_app,
+    make_observations,
+    reset_database,
+    timed,
+)
+
+import ingest
+
+
+def _upload(client, batches):
+    """Uploads each batch in bulk mode and returns the rows per second, along
+    with the total accepted and duplicate rows."""
+
+    headers = auth_headers()
+    elapsed, accepted, duplicates = 0, 0, 0
+
+    for batch in batches:
+        response, seconds = timed(
+            client.post,
+            "/observations/create-many",
+            json=batch,
+            query_string={"mode": "bulk"},
+            headers=headers,
+        )
+        assert response.status_code == 201, response.text
+        elapsed += seconds
+        accepted += response.json["accepted"]
+        duplicates += response.json["duplicates"]
+
+    return sum(len(batch) for batch in batches) / elapsed, accepted, duplicates
+
+
+def _print_result(name, rows_per_second, accepted, duplicates):
+    """Prints the results of a case as a row of the table."""
+
+    print(f"{name:>24}{rows_per_second:>10.0f}{accepted:>10}{duplicates:>12}")
+
+
+def run(batch_size=5000, batches=5):
+    """Uploads batches of new and then repeated observations, and prints the
+    throughput of each.
+
+    Args:
+        batch_size (int): The number of observations in each request.
+        batches (int): The number of requests to time for each case.
+    """
+
+    observations = make_observations(batch_size * batches)
+    uploads = [
+        observations[start : start + batch_size]
+        for start in range(0, len(observations), batch_size)
+    ]
+
+    print(f"{'case':>24}{'rows/s':>10}{'accepted':>10}{'duplicates':>12}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_benchmark_app(
+            f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        )
+        client = app.test_client()
+
+        cases = (
+            ("new, filtered", ingest.find_duplicates),
+            (
+                "new, every key looked up",
+                partial(ingest.find_duplicates, check_all=True),
+            ),
+        )
+        for name, lookup in cases:
+            reset_database(app)
+            app.extensions.pop("recent_observation_keys", None)
+            with mock.patch("ingest.find_duplicates", lookup):
+                results = _upload(client, uploads)
+            _print_result(name, *results)
+
+        results = _upload(client, uploads)
+        _print_result("repeated", *results)
+
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:]))
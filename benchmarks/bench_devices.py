@@ -0,0 +1,103 @@
+"""Measures listing devices with their latest observations as the fleet
+grows, compared with looking up each device's latest observation with its own
+query.
+
+Usage:
+    python benchmarks/bench_devices.py [observations per device]
+"""
+
+import os
+import statistics
+import sys
+import tempfile
+
+from common import auth_headers, create_benchmark_app, timed
+
+from models import Device, Observation, db
+from utils.seed_data import seed_data
+
+FLEET_SIZES = (100, 1000, 10000)
+REPEATS = 10
+
+
+def _query_per_device():
+    """Lists every device, then queries each one's latest observation."""
+
+    devices = Device.query.order_by(Device.id).all()
+
+    return [
+        Observation.query.filter(Observation.device_id == device.id)
+        .order_by(Observation.observed_at_utc.desc(), Observation.id.desc())
+        .first()
+        for device in devices
+    ]
+
+
+def _list_all(client, headers):
+    """Pages through every device with its latest observation."""
+
+    cursor = None
+    while True:
+        query_string = {"embed": "latest_observation", "limit": 1000}
+        if cursor:
+            query_string["cursor"] = cursor
+
+        response = client.get(
+            "/devices", query_string=query_string, headers=headers
+        )
+        cursor = response.json["next_cursor"]
+
+        if cursor is None:
+            return
+
+
+def run(observations_per_device=10):
+    """Seeds fleets of increasing size and prints the time to fetch a page of
+    devices and to list the whole fleet.
+
+    Args:
+        observations_per_device (int): The number of observations to seed for
+            each device.
+    """
+
+    headers = auth_headers()
+
+    print(
+        f"{'devices':>8}{'page of 100 (ms)':>18}{'whole fleet (ms)':>18}"
+        f"{'query per device (ms)':>23}"
+    )
+
+    for size in FLEET_SIZES:
+        with tempfile.TemporaryDirectory() as directory:
+            app = create_benchmark_app(
+                f"sqlite:///{os.path.join(directory, 'bench.db')}",
+                RESPONSE_CACHE_SIZE="0",
+            )
+            seed_data(size, size * observations_per_device, target_app=app)
+            client = app.test_client()
+
+            page = statistics.median(
+                timed(
+                    client.get,
+                    "/devices",
+                    query_string={"embed": "latest_observation", "limit": 100},
+                    headers=headers,
+                )[1]
+                for _ in range(REPEATS)
+            )
+            fleet = timed(_list_all, client, headers)[1]
+
+            with app.app_context():
+                per_device = timed(_query_per_device)[1]
+
+            print(
+                f"{size:>8}{page * 1000:>18.2f}{fleet * 1000:>18.1f}"
+                f"{per_device * 1000:>23.1f}"
+            )
+
+            with app.app_context():
+                db.engine.dispose()
+
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,138 @@
+"""Compares query latency on the observation table with and without its
+secondary indexes.
+
+Usage:
+    python benchmarks/bench_indexes.py [rows] [devices]
+"""
+
+import datetime
+import os
+import statistics
+import sys
+import tempfile
+
+from common import timed
+from sqlalchemy import create_engine, insert, select
+
+from models import Observation, db
+
+QUERY_REPEATS = 20
+INSERT_CHUNK_SIZE = 50000
+
+
+def _rows(count, num_devices):
+    """Generates observations spread over a year across the given devices."""
+
+    start = datetime.datetime(2024, 1, 1)
+    step = datetime.timedelta(days=365) / count
+
+    for i in range(count):
+        observed_at = start + step * i
+        yield {
+            "date_logged": observed_at.date(),
+            "time_logged": observed_at.time(),
+            "time_zone_offset": "+00:00",
+            "latitude": 51.5,
+            "longitude": -0.1,
+            "water_temp": i % 30,
+            "air_temp": i % 40,
+            "wind_speed": i % 100,
+            "wind_direction": i % 360,
+            "humidity": i % 100,
+            "haze_percent": i % 100,
+            "precipitation_mm": i % 10,
+            "radiation_bq": i % 50,
+            "device_id": i % num_devices + 1,
+            "observed_at_utc": observed_at,
+        }
+
+
+def _seed(engine, count, num_devices):
+    """Creates the schema without indexes and inserts the observations."""
+
+    db.metadata.create_all(engine)
+    table = Observation.__table__
+
+    for index in table.indexes:
+        index.drop(engine)
+
+    rows = _rows(count, num_devices)
+    with engine.begin() as connection:
+        while chunk := [row for _, row in zip(range(INSERT_CHUNK_SIZE), rows)]:
+            connection.execute(insert(table), chunk)
+
+
+def _queries(num_devices):
+    """Builds the queries to time, mirroring those built by get_observations."""
+
+    table = Observation.__table__
+    day = datetime.datetime(2024, 6, 1)
+
+    return {
+        "device + UTC range": select(table).where(
+            table.c.device_id == num_devices // 2,
+            table.c.observed_at_utc >= day,
+            table.c.observed_at_utc < day + datetime.timedelta(days=7),
+        ),
+        "UTC range (1 hour)": select(table).where(
+            table.c.observed_at_utc >= day,
+            table.c.observed_at_utc < day + datetime.timedelta(hours=1),
+        ),
+        "date range page": select(table)
+        .where(
+            table.c.date_logged >= day.date(),
+            table.c.date_logged <= (day + datetime.timedelta(days=1)).date(),
+        )
+        .order_by(table.c.date_logged, table.c.time_logged, table.c.id)
+        .limit(100),
+    }
+
+
+def _time_queries(engine, queries):
+    """Returns the median latency in milliseconds of each query."""
+
+    results = {}
+
+    with engine.connect() as connection:
+        for name, query in queries.items():
+            timings = [
+                timed(lambda: connection.execute(query).all())[1]
+                for _ in range(QUERY_REPEATS)
+            ]
+            results[name] = statistics.median(timings) * 1000
+
+    return results
+
+
+def run(count=1_000_000, num_devices=1000):
+    """Seeds a database and prints scan versus index seek latency.
+
+    Args:
+        count (int): The number of observations to insert.
+        num_devices (int): The number of devices to spread them across.
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(
+            f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        )
+
+        _, seconds = timed(_seed, engine, count, num_devices)
+        print(f"Seeded {count} observations in {seconds:.1f}s")
+
+        queries = _queries(num_devices)
+        scan = _time_queries(engine, queries)
+
+        for index in Observation.__table__.indexes:
+            index.create(engine)
+        seek = _time_queries(engine, queries)
+
+        print(f"{'query':<20}{'scan (ms)':>12}{'index (ms)':>12}")
+        for name in queries:
+            print(f"{name:<20}{scan[name]:>12.2f}{seek[name]:>12.2f}")
+
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:]))
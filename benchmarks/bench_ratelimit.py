@@ -0,0 +1,44 @@
+"""Measures the overhead the rate limiter adds to each request with each
+backend, by timing calls to take a token from many users' buckets.
+
+Usage:
+    python benchmarks/bench_ratelimit.py [calls] [users]
+"""
+
+import os
+import sys
+import tempfile
+
+from common import timed
+
+from ratelimit import MemoryBackend, SQLiteBackend
+
+
+def _take_tokens(backend, calls, users):
+    """Takes a token from each user's bucket in turn."""
+
+    for i in range(calls):
+        backend.take(f"read:user{i % users}", 1000000, 1000000)
+
+
+def run(calls=20000, users=100):
+    """Times taking tokens with each backend and prints the cost of each.
+
+    Args:
+        calls (int): The number of tokens to take.
+        users (int): The number of buckets to take them from.
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        backends = {
+            "memory": MemoryBackend(),
+            "sqlite": SQLiteBackend(os.path.join(directory, "limits.db"), 5),
+        }
+
+        for name, backend in backends.items():
+            _, seconds = timed(_take_tokens, backend, calls, users)
+            print(f"{name:>8}: {seconds / calls * 1e6:>8.1f} us per request")
+
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,324 @@
+"""Load-tests every API route against a seeded database and writes the
+latencies as JSON, so that results can be compared between commits.
+
+Usage:
+    python benchmarks/bench_routes.py [--observations N] [--devices N]
+        [--repeats N] [--database URI] [--output PATH]
+"""
+
+import argparse
+import base64
+import datetime
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+
+from common import auth_headers, create_benchmark_app, make_observations, timed
+
+from config import config
+from ingest_queue import get_ingest_queue
+from models import db
+from utils.seed_data import seed_data
+
+
+def _login_headers():
+    """Builds basic auth headers for the configured website user."""
+
+    credentials = f"{config.website_user}:{config.website_password}"
+    encoded = base64.b64encode(credentials.encode()).decode()
+
+    return {"Authorization": f"Basic {encoded}"}
+
+
+def _new_observations(count, num_devices):
+    """Builds a function returning observations that haven't been created yet
+    each time it's called, after the seeded ones, so that repeated creates
+    aren't skipped as duplicates."""
+
+    batches = itertools.count()
+    start = datetime.datetime(2030, 1, 1)
+
+    return lambda: make_observations(
+        count,
+        num_devices,
+        start + datetime.timedelta(minutes=count * next(batches)),
+    )
+
+
+def _cases(num_devices):
+    """Builds the requests to time, as (name, method, path, options) tuples.
+
+    Reads are run at several selectivities, from a single device's readings
+    to a week of readings across every device.
+    """
+
+    new_observations = _new_observations(100, num_devices)
+    day = {"date_from": "2024-06-01", "date_to": "2024-06-01"}
+    week = {"date_from": "2024-06-01", "date_to": "2024-06-07"}
+
+    return [
+        ("login", "GET", "/login", {"headers": _login_headers()}),
+        (
+            "create device",
+            "POST",
+            "/devices",
+            {
+                "json": {
+                    "name": "Benchmark",
+                    "city": "London",
+                    "country": "United Kingdom",
+                    "status": "Online",
+                    "battery_level": 100,
+                }
+            },
+        ),
+        (
+            "create",
+            "POST",
+            "/observations",
+            {"json": lambda: new_observations()[0]},
+        ),
+        (
+            "create async",
+            "POST",
+            "/observations",
+            {
+                "json": lambda: new_observations()[0],
+                "query_string": {"mode": "async"},
+            },
+        ),
+        (
+            "create many (100)",
+            "POST",
+            "/observations/create-many",
+            {"json": new_observations},
+        ),
+        (
+            "create many bulk (100)",
+            "POST",
+            "/observations/create-many",
+            {"json": new_observations, "query_string": {"mode": "bulk"}},
+        ),
+        (
+            "read device + day",
+            "GET",
+            "/observations",
+            {"query_string": {**day, "device_id": num_devices // 2 + 1}},
+        ),
+        ("read day", "GET", "/observations", {"query_string": day}),
+        ("read week", "GET", "/observations", {"query_string": week}),
+        (
+            "read week (3 fields)",
+            "GET",
+            "/observations",
+            {
+                "query_string": {
+                    **week,
+                    "fields": "date_logged,time_logged,air_temp",
+                }
+            },
+        ),
+        (
+            "read week humidity > 90",
+            "GET",
+            "/observations",
+            {"query_string": {**week, "min_humidity": 91}},
+        ),
+        (
+            "read page (100)",
+            "GET",
+            "/observations",
+            {"query_string": {"limit": 100}},
+        ),
+        (
+            "read bounding box",
+            "GET",
+            "/observations",
+            {
+                "query_string": {
+                    "min_latitude": 50,
+                    "max_latitude": 52,
+                    "min_longitude": -1,
+                    "max_longitude": 1,
+                }
+            },
+        ),
+        (
+            "read near (250 km)",
+            "GET",
+            "/observations",
+            {"query_string": {"near": "51.5,-0.1", "radius_km": 250}},
+        ),
+        (
+            "export day (ndjson)",
+            "GET",
+            "/observations/export",
+            {"query_string": {**day, "format": "ndjson"}},
+        ),
+        (
+            "aggregate daily",
+            "GET",
+            "/observations/aggregate",
+            {"query_string": {"bucket": "day"}},
+        ),
+        (
+            "aggregate daily (rollups)",
+            "GET",
+            "/observations/aggregate",
+            {
+                "query_string": {
+                    "bucket": "day",
+                    "observed_from": "2024-01-01T00:00:00",
+                }
+            },
+        ),
+        (
+            "series (1,000 points)",
+            "GET",
+            "/observations/series",
+            {"query_string": {"device_id": 1, "metric": "air_temp"}},
+        ),
+    ]
+
+
+def _git_commit():
+    """Gets the commit being benchmarked, if run from a git checkout."""
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _time_case(client, method, path, options, repeats):
+    """Times repeated requests and summarises their latencies.
+
+    A callable json option is called for a new body before each request.
+    """
+
+    headers = {**auth_headers(), **options.get("headers", {})}
+    kwargs = {**options, "headers": headers}
+    body_factory = (
+        options.get("json") if callable(options.get("json")) else None
+    )
+
+    # Warm up connections and caches of compiled statements first.
+    if body_factory:
+        kwargs["json"] = body_factory()
+    response = client.open(path, method=method, **kwargs)
+
+    timings = []
+    for _ in range(repeats):
+        if body_factory:
+            kwargs["json"] = body_factory()
+        # Read the whole body, so that streamed responses are timed in full.
+        body, seconds = timed(
+            lambda: client.open(path, method=method, **kwargs).get_data()
+        )
+        timings.append(seconds * 1000)
+
+    timings.sort()
+
+    return {
+        "status": response.status_code,
+        "bytes": len(body),
+        "median_ms": statistics.median(timings),
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "min_ms": timings[0],
+        "max_ms": timings[-1],
+    }
+
+
+def run(num_observations, num_devices, repeats, database_uri, output):
+    """Seeds the database, times every case and writes the results.
+
+    Args:
+        num_observations (int): The number of observations to seed.
+        num_devices (int): The number of devices to seed.
+        repeats (int): The number of times each request is timed.
+        database_uri (str): The database to benchmark against, which is
+            seeded from scratch.
+        output (str): The path the JSON results are written to.
+    """
+
+    # Responses would otherwise be served from the cache after the first
+    # request, which would only measure the cache.
+    app = create_benchmark_app(database_uri, RESPONSE_CACHE_SIZE="0")
+
+    with app.app_context():
+        db.drop_all()
+
+    _, seconds = timed(seed_data, num_devices, num_observations, target_app=app)
+    print(f"Seeded {num_observations} observations in {seconds:.1f}s")
+
+    client = app.test_client()
+    results = []
+
+    print(f"{'route':<28}{'status':>7}{'median ms':>11}{'p95 ms':>10}")
+    for name, method, path, options in _cases(num_devices):
+        result = {
+            "name": name,
+            "method": method,
+            "path": path,
+            **_time_case(client, method, path, options, repeats),
+        }
+        results.append(result)
+        print(
+            f"{name:<28}{result['status']:>7}"
+            f"{result['median_ms']:>11.2f}{result['p95_ms']:>10.2f}"
+        )
+
+    with app.app_context():
+        get_ingest_queue().shutdown()
+
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(
+            {
+                "commit": _git_commit(),
+                "timestamp": datetime.datetime.now(
+                    datetime.timezone.utc
+                ).isoformat(),
+                "python": platform.python_version(),
+                "database": app.config["SQLALCHEMY_DATABASE_URI"].split(":")[0],
+                "observations": num_observations,
+                "devices": num_devices,
+                "repeats": repeats,
+                "results": results,
+            },
+            file,
+            indent=2,
+        )
+
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--observations", type=int, default=1_000_000)
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument(
+        "--database",
+        help="SQLAlchemy URI of a scratch database, which will be wiped. "
+        "Defaults to a temporary SQLite database.",
+    )
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        run(
+            args.observations,
+            args.devices,
+            args.repeats,
+            args.database or f"sqlite:///{os.path.join(directory, 'bench.db')}",
+            args.output,
+        )
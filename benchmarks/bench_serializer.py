@@ -0,0 +1,84 @@
+"""Compares building a full observations response through ObservationSchema
+and through the precompiled row serialiser.
+
+Usage:
+    python benchmarks/bench_serializer.py [rows...]
+"""
+
+import os
+import sys
+import tempfile
+
+from common import (
+    create_benchmark_app,
+    make_observations,
+    reset_database,
+    timed,
+)
+from flask import jsonify
+
+from ingest import insert_rows, validate_rows
+from models import Observation, db
+from schemas import ObservationSchema
+from serializers import observation_serializer
+
+
+def schema_response():
+    """Loads every observation as an ORM object and dumps it with the
+    schema."""
+
+    observations = Observation.query.all()
+
+    return jsonify(ObservationSchema(many=True).dump(observations))
+
+
+def serializer_response():
+    """Selects only the serialised columns and dumps them with the compiled
+    serialiser."""
+
+    serializer = observation_serializer()
+    rows = Observation.query.with_entities(*serializer.columns).all()
+
+    return jsonify(serializer.dump(rows))
+
+
+def run(*sizes):
+    """Times building the response for each number of rows and prints the
+    results.
+
+    Args:
+        sizes (int): The numbers of rows to benchmark with.
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_benchmark_app(
+            f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        )
+
+        for size in sizes or (10000, 100000):
+            reset_database(app)
+
+            with app.app_context():
+                rows, _ = validate_rows(make_observations(size))
+                insert_rows(rows)
+                db.session.commit()
+
+                results = {}
+                for mode, build in (
+                    ("schema", schema_response),
+                    ("fast", serializer_response),
+                ):
+                    response, seconds = timed(build)
+                    results[mode] = response.get_data()
+                    print(
+                        f"{size:>7} rows {mode:>7}: {seconds * 1000:>8.1f} ms"
+                    )
+
+                    # Drop the loaded objects so both modes start cold.
+                    db.session.expunge_all()
+
+                assert results["schema"] == results["fast"]
+
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,88 @@
+"""Measures fetching a device's series of one metric downsampled for a chart,
+compared with fetching every raw observation for the device.
+
+Usage:
+    python benchmarks/bench_series.py [points]
+"""
+
+import os
+import statistics
+import sys
+import tempfile
+
+from common import auth_headers, create_benchmark_app, timed
+
+from downsample import lttb
+from models import db
+from utils.seed_data import seed_data
+
+SERIES_SIZES = (10000, 100000, 1000000)
+REPEATS = 3
+
+
+def run(points=1000):
+    """Seeds a single device with series of increasing length and prints the
+    time to fetch each one downsampled and raw, along with the response
+    sizes.
+
+    Args:
+        points (int): The number of points to downsample each series to.
+    """
+
+    headers = auth_headers()
+
+    # The downsampling alone, without reading from the database.
+    series = [(x, (x * 7919) % 1000) for x in range(max(SERIES_SIZES))]
+    seconds = timed(list, lttb(iter(series), len(series), points))[1]
+    print(f"LTTB of {len(series)} points in memory: {seconds * 1000:.0f} ms\n")
+
+    print(
+        f"{'points':>9}{'series (ms)':>13}{'series (KB)':>13}"
+        f"{'raw (ms)':>11}{'raw (KB)':>11}"
+    )
+
+    for size in SERIES_SIZES:
+        with tempfile.TemporaryDirectory() as directory:
+            app = create_benchmark_app(
+                f"sqlite:///{os.path.join(directory, 'bench.db')}",
+                RESPONSE_CACHE_SIZE="0",
+            )
+            seed_data(1, size, target_app=app)
+            client = app.test_client()
+
+            query_string = {
+                "device_id": 1,
+                "metric": "air_temp",
+                "points": points,
+            }
+            timings = [
+                timed(
+                    client.get,
+                    "/observations/series",
+                    query_string=query_string,
+                    headers=headers,
+                )
+                for _ in range(REPEATS)
+            ]
+            series_seconds = statistics.median(t[1] for t in timings)
+            series_size = len(timings[0][0].data)
+
+            raw, raw_seconds = timed(
+                client.get,
+                "/observations",
+                query_string={"device_id": 1},
+                headers=headers,
+            )
+
+            print(
+                f"{size:>9}{series_seconds * 1000:>13.1f}"
+                f"{series_size / 1024:>13.1f}{raw_seconds * 1000:>11.0f}"
+                f"{len(raw.data) / 1024:>11.0f}"
+            )
+
+            with app.app_context():
+                db.engine.dispose()
+
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,99 @@
+"""Compares estimating percentiles from the stored sketches with computing
+them exactly by sorting the raw observations, over every device and day.
+
+Usage:
+    python benchmarks/bench_stats.py [observations] [devices]
+"""
+
+import os
+import sys
+import tempfile
+
+from common import (
+    auth_headers,
+    create_benchmark_app,
+    make_observations,
+    reset_database,
+    timed,
+)
+
+from models import Observation, db
+from sketches import DEFAULT_PERCENTILES, SKETCH_METRICS
+
+BATCH_SIZE = 5000
+
+
+def _exact_percentiles():
+    """Reads every sketched metric of every observation and sorts them to get
+    the exact default percentiles."""
+
+    results = {}
+
+    for metric in SKETCH_METRICS:
+        values = sorted(
+            value for (value,) in db.session.query(getattr(Observation, metric))
+        )
+        results[metric] = [
+            values[min(len(values) - 1, int(p / 100 * len(values)))]
+            for p in DEFAULT_PERCENTILES
+        ]
+
+    return results
+
+
+def run(count=200000, num_devices=20):
+    """Uploads observations spread across devices and days, then times the
+    stats endpoint against an exact computation.
+
+    Args:
+        count (int): The number of observations to upload.
+        num_devices (int): The number of devices to spread them across.
+    """
+
+    observations = make_observations(count, num_devices)
+    headers = auth_headers()
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_benchmark_app(
+            f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        )
+        reset_database(app, num_devices)
+        client = app.test_client()
+
+        for start in range(0, count, BATCH_SIZE):
+            response = client.post(
+                "/observations/create-many",
+                json=observations[start : start + BATCH_SIZE],
+                query_string={"mode": "bulk"},
+                headers=headers,
+            )
+            assert response.status_code == 201, response.text
+
+        estimates = None
+        for group_by in ("", "device_id", "device_id,day"):
+            response, seconds = timed(
+                client.get,
+                "/observations/stats",
+                query_string={"group_by": group_by},
+                headers=headers,
+            )
+            assert response.status_code == 200, response.text
+            print(
+                f"sketches, group_by={group_by or '-':<14}"
+                f"{seconds * 1000:>10.1f} ms{len(response.json):>8} groups"
+            )
+            estimates = estimates or response.json[0]
+
+        with app.app_context():
+            exact, seconds = timed(_exact_percentiles)
+        print(f"{'exact, sorting every value':<33}{seconds * 1000:>10.1f} ms")
+
+        for metric in SKETCH_METRICS:
+            estimated = [
+                estimates[metric][f"p{p}"] for p in DEFAULT_PERCENTILES
+            ]
+            print(f"{metric}: estimated {estimated}, exact {exact[metric]}")
+
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:]))
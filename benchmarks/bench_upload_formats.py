@@ -0,0 +1,124 @@
+"""Measures the peak memory and throughput of bulk uploads in each format as
+the upload grows. JSON arrays are loaded whole, while CSV, NDJSON and
+MessagePack uploads are streamed, so their peak memory should stay flat.
+
+Usage:
+    python benchmarks/bench_upload_formats.py [rows] [rows] ...
+"""
+
+import csv
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+
+import msgpack
+from common import (
+    auth_headers,
+    create_benchmark_app,
+    make_observations,
+    reset_database,
+    timed,
+)
+
+DEFAULT_ROWS = (25000, 100000)
+
+
+def _write_json(path, observations):
+    """Writes observations to a file as a JSON array."""
+
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(observations, file)
+
+
+def _write_csv(path, observations):
+    """Writes observations to a file as CSV with a header row."""
+
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=list(observations[0]))
+        writer.writeheader()
+        writer.writerows(observations)
+
+
+def _write_ndjson(path, observations):
+    """Writes observations to a file as NDJSON."""
+
+    with open(path, "w", encoding="utf-8") as file:
+        for observation in observations:
+            file.write(json.dumps(observation) + "\n")
+
+
+def _write_msgpack(path, observations):
+    """Writes observations to a file as consecutive MessagePack maps."""
+
+    with open(path, "wb") as file:
+        for observation in observations:
+            file.write(msgpack.packb(observation))
+
+
+FORMATS = {
+    "json": ("application/json", _write_json),
+    "csv": ("text/csv", _write_csv),
+    "ndjson": ("application/x-ndjson", _write_ndjson),
+    "msgpack": ("application/msgpack", _write_msgpack),
+}
+
+
+def run(*row_counts):
+    """Uploads files of each size in each format and prints the peak memory
+    allocated while handling the request and the rows inserted per second.
+
+    Args:
+        *row_counts (int): The number of observations in each upload.
+    """
+
+    headers = auth_headers()
+
+    print(
+        f"{'rows':>8}{'format':>9}{'upload (MB)':>13}"
+        f"{'peak memory (MB)':>18}{'rows/s':>10}"
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_benchmark_app(
+            f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        )
+        client = app.test_client()
+
+        for rows in row_counts or DEFAULT_ROWS:
+            observations = make_observations(rows)
+
+            for name, (content_type, write) in FORMATS.items():
+                path = os.path.join(directory, f"upload.{name}")
+                write(path, observations)
+                reset_database(app)
+
+                # The file is passed as the request stream, so the upload
+                # isn't held in memory before the route reads it.
+                with open(path, "rb") as upload:
+                    tracemalloc.start()
+                    response, seconds = timed(
+                        client.post,
+                        "/observations/create-many",
+                        query_string={"mode": "bulk"},
+                        input_stream=upload,
+                        content_length=os.path.getsize(path),
+                        content_type=content_type,
+                        headers=headers,
+                    )
+                    _, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+
+                assert response.status_code == 201, response.text
+                assert response.json["accepted"] == rows
+
+                print(
+                    f"{rows:>8}{name:>9}"
+                    f"{os.path.getsize(path) / 1e6:>13.1f}"
+                    f"{peak / 1e6:>18.1f}{rows / seconds:>10.0f}"
+                )
+
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,154 @@
+"""Shared helpers for the benchmark scripts."""
+
+import datetime
+import os
+import sys
+import time
+
+import jwt
+from flask import Flask
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import app as _app  # noqa: F401 - imported first to resolve circular imports
+from config import Config, config
+from models import Device, db
+from routes import api
+
+# The benchmarks time the routes themselves, so they aren't rate limited and
+# any number of queries can run at once.
+BENCHMARK_SETTINGS = {
+    "SQLALCHEMY_ECHO": "False",
+    "RATE_LIMIT_READ_PER_SECOND": "0",
+    "RATE_LIMIT_WRITE_PER_SECOND": "0",
+    "MAX_CONCURRENT_QUERIES": "0",
+}
+
+
+def benchmark_config(database_uri, **settings):
+    """Builds the configuration for a benchmark app.
+
+    Args:
+        database_uri (str): The SQLAlchemy database URI to benchmark against.
+        settings: Settings that take precedence over the benchmark defaults
+            and .env, keyed by the name of the environment variable.
+
+    Returns:
+        Config: The configuration.
+    """
+
+    return Config(
+        **BENCHMARK_SETTINGS,
+        SQLALCHEMY_DATABASE_URI=database_uri,
+        **settings,
+    )
+
+
+def create_benchmark_app(database_uri, **settings):
+    """Creates a Flask app with the API registered against the given database.
+
+    Args:
+        database_uri (str): The SQLAlchemy database URI to benchmark against.
+        settings: Settings that take precedence over the benchmark defaults
+            and .env, keyed by the name of the environment variable, e.g.
+            RESPONSE_CACHE_SIZE="0" to disable the response cache.
+
+    Returns:
+        Flask: The configured app.
+    """
+
+    app = Flask(__name__)
+    app.extensions["config"] = benchmark_config(database_uri, **settings)
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_uri
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.json.sort_keys = False
+    db.init_app(app)
+    app.register_blueprint(api)
+
+    return app
+
+
+def reset_database(app, num_devices=1):
+    """Drops and recreates all tables and adds some devices.
+
+    Args:
+        app (Flask): The benchmark app.
+        num_devices (int): The number of devices to create.
+    """
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add_all(
+            Device(
+                name=f"Device {i+1}",
+                city="London",
+                country="United Kingdom",
+                status="Online",
+                battery_level=100,
+            )
+            for i in range(num_devices)
+        )
+        db.session.commit()
+
+
+def auth_headers():
+    """Builds request headers with a valid JWT for the configured secret."""
+
+    token = jwt.encode(
+        {
+            "user": config.website_user,
+            "exp": datetime.datetime.now(datetime.timezone.utc)
+            + datetime.timedelta(hours=1),
+        },
+        config.secret_key,
+    )
+
+    return {"Authorization": f"Bearer {token}"}
+
+
+def make_observations(
+    count, num_devices=1, start=datetime.datetime(2024, 1, 1)
+):
+    """Builds a list of valid observation request bodies, a minute apart.
+
+    Args:
+        count (int): The number of observations to build.
+        num_devices (int): The number of devices to spread them across.
+        start (datetime, optional): The time of the first observation.
+
+    Returns:
+        list: The observation dictionaries.
+    """
+
+    return [
+        {
+            "date_logged": (start + datetime.timedelta(minutes=i))
+            .date()
+            .isoformat(),
+            "time_logged": (start + datetime.timedelta(minutes=i))
+            .time()
+            .isoformat(),
+            "time_zone_offset": "+00:00",
+            "latitude": 51.5,
+            "longitude": -0.1,
+            "water_temp": 10 + i % 5,
+            "air_temp": 15 + i % 7,
+            "wind_speed": i % 40,
+            "wind_direction": i % 360,
+            "humidity": i % 100,
+            "haze_percent": i % 100,
+            "precipitation_mm": i % 10,
+            "radiation_bq": i % 20,
+            "device_id": i % num_devices + 1,
+        }
+        for i in range(count)
+    ]
+
+
+def timed(function, *args, **kwargs):
+    """Calls a function and returns its result and elapsed time in seconds."""
+
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+
+    return result, time.perf_counter() - start
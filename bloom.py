@@ -0,0 +1,93 @@
+"""In-process Bloom filters for cheaply ruling out that a key has been seen.
+
+A Bloom filter answers "definitely not seen" or "possibly seen" for a key
+using a fixed number of bits per key, with a tunable rate of false positives
+and no false negatives for the keys that were added.
+"""
+
+import math
+
+
+class BloomFilter:
+    """A fixed-size Bloom filter of hashable keys.
+
+    Keys are hashed with Python's hash(), so the filter is only meaningful
+    within the process that built it.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        """Sizes the filter.
+
+        Args:
+            capacity (int): The number of keys the filter is sized for.
+            error_rate (float, optional): The false positive rate once it
+                holds that many keys.
+        """
+
+        self.capacity = capacity
+        self.size = max(
+            8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        )
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        """Gets the bits set for a key, by double hashing."""
+
+        first = hash(key)
+        second = hash((key, self.size)) | 1
+        size = self.size
+
+        return [(first + i * second) % size for i in range(self.hash_count)]
+
+    def add(self, key):
+        """Adds a key to the filter."""
+
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+
+class RotatingBloomFilter:
+    """A Bloom filter of the most recently added keys.
+
+    Once the current filter has been filled to its capacity it becomes the
+    previous one, and keys are added to a new empty filter, so the false
+    positive rate stays bounded however many keys are added. Between one and
+    two capacities' worth of the latest keys are remembered.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        """Sizes the filters.
+
+        Args:
+            capacity (int): The number of keys in each generation.
+            error_rate (float, optional): The false positive rate of each
+                generation when full.
+        """
+
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._current = BloomFilter(capacity, error_rate)
+        self._previous = None
+
+    def add(self, key):
+        """Adds a key, starting a new generation if the current one is full."""
+
+        if self._current.count >= self.capacity:
+            self._previous = self._current
+            self._current = BloomFilter(self.capacity, self.error_rate)
+
+        self._current.add(key)
+
+    def __contains__(self, key):
+        return key in self._current or (
+            self._previous is not None and key in self._previous
+        )
@@ -0,0 +1,179 @@
+"""Caching of read responses, with ETags for conditional requests.
+
+Clients often poll the same query every few seconds. Responses are cached
+keyed on the normalised query parameters, so that a repeat request costs
+neither a database query nor serialisation, and carry an ETag so that a client
+that already holds the latest response gets an empty 304 instead.
+
+Every write bumps a generation counter, which invalidates all cached responses
+at once. The cache is held per process, so writes handled by another worker
+only become visible once entries expire after their time-to-live.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, make_response, request
+
+from config import get_config
+from replicas import client_wrote_recently
+
+# Guards creating the response cache for an app.
+_extension_lock = threading.Lock()
+
+
+class ResponseCache:
+    """A bounded, thread-safe LRU cache of response bodies."""
+
+    def __init__(self, max_size, ttl):
+        """Initialises the cache.
+
+        Args:
+            max_size (int): The maximum number of responses to cache. A size of
+                0 disables caching.
+            ttl (float): The number of seconds a response stays cached.
+        """
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Gets a cached response if it is still valid.
+
+        Args:
+            key (tuple): The cache key for the request.
+
+        Returns:
+            tuple: The response body, mimetype and ETag, or None if there is no
+            valid cached response.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return None
+
+            generation, expires_at, response = entry
+            if generation != self.generation or expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return response
+
+    def put(self, key, generation, response):
+        """Caches a response.
+
+        Args:
+            key (tuple): The cache key for the request.
+            generation (int): The generation when the response was built. If
+                there has been a write since, the response isn't cached.
+            response (tuple): The response body, mimetype and ETag.
+        """
+
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            if generation != self.generation:
+                return
+
+            expires_at = time.monotonic() + self.ttl
+            self._entries[key] = (generation, expires_at, response)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        """Invalidates every cached response, e.g. after a write."""
+
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+
+def get_response_cache():
+    """Gets the response cache for the current app, creating it if needed.
+
+    Returns:
+        ResponseCache: The app's response cache.
+    """
+
+    cache = current_app.extensions.get("response_cache")
+
+    # Checked again under the lock, so that concurrent first requests don't
+    # each create a cache, without locking every request once it exists.
+    if cache is None:
+        with _extension_lock:
+            cache = current_app.extensions.get("response_cache")
+
+            if cache is None:
+                app_config = get_config()
+                cache = current_app.extensions["response_cache"] = (
+                    ResponseCache(
+                        app_config.response_cache_size,
+                        app_config.response_cache_ttl,
+                    )
+                )
+
+    return cache
+
+
+def invalidate_responses():
+    """Invalidates all cached responses after data has been written."""
+
+    get_response_cache().invalidate()
+
+
+def _cache_key():
+    """Builds a cache key from the request path and its query parameters,
+    ignoring the order they were given in."""
+
+    return (request.path, tuple(sorted(request.args.items(multi=True))))
+
+
+def cached_response(f):
+    """Decorator to cache a route's successful responses and answer
+    conditional requests for them."""
+
+    @wraps(f)
+    def decorator(*args, **kwargs):
+        # A client that has just written reads from the primary, but cached
+        # responses may have been read from a lagging replica, so the cache
+        # is bypassed entirely.
+        if client_wrote_recently():
+            return f(*args, **kwargs)
+
+        cache = get_response_cache()
+        key = _cache_key()
+        cached = cache.get(key)
+
+        if cached is not None:
+            body, mimetype, etag = cached
+            response = current_app.response_class(body, mimetype=mimetype)
+        else:
+            # Note the generation before running the query, so a response
+            # built while a write was happening isn't cached.
+            generation = cache.generation
+            response = make_response(f(*args, **kwargs))
+
+            if response.status_code != 200:
+                return response
+
+            body = response.get_data()
+            etag = hashlib.sha1(body).hexdigest()
+            cache.put(key, generation, (body, response.mimetype, etag))
+
+        response.set_etag(etag)
+
+        return response.make_conditional(request)
+
+    return decorator
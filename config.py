@@ -1,23 +1,170 @@
 """Application-related configuration."""
 
 from dotenv import dotenv_values
+from flask import current_app, has_app_context
+
+
+def _flag(value):
+    """Parses a boolean setting, e.g. "True" or "false"."""
+
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
 
 
 class Config:
     """Configuration class to expose application configuration values."""
 
-    def __init__(self):
-        env_vars = dotenv_values(".env")
+    def __init__(self, env_file=".env", **overrides):
+        """Loads the configuration.
+
+        Args:
+            env_file (str, optional): The path of the file to load settings
+                from. Defaults to .env.
+            overrides: Settings that take precedence over those in the file,
+                keyed by the name of the environment variable.
+        """
+
+        env_vars = {**dotenv_values(env_file), **overrides}
 
         self.secret_key = env_vars["SECRET_KEY"]
         self.website_user = env_vars["WEBSITE_USER"]
         self.website_password = env_vars["WEBSITE_PASSWORD"]
         self.database_uri = env_vars["SQLALCHEMY_DATABASE_URI"]
-        self.database_echo = env_vars["SQLALCHEMY_ECHO"]
-        self.database_track_modifications = env_vars[
-            "SQLALCHEMY_TRACK_MODIFICATIONS"
+        self.database_echo = _flag(env_vars["SQLALCHEMY_ECHO"])
+        self.database_track_modifications = _flag(
+            env_vars["SQLALCHEMY_TRACK_MODIFICATIONS"]
+        )
+        # Connection pool settings, which don't apply to SQLite
+        self.database_pool_size = int(env_vars.get("DATABASE_POOL_SIZE", 10))
+        self.database_max_overflow = int(
+            env_vars.get("DATABASE_MAX_OVERFLOW", 20)
+        )
+        self.database_pool_timeout = float(
+            env_vars.get("DATABASE_POOL_TIMEOUT_SECONDS", 30)
+        )
+        self.database_pool_recycle = int(
+            env_vars.get("DATABASE_POOL_RECYCLE_SECONDS", 1800)
+        )
+        self.database_pool_pre_ping = _flag(
+            env_vars.get("DATABASE_POOL_PRE_PING", True)
+        )
+        # Read-only replicas of the database, as a comma-separated list of
+        # URIs, which GET requests are spread across
+        self.database_replica_uris = [
+            uri.strip()
+            for uri in env_vars.get("DATABASE_REPLICA_URIS", "").split(",")
+            if uri.strip()
         ]
+        # How long a client's reads go to the primary after it writes, so that
+        # it sees its own writes despite replication lag
+        self.read_your_writes_seconds = float(
+            env_vars.get("READ_YOUR_WRITES_SECONDS", 5)
+        )
+        # How often each replica is checked, and an ejected one retried
+        self.replica_health_check_seconds = float(
+            env_vars.get("REPLICA_HEALTH_CHECK_SECONDS", 10)
+        )
+        # SQLite connection settings
+        self.sqlite_journal_mode = env_vars.get("SQLITE_JOURNAL_MODE", "WAL")
+        self.sqlite_synchronous = env_vars.get("SQLITE_SYNCHRONOUS", "NORMAL")
+        self.sqlite_busy_timeout_ms = int(
+            env_vars.get("SQLITE_BUSY_TIMEOUT_MS", 5000)
+        )
         self.jwt_expiry_minutes = int(env_vars["JWT_EXPIRY_MINUTES"])
+        self.jwt_cache_size = int(env_vars.get("JWT_CACHE_SIZE", 10000))
+        self.response_cache_size = int(
+            env_vars.get("RESPONSE_CACHE_SIZE", 1000)
+        )
+        self.response_cache_ttl = float(
+            env_vars.get("RESPONSE_CACHE_TTL_SECONDS", 10)
+        )
+        self.ingest_queue_size = int(env_vars.get("INGEST_QUEUE_SIZE", 10000))
+        self.ingest_batch_size = int(env_vars.get("INGEST_BATCH_SIZE", 500))
+        self.ingest_flush_interval = float(
+            env_vars.get("INGEST_FLUSH_INTERVAL_SECONDS", 0.5)
+        )
+        self.ingest_enqueue_timeout = float(
+            env_vars.get("INGEST_ENQUEUE_TIMEOUT_SECONDS", 1)
+        )
+        # Requests taking at least this long are logged with their SQL, or 0
+        # to disable the slow request log
+        self.slow_request_ms = float(env_vars.get("SLOW_REQUEST_MS", 0))
+        # Months of observations older than this many whole months are moved
+        # into compressed files in the archive directory
+        self.archive_after_months = int(
+            env_vars.get("ARCHIVE_AFTER_MONTHS", 12)
+        )
+        self.archive_directory = env_vars.get("ARCHIVE_DIRECTORY", "archive")
+        # The number of recently ingested observation keys each worker
+        # remembers, so that only batches likely to hold duplicates need
+        # checking against the database
+        self.dedupe_filter_capacity = int(
+            env_vars.get("DEDUPE_FILTER_CAPACITY", 1000000)
+        )
+        # Token bucket limits on each user's read and write requests, as
+        # requests per second and the burst allowed, or a rate of 0 to
+        # disable them
+        self.rate_limit_read_rate = float(
+            env_vars.get("RATE_LIMIT_READ_PER_SECOND", 10)
+        )
+        self.rate_limit_read_burst = int(
+            env_vars.get("RATE_LIMIT_READ_BURST", 50)
+        )
+        self.rate_limit_write_rate = float(
+            env_vars.get("RATE_LIMIT_WRITE_PER_SECOND", 100)
+        )
+        self.rate_limit_write_burst = int(
+            env_vars.get("RATE_LIMIT_WRITE_BURST", 500)
+        )
+        # Where the limiter state is kept: "memory" for each worker to keep
+        # its own, or "sqlite" to share it between the workers on a host
+        # through the RATE_LIMIT_DATABASE file
+        self.rate_limit_backend = env_vars.get("RATE_LIMIT_BACKEND", "memory")
+        self.rate_limit_database = env_vars.get(
+            "RATE_LIMIT_DATABASE", "ratelimit.db"
+        )
+        # The most expensive queries run at once, beyond which they are
+        # refused, or 0 for no limit
+        self.max_concurrent_queries = int(
+            env_vars.get("MAX_CONCURRENT_QUERIES", 8)
+        )
+
+    def engine_options(self, database_uri=None):
+        """Builds the SQLAlchemy engine options for a database.
+
+        Args:
+            database_uri (str, optional): The URI of the database. Defaults to
+                the primary database.
+
+        Returns:
+            dict: Keyword arguments for create_engine.
+        """
+
+        if (database_uri or self.database_uri).startswith("sqlite"):
+            # SQLite connections are local files, so there's nothing to ping
+            # or recycle, and Flask-SQLAlchemy picks a suitable pool.
+            return {}
+
+        return {
+            "pool_size": self.database_pool_size,
+            "max_overflow": self.database_max_overflow,
+            "pool_timeout": self.database_pool_timeout,
+            "pool_recycle": self.database_pool_recycle,
+            "pool_pre_ping": self.database_pool_pre_ping,
+        }
 
 
 config = Config()
+
+
+def get_config():
+    """Gets the configuration of the current app.
+
+    Returns:
+        Config: The configuration the app was created with, or the one loaded
+        from .env outside an app or for an app created without one.
+    """
+
+    if has_app_context():
+        return current_app.extensions.get("config", config)
+
+    return config
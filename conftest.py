@@ -0,0 +1,126 @@
+"""Fixtures and helpers shared by the tests.
+
+The app fixture holds num_devices devices and caches responses unless
+cache_responses is False. A module changes either by overriding the fixture,
+and a single test by parametrizing it, e.g.
+@pytest.mark.parametrize("num_devices", [2]).
+"""
+
+import datetime
+
+import pytest
+from flask import Flask
+
+from app import api_blueprint as api
+from cache import ResponseCache
+from models import Device, Observation, db
+
+AUTH_HEADERS = {"Authorization": "Bearer valid_token"}
+
+
+def make_observation(**overrides):
+    """Builds valid observation request data, overriding any given fields."""
+
+    observation_data = {
+        "date_logged": "2024-01-01",
+        "time_logged": "12:00:00",
+        "time_zone_offset": "UTC+00:00",
+        "latitude": 10.0,
+        "longitude": 20.0,
+        "water_temp": 10,
+        "air_temp": 20,
+        "wind_speed": 7,
+        "wind_direction": 180,
+        "humidity": 10,
+        "haze_percent": 10,
+        "precipitation_mm": 0,
+        "radiation_bq": 5,
+        "device_id": 1,
+    }
+    observation_data.update(overrides)
+
+    return observation_data
+
+
+def make_observation_row(**overrides):
+    """Builds an observation to add to the database directly, with the same
+    defaults as make_observation, overriding any given fields."""
+
+    observation_data = make_observation()
+    observation_data["date_logged"] = datetime.date.fromisoformat(
+        observation_data["date_logged"]
+    )
+    observation_data["time_logged"] = datetime.time.fromisoformat(
+        observation_data["time_logged"]
+    )
+    observation_data.update(overrides)
+
+    return Observation(**observation_data)
+
+
+def make_device(number, **overrides):
+    """Builds a device named after its number, overriding any given
+    fields."""
+
+    device_data = {
+        "name": f"DV-{number:03d}",
+        "city": "London",
+        "country": "United Kingdom",
+        "status": "Online",
+        "battery_level": 50,
+    }
+    device_data.update(overrides)
+
+    return Device(**device_data)
+
+
+@pytest.fixture
+def num_devices():
+    """Fixture for the number of devices the app's database starts with."""
+
+    return 1
+
+
+@pytest.fixture
+def cache_responses():
+    """Fixture for whether the app caches responses."""
+
+    return True
+
+
+@pytest.fixture
+def app(mocker, num_devices, cache_responses):
+    """Fixture to set up an app backed by an in-memory SQLite database
+    holding num_devices devices, which accepts any bearer token."""
+
+    app = Flask(__name__)
+    app.register_blueprint(api)
+    app.config["TESTING"] = True
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+
+    if not cache_responses:
+        app.extensions["response_cache"] = ResponseCache(0, 0)
+
+    # Mock the JWT decode function to return a valid token - the value is not
+    # relevant for these tests.
+    mocker.patch("jwt.decode", return_value={"valid": "token"})
+
+    with app.app_context():
+        db.create_all()
+        db.session.add_all(
+            make_device(number) for number in range(1, num_devices + 1)
+        )
+        db.session.commit()
+
+        yield app
+
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def db_client(app):
+    """Fixture to set up an authenticated test client for the app."""
+
+    return app.test_client()
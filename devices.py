@@ -0,0 +1,111 @@
+"""Listing of devices along with their latest observations.
+
+Each device keeps a pointer to its most recent observation, which is updated
+whenever observations are inserted. A page of devices can then be read along
+with their latest observations in a single query joining on the pointer,
+rather than looking up the latest observation with a query per device, so the
+cost of a page doesn't grow with the size of the fleet.
+"""
+
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+
+from filters import DEVICE_FILTERS
+from models import Device, Observation, db
+
+
+def latest_observations_statement(device_ids=None):
+    """Builds a statement that points devices at their latest observations.
+
+    The latest observation of each device is found with a correlated subquery
+    that seeks to the end of the device's entries in the (device_id,
+    observed_at_utc) index.
+
+    Args:
+        device_ids (iterable, optional): The devices to update. Defaults to
+            every device.
+
+    Returns:
+        The UPDATE statement.
+    """
+
+    device = Device.__table__
+    observation = Observation.__table__
+
+    latest = (
+        select(observation.c.id)
+        .where(observation.c.device_id == device.c.id)
+        .order_by(observation.c.observed_at_utc.desc(), observation.c.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    statement = update(device).values(last_observation_id=latest)
+
+    if device_ids is not None:
+        statement = statement.where(device.c.id.in_(sorted(device_ids)))
+
+    return statement
+
+
+def update_latest_observations(device_ids, session=None):
+    """Updates the latest observation pointers of devices that have had
+    observations inserted.
+
+    This should be called in the same transaction that inserts the
+    observations, and the caller is responsible for committing the session.
+    Observations added through the ORM are handled automatically when the
+    session is flushed, so this only needs calling for Core inserts.
+
+    Args:
+        device_ids (iterable): The ids of the devices to update.
+        session (Session, optional): The session to use. Defaults to
+            db.session.
+    """
+
+    device_ids = set(device_ids)
+
+    if device_ids:
+        session = session or db.session
+        session.execute(latest_observations_statement(device_ids))
+
+
+@event.listens_for(Session, "after_flush")
+def _update_flushed_devices(session, flush_context):
+    """Updates the latest observation pointers of devices with observations
+    inserted through the ORM as part of the same flush."""
+
+    update_latest_observations(
+        (
+            instance.device_id
+            for instance in session.new
+            if isinstance(instance, Observation)
+        ),
+        session,
+    )
+
+
+def device_query(columns, filters, include_latest=False):
+    """Builds a query for devices, filtered by the given query string
+    parameters.
+
+    Args:
+        columns (list): The columns to select.
+        filters (dict): The device filters, parsed by DEVICE_FILTERS.
+        include_latest (bool, optional): Whether to join each device's latest
+            observation, so that observation columns can be selected. These
+            are None for devices without any observations.
+
+    Returns:
+        Query: The device query.
+    """
+
+    query = Device.query.with_entities(*columns)
+
+    if include_latest:
+        query = query.outerjoin(
+            Observation, Observation.id == Device.last_observation_id
+        )
+
+    query = DEVICE_FILTERS.apply(query, filters)
+
+    return query
@@ -0,0 +1,220 @@
+"""Downsampling of metric time series for charting.
+
+Series are reduced with the Largest-Triangle-Three-Buckets algorithm, which
+keeps the points that contribute most to the shape of the line, so peaks and
+troughs survive downsampling in a way they wouldn't with averaging.
+
+The implementation consumes points as a stream, holding only two buckets in
+memory at a time, so that rows can be read from a database cursor without
+loading the whole series.
+"""
+
+import heapq
+from bisect import bisect_left
+from datetime import datetime
+from operator import itemgetter
+
+from sqlalchemy import func
+
+from archive import query_month
+from models import Observation
+
+# The number of points returned when none is requested, and the most a client
+# is allowed to request.
+DEFAULT_SERIES_POINTS = 1000
+MAX_SERIES_POINTS = 10000
+
+# The number of rows fetched from the database cursor at a time.
+SERIES_BATCH_SIZE = 10000
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def epoch_seconds(timestamp):
+    """Converts a naive UTC datetime to seconds since the epoch."""
+
+    return (timestamp - EPOCH).total_seconds()
+
+
+def _buckets(points, count, threshold):
+    """Splits a stream of points into the buckets used by LTTB.
+
+    The first and last points are each given a bucket of their own, and the
+    points between them are divided into threshold - 2 buckets of roughly
+    equal size.
+
+    Args:
+        points (iterable): The points, ordered by x.
+        count (int): The number of points expected.
+        threshold (int): The number of buckets.
+
+    Yields:
+        list: The points in each bucket.
+    """
+
+    middle_count, bucket_count = count - 2, threshold - 2
+    iterator = iter(points)
+
+    first = next(iterator, None)
+    if first is None:
+        return
+    yield [first]
+
+    # The index among the middle points at which the next bucket starts,
+    # worked out in integers so that rounding can't add an extra bucket.
+    bucket = []
+    bucket_number = 0
+    boundary = middle_count // bucket_count
+    index = 0
+    previous = None
+
+    # Hold each point back until the next has been read, so that the final
+    # point can be recognised and kept out of the last middle bucket. Any
+    # points beyond the count, e.g. inserted since it was taken, go into the
+    # last middle bucket too.
+    for point in iterator:
+        if previous is not None:
+            while index >= boundary and bucket_number < bucket_count - 1:
+                bucket_number += 1
+                boundary = (bucket_number + 1) * middle_count // bucket_count
+                if bucket:
+                    yield bucket
+                    bucket = []
+
+            bucket.append(previous)
+            index += 1
+
+        previous = point
+
+    if bucket:
+        yield bucket
+    if previous is not None:
+        yield [previous]
+
+
+def lttb(points, count, threshold):
+    """Downsamples a series using Largest-Triangle-Three-Buckets.
+
+    Args:
+        points (iterable): (x, y, ...) tuples ordered by x. Any further items
+            in each tuple are passed through with the selected points.
+        count (int): The number of points in the series.
+        threshold (int): The number of points to reduce the series to, which
+            must be at least 3.
+
+    Yields:
+        tuple: The selected points, in order.
+    """
+
+    if count <= threshold:
+        yield from points
+        return
+
+    buckets = _buckets(points, count, threshold)
+
+    selected = next(buckets, [None])[0]
+    if selected is None:
+        return
+    yield selected
+
+    current = next(buckets, None)
+    if current is None:
+        return
+
+    for following in buckets:
+        # The triangle's third point is the average of the next bucket.
+        average_x = sum(point[0] for point in following) / len(following)
+        average_y = sum(point[1] for point in following) / len(following)
+        selected_x, selected_y = selected[0], selected[1]
+
+        selected = max(
+            current,
+            key=lambda point: abs(
+                (selected_x - average_x) * (point[1] - selected_y)
+                - (selected_x - point[0]) * (average_y - selected_y)
+            ),
+        )
+        yield selected
+
+        current = following
+
+    # The last bucket only holds the final point.
+    yield current[0]
+
+
+def archived_rows(statement, months):
+    """Runs a query ordered by UTC time against archived months, merging
+    their rows in order.
+
+    Archived months are partitioned by the local date logged, so only the
+    edges of neighbouring months can overlap in UTC. A month is loaded once
+    the rows of the month before it have been consumed, so only one month and
+    the edge of the one before it are held in memory at a time.
+
+    Args:
+        statement (Select): The query, selecting the UTC time first.
+        months (list): The archived months to include, ordered by month.
+
+    Yields:
+        The rows in order.
+    """
+
+    time = itemgetter(0)
+    earlier = []
+
+    for month in months:
+        rows = query_month(statement, month)
+        if not rows:
+            continue
+
+        # Rows before this month's first can't be overtaken by later months.
+        split = bisect_left(earlier, rows[0][0], key=time)
+        yield from earlier[:split]
+        earlier = list(heapq.merge(earlier[split:], rows, key=time))
+
+    yield from earlier
+
+
+def downsample_series(query, metric, threshold, months=()):
+    """Reads one metric of the observations matching a query and downsamples
+    it.
+
+    Only the timestamp and metric columns are selected, and rows are fetched
+    from the cursor in batches rather than all at once. Archived months are
+    counted first and then read one at a time.
+
+    Args:
+        query: The filtered Observation query.
+        metric (str): The name of the numeric field to read.
+        threshold (int): The number of points to reduce the series to.
+        months (list, optional): The archived months to include.
+
+    Returns:
+        list: [timestamp, value] pairs ordered by time, with timestamps as ISO
+        8601 strings in UTC.
+    """
+
+    count = query.with_entities(func.count()).scalar()
+    rows = (
+        query.with_entities(
+            Observation.observed_at_utc, getattr(Observation, metric)
+        )
+        .order_by(Observation.observed_at_utc, Observation.id)
+        .yield_per(SERIES_BATCH_SIZE)
+    )
+
+    if months:
+        count_statement = query.with_entities(func.count()).statement
+        count += sum(
+            query_month(count_statement, month)[0][0] for month in months
+        )
+        rows = heapq.merge(
+            archived_rows(rows.statement, months), rows, key=itemgetter(0)
+        )
+
+    points = ((epoch_seconds(time), value, time) for time, value in rows)
+
+    return [
+        [time.isoformat(), value]
+        for _, value, time in lttb(points, count, threshold)
+    ]
@@ -0,0 +1,122 @@
+"""Streaming serialisation of observations for bulk export."""
+
+import csv
+import io
+import json
+
+from archive import stream_all
+from pagination import KEYSET_ORDER, keyset_columns, keyset_key
+from serializers import observation_serializer
+
+# The number of rows fetched from the database cursor at a time, which is also
+# the number of rows written out in each chunk of the response.
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def _batches(query, serializer, months=()):
+    """Iterates over the results of a query in batches, without loading the
+    whole result set into memory.
+
+    Args:
+        query: The Observation query to run.
+        serializer (RowSerializer): The serialiser for the fields to export.
+        months (list, optional): The archived months to include.
+
+    Yields:
+        list: Lists of at most EXPORT_BATCH_SIZE serialised observations, the
+        first holding only the first observation.
+    """
+
+    dump_row = serializer.dump_row
+    batch = []
+
+    # yield_per streams rows from a server-side cursor rather than buffering
+    # every row before the first one is returned. The keyset columns are
+    # needed to merge in rows from the archive.
+    rows = (
+        query.with_entities(
+            *serializer.columns, *keyset_columns(serializer.field_names)
+        )
+        .order_by(*KEYSET_ORDER)
+        .yield_per(EXPORT_BATCH_SIZE)
+    )
+    rows = iter(stream_all(rows, months, keyset_key))
+
+    # Send the first row on its own so the client gets the first byte as soon
+    # as the query produces it, rather than once a whole batch is fetched.
+    first = next(rows, None)
+    if first is None:
+        return
+    yield [dump_row(first)]
+
+    for row in rows:
+        batch.append(dump_row(row))
+
+        if len(batch) == EXPORT_BATCH_SIZE:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def generate_ndjson(query, field_names=None, months=()):
+    """Streams observations as newline-delimited JSON.
+
+    Args:
+        query: The Observation query to run.
+        field_names (tuple, optional): The fields to export. Defaults to all
+            of ObservationSchema's fields.
+        months (list, optional): The archived months to include.
+
+    Yields:
+        str: Chunks of the response body, one JSON object per line.
+    """
+
+    serializer = observation_serializer(field_names)
+
+    for batch in _batches(query, serializer, months):
+        yield "".join(
+            json.dumps(observation, separators=(",", ":")) + "\n"
+            for observation in batch
+        )
+
+
+def generate_csv(query, field_names=None, months=()):
+    """Streams observations as CSV with a header row.
+
+    Args:
+        query: The Observation query to run.
+        field_names (tuple, optional): The fields to export, which are also
+            the CSV columns. Defaults to all of ObservationSchema's fields.
+        months (list, optional): The archived months to include.
+
+    Yields:
+        str: Chunks of the response body.
+    """
+
+    serializer = observation_serializer(field_names)
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=serializer.field_names)
+
+    # Send the header straight away so the client gets the first byte before
+    # the query has produced any rows.
+    writer.writeheader()
+    yield buffer.getvalue()
+
+    for batch in _batches(query, serializer, months):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(batch)
+        yield buffer.getvalue()
+
+
+EXPORT_GENERATORS = {
+    "ndjson": generate_ndjson,
+    "csv": generate_csv,
+}
@@ -0,0 +1,406 @@
+"""Declarative filtering of observation and device queries.
+
+Rather than each route reading and applying its own query string parameters,
+the filters for a model are derived once from its columns, with a parser and
+set of operators chosen by each column's type:
+
+    <column>=value          equal to the value
+    <column>__in=a,b,c      equal to one of the comma-separated values
+    min_<column>=value      at least the value
+    max_<column>=value      at most the value
+    <column>__gt=value      greater than the value
+    <column>__lt=value      less than the value
+
+Text columns only support equality and in. Values are validated strictly, and
+any parameter that is neither a filter nor one of the route's own parameters
+is rejected, so that a typo gives a Bad Request rather than silently matching
+everything.
+
+The predicates for each combination of filters are built once, with a named
+bound parameter per filter, and reused with the request's values bound in.
+Identical combinations therefore produce the same SQL, which SQLAlchemy's
+compiled statement cache and the database's prepared statement cache can both
+reuse.
+"""
+
+import math
+import operator
+import re
+from datetime import date, time
+from functools import lru_cache
+
+from sqlalchemy import (
+    Date,
+    DateTime,
+    Float,
+    Integer,
+    String,
+    Time,
+    and_,
+    bindparam,
+)
+
+from models import (
+    Device,
+    Observation,
+    ObservationSketch,
+    parse_utc_datetime,
+)
+from spatial import bounding_box_predicate, radius_predicate
+
+# The number of combinations of filters whose predicates are kept for reuse.
+COMPILED_FILTERS_CACHE_SIZE = 256
+
+INTEGER_PATTERN = re.compile(r"[+-]?\d+")
+NUMBER_PATTERN = re.compile(r"[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?")
+
+OPERATORS = {
+    "eq": operator.eq,
+    "in": lambda column, value: column.in_(value),
+    "min": operator.ge,
+    "max": operator.le,
+    "gt": operator.gt,
+    "lt": operator.lt,
+}
+ORDERED_OPERATORS = tuple(OPERATORS)
+TEXT_OPERATORS = ("eq", "in")
+
+
+class InvalidFilterError(ValueError):
+    """Raised when a filter in the query string is invalid."""
+
+
+def parse_integer(value):
+    """Parses a whole number, rejecting anything int() would only accept
+    leniently, such as surrounding whitespace or digit separators."""
+
+    if not INTEGER_PATTERN.fullmatch(value):
+        raise ValueError(f"Invalid integer: {value!r}")
+
+    return int(value)
+
+
+def parse_number(value):
+    """Parses a finite decimal number."""
+
+    if not NUMBER_PATTERN.fullmatch(value):
+        raise ValueError(f"Invalid number: {value!r}")
+
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"Number out of range: {value!r}")
+
+    return number
+
+
+def parse_positive_number(value):
+    """Parses a finite decimal number greater than zero."""
+
+    number = parse_number(value)
+    if number <= 0:
+        raise ValueError(f"Not a positive number: {value!r}")
+
+    return number
+
+
+def parse_location(value):
+    """Parses a location given as "latitude,longitude"."""
+
+    latitude, longitude = (parse_number(part) for part in value.split(","))
+
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError(f"Invalid location: {value!r}")
+
+    return latitude, longitude
+
+
+# The parser, description for error messages and operators for each column
+# type, most specific first.
+COLUMN_TYPES = (
+    (Integer, parse_integer, "an integer", ORDERED_OPERATORS),
+    (Float, parse_number, "a number", ORDERED_OPERATORS),
+    (
+        DateTime,
+        parse_utc_datetime,
+        "a date and time in ISO 8601 format",
+        ORDERED_OPERATORS,
+    ),
+    (Date, date.fromisoformat, "a date (YYYY-MM-DD)", ORDERED_OPERATORS),
+    (Time, time.fromisoformat, "a time (HH:MM:SS)", ORDERED_OPERATORS),
+    (String, str, "text", TEXT_OPERATORS),
+)
+
+
+def _parameter_name(column_name, operator_name):
+    """Gets the query string parameter for an operator on a column."""
+
+    if operator_name == "eq":
+        return column_name
+    if operator_name in ("min", "max"):
+        return f"{operator_name}_{column_name}"
+    return f"{column_name}__{operator_name}"
+
+
+class Filter:
+    """A query string parameter comparing a column with its value."""
+
+    def __init__(self, name, column, operator_name, parse, description):
+        """Initialises the filter.
+
+        Args:
+            name (str): The query string parameter.
+            column: The column to compare.
+            operator_name (str): The key of the comparison in OPERATORS.
+            parse (callable): Parses a single value from its string, raising
+                ValueError if it is invalid.
+            description (str): What a valid value is, for error messages.
+        """
+
+        self.name = name
+        self.column = column
+        self.operator_name = operator_name
+        self.parse = parse
+        self.description = description
+
+    def parse_value(self, value):
+        """Parses the parameter's value from the query string.
+
+        Args:
+            value (str): The parameter's value.
+
+        Raises:
+            InvalidFilterError: If the value is invalid.
+
+        Returns:
+            The parsed value, or a list of them for the in operator.
+        """
+
+        try:
+            if self.operator_name == "in":
+                return [self.parse(part) for part in value.split(",")]
+            return self.parse(value)
+        except ValueError as error:
+            if self.operator_name == "in":
+                message = f"{self.name} must be a comma-separated list of "
+                message += re.sub(r"^an? ", "", self.description) + " values"
+            else:
+                message = f"{self.name} must be {self.description}"
+            raise InvalidFilterError(message) from error
+
+    def predicate(self):
+        """Builds the predicate with a bound parameter named after the filter,
+        for its value to be bound in later."""
+
+        if self.operator_name == "in":
+            value = bindparam(self.name, expanding=True)
+        else:
+            value = bindparam(self.name, type_=self.column.type)
+
+        return OPERATORS[self.operator_name](self.column, value)
+
+
+class FilterSet:
+    """The filters available on a model, built once from its columns."""
+
+    def __init__(
+        self,
+        model,
+        exclude=(),
+        renames=None,
+        parameters=None,
+        predicates=(),
+    ):
+        """Builds the filters.
+
+        Args:
+            model: The model whose columns can be filtered on.
+            exclude (tuple, optional): Columns that can't be filtered on.
+            renames (dict, optional): Parameter names to use in place of the
+                generated ones, e.g. date_from for min_date_logged.
+            parameters (dict, optional): Other parameters, mapped to a
+                (parse, description) pair, that are handled by predicates.
+            predicates (tuple, optional): Functions taking the parsed filters
+                and returning a further predicate to apply, or None.
+        """
+
+        renames = renames or {}
+        self.filters = {}
+
+        for column in model.__table__.columns:
+            if column.name in exclude:
+                continue
+
+            attribute = getattr(model, column.name)
+            parse, description, operator_names = next(
+                (parse, description, operator_names)
+                for column_type, parse, description, operator_names in (
+                    COLUMN_TYPES
+                )
+                if isinstance(column.type, column_type)
+            )
+            for operator_name in operator_names:
+                name = _parameter_name(column.name, operator_name)
+                name = renames.get(name, name)
+                self.filters[name] = Filter(
+                    name, attribute, operator_name, parse, description
+                )
+
+        self.parameters = parameters or {}
+        self.predicates = predicates
+        self._compile = lru_cache(maxsize=COMPILED_FILTERS_CACHE_SIZE)(
+            self._build
+        )
+
+    def parse(self, args, allowed=()):
+        """Parses and validates the filters in a query string.
+
+        Args:
+            args (MultiDict): The request's query string parameters.
+            allowed (tuple, optional): The route's own parameters, which are
+                left for it to read.
+
+        Raises:
+            InvalidFilterError: If a parameter is unknown, repeated or has an
+                invalid value.
+
+        Returns:
+            dict: The parsed value of each filter given.
+        """
+
+        unknown = sorted(
+            name
+            for name in args
+            if name not in self.filters
+            and name not in self.parameters
+            and name not in allowed
+        )
+        if unknown:
+            raise InvalidFilterError(
+                "Unknown parameters: " + ", ".join(unknown)
+            )
+
+        values = {}
+        for name in args:
+            if name in allowed:
+                continue
+
+            given = args.getlist(name)
+            if len(given) > 1:
+                raise InvalidFilterError(f"{name} can only be given once")
+
+            if name in self.filters:
+                values[name] = self.filters[name].parse_value(given[0])
+            else:
+                parse, description = self.parameters[name]
+                try:
+                    values[name] = parse(given[0])
+                except ValueError as error:
+                    raise InvalidFilterError(
+                        f"{name} must be {description}"
+                    ) from error
+
+        return values
+
+    def _build(self, names):
+        """Builds the combined predicate for a combination of filters."""
+
+        return and_(*(self.filters[name].predicate() for name in names))
+
+    def apply(self, query, values):
+        """Applies parsed filters to a query.
+
+        Args:
+            query: The query to filter.
+            values (dict): The parsed filters, as returned by parse.
+
+        Raises:
+            InvalidFilterError: If the filters can't be applied together.
+
+        Returns:
+            Query: The filtered query.
+        """
+
+        names = tuple(sorted(name for name in values if name in self.filters))
+        if names:
+            query = query.filter(
+                self._compile(names).params(
+                    {name: values[name] for name in names}
+                )
+            )
+
+        for predicate in self.predicates:
+            clause = predicate(values)
+            if clause is not None:
+                query = query.filter(clause)
+
+        return query
+
+
+def _bounding_box(values):
+    """Prunes latitude/longitude range filters to the grid cells covering the
+    bounding box, where it is given in full."""
+
+    bounds = tuple(
+        values.get(name)
+        for name in (
+            "min_latitude",
+            "max_latitude",
+            "min_longitude",
+            "max_longitude",
+        )
+    )
+    if None in bounds or bounds[2] > bounds[3]:
+        return None
+
+    return bounding_box_predicate(Observation.grid_cell, *bounds)
+
+
+def _near(values):
+    """Matches observations within radius_km kilometres of the near location."""
+
+    if "near" not in values:
+        return None
+    if "radius_km" not in values:
+        raise InvalidFilterError("radius_km must be a positive number")
+
+    latitude, longitude = values["near"]
+
+    return radius_predicate(
+        Observation.grid_cell,
+        Observation.latitude,
+        Observation.longitude,
+        latitude,
+        longitude,
+        values["radius_km"],
+    )
+
+
+# Observations are filtered on their local date with date_from and date_to,
+# and on their UTC timestamp with observed_from and observed_to. The latter
+# compares observations correctly across time zones, and together with the
+# device uses the composite index.
+OBSERVATION_FILTERS = FilterSet(
+    Observation,
+    exclude=("grid_cell",),
+    renames={
+        "min_date_logged": "date_from",
+        "max_date_logged": "date_to",
+        "min_observed_at_utc": "observed_from",
+        "max_observed_at_utc": "observed_to",
+    },
+    parameters={
+        "near": (parse_location, "a location given as latitude,longitude"),
+        "radius_km": (parse_positive_number, "a positive number"),
+    },
+    predicates=(_bounding_box, _near),
+)
+
+DEVICE_FILTERS = FilterSet(Device, exclude=("last_observation_id",))
+
+# Sketches are filtered on their UTC day with date_from and date_to, for
+# consistency with the observation filters.
+SKETCH_FILTERS = FilterSet(
+    ObservationSketch,
+    exclude=("metric", "sketch"),
+    renames={"min_day": "date_from", "max_day": "date_to"},
+)
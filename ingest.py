@@ -0,0 +1,619 @@
+"""High-throughput ingest of observations.
+
+The regular create routes load each row into an ORM instance through
+ObservationSchema, which is convenient but slow for large batches. This module
+validates plain dictionaries against the Observation column types and inserts
+them in chunks with a Core executemany, without building ORM objects.
+
+Besides JSON arrays, batches can be uploaded as CSV, NDJSON or a stream of
+MessagePack maps. These are parsed
+incrementally from the request body and inserted a chunk at a time, so memory
+use stays constant however large the upload is.
+
+Gateways retry posts that time out, so the same reading can arrive more than
+once. Observations are unique on their natural key of device and UTC time,
+and duplicates are reported rather than inserted. Each worker remembers the
+keys it has recently ingested in a Bloom filter, and only looks up the keys
+that it may have seen before, so a batch of new observations is inserted
+without any extra query. Keys stored by other workers are caught by the
+unique index, after which the batch is retried with every key looked up.
+"""
+
+import codecs
+import csv
+import json
+import threading
+from datetime import date, time
+from functools import partial
+from operator import itemgetter
+
+import msgpack
+from flask import current_app
+from sqlalchemy import insert, select, tuple_
+from sqlalchemy.exc import IntegrityError
+
+from bloom import RotatingBloomFilter
+from config import get_config
+from devices import update_latest_observations
+from models import (
+    NATURAL_KEY,
+    Observation,
+    db,
+    parse_utc_offset,
+    utc_timestamp,
+)
+from rollups import update_rollups
+from sketches import update_sketches
+
+# The number of rows sent to the database in each executemany call.
+BULK_CHUNK_SIZE = 1000
+
+# The number of bytes read from an upload at a time.
+UPLOAD_READ_SIZE = 64 * 1024
+
+# The most rejected rows whose errors are reported back, so that the summary
+# of a large upload stays small however many of its rows are invalid.
+MAX_REPORTED_ERRORS = 1000
+
+# Guards creating the recent keys filter for an app.
+_extension_lock = threading.Lock()
+
+MISSING_MESSAGE = "Missing data for required field."
+UNKNOWN_MESSAGE = "Unknown field."
+
+
+class InvalidUploadError(ValueError):
+    """Raised when an upload can't be parsed any further."""
+
+
+class MalformedRecord:
+    """Stands in for a record in an upload that couldn't be parsed, so that
+    it is reported as a rejected row while the rest are still ingested."""
+
+    def __init__(self, message):
+        self.message = message
+
+
+def _parse_integer(value):
+    """Converts a value to an integer, rejecting booleans."""
+
+    if isinstance(value, bool):
+        raise ValueError
+    return int(value)
+
+
+def _parse_float(value):
+    """Converts a value to a float, rejecting booleans."""
+
+    if isinstance(value, bool):
+        raise ValueError
+    return float(value)
+
+
+def _parse_date(value):
+    """Converts an ISO 8601 string to a date."""
+
+    return date.fromisoformat(value)
+
+
+def _parse_time(value):
+    """Converts an ISO 8601 string to a time."""
+
+    return time.fromisoformat(value)
+
+
+# Parsers and error messages for each column type, matching the messages that
+# marshmallow produces for the equivalent fields.
+_PARSERS = {
+    int: (_parse_integer, "Not a valid integer."),
+    float: (_parse_float, "Not a valid number."),
+    date: (_parse_date, "Not a valid date."),
+    time: (_parse_time, "Not a valid time."),
+    str: (str, "Not a valid string."),
+}
+
+
+def _build_fields(model):
+    """Builds a parser for each column a client may supply for the model.
+
+    Args:
+        model: The SQLAlchemy model to build parsers for.
+
+    Returns:
+        dict: A mapping of column name to (parser, error message, max length).
+    """
+
+    fields = {}
+
+    for column in model.__table__.columns:
+        # Primary keys and columns populated by the database are never
+        # accepted from clients.
+        if column.primary_key or column.default or column.server_default:
+            continue
+
+        python_type = column.type.python_type
+        parser, message = _PARSERS[python_type]
+        max_length = getattr(column.type, "length", None)
+        fields[column.name] = (parser, message, max_length)
+
+    return fields
+
+
+OBSERVATION_FIELDS = _build_fields(Observation)
+
+# Additional checks applied to fields after they have been converted.
+OBSERVATION_VALIDATORS = {
+    "time_zone_offset": (parse_utc_offset, "Not a valid time zone offset."),
+}
+
+
+def validate_row(row):
+    """Validates and converts a single observation.
+
+    Args:
+        row (dict): The observation data supplied by the client.
+
+    Returns:
+        tuple: The converted row, or None if it is invalid, and a dictionary of
+        error messages keyed by field name.
+    """
+
+    if isinstance(row, MalformedRecord):
+        return None, {"_schema": [row.message]}
+    if not isinstance(row, dict):
+        return None, {"_schema": ["Invalid input type."]}
+
+    converted = {}
+    errors = {}
+
+    for name, (parser, message, max_length) in OBSERVATION_FIELDS.items():
+        value = row.get(name)
+
+        if value is None:
+            errors[name] = [MISSING_MESSAGE]
+            continue
+
+        try:
+            value = parser(value)
+        except (TypeError, ValueError):
+            errors[name] = [message]
+            continue
+
+        if max_length is not None and len(value) > max_length:
+            errors[name] = [f"Longer than maximum length {max_length}."]
+            continue
+
+        if name in OBSERVATION_VALIDATORS:
+            validator, message = OBSERVATION_VALIDATORS[name]
+            try:
+                validator(value)
+            except ValueError:
+                errors[name] = [message]
+                continue
+
+        converted[name] = value
+
+    # Most rows only have known fields, which a set comparison can confirm
+    # without looking up each one.
+    if not row.keys() <= OBSERVATION_FIELDS.keys():
+        for name in row:
+            if name not in OBSERVATION_FIELDS:
+                errors[name] = [UNKNOWN_MESSAGE]
+
+    if errors:
+        return None, errors
+
+    return converted, {}
+
+
+def validate_rows(rows):
+    """Validates a batch of observations.
+
+    Args:
+        rows (list): The observations supplied by the client.
+
+    Returns:
+        tuple: A list of the valid converted rows and a dictionary of errors
+        keyed by the index of each invalid row.
+    """
+
+    valid = []
+    errors = {}
+
+    for index, row in enumerate(rows):
+        converted, row_errors = validate_row(row)
+
+        if row_errors:
+            errors[index] = row_errors
+        else:
+            valid.append(converted)
+
+    return valid, errors
+
+
+def insert_rows(rows):
+    """Inserts validated observations in chunks using a Core executemany,
+    merges them into the rollup tables and updates the devices' latest
+    observations.
+
+    The caller is responsible for committing the session.
+
+    Args:
+        rows (list): Rows returned from validate_rows.
+
+    Returns:
+        list: The ids of the inserted rows in insertion order, or None if the
+        database cannot return ids from a multi-row insert.
+    """
+
+    table = Observation.__table__
+    dialect = db.session.get_bind().dialect
+    statement = insert(table)
+
+    # Not every database can return the generated ids from a multi-row
+    # insert, e.g. MySQL, in which case we can't report them. Where it can,
+    # the ids are returned with each row's natural key to match them back to
+    # the rows, as asking for them in parameter order makes some databases,
+    # e.g. SQLite, insert a row at a time.
+    returning = dialect.insert_executemany_returning
+    key_columns = [table.c[name] for name in NATURAL_KEY]
+    get_key = itemgetter(*NATURAL_KEY)
+
+    if returning:
+        statement = statement.returning(table.c.id, *key_columns)
+
+    ids = [] if returning else None
+
+    for start in range(0, len(rows), BULK_CHUNK_SIZE):
+        chunk = rows[start : start + BULK_CHUNK_SIZE]
+
+        # Set the UTC timestamp up front rather than leaving it to the column
+        # default, as the rollups and sketches need it too.
+        for row in chunk:
+            if "observed_at_utc" not in row:
+                row["observed_at_utc"] = utc_timestamp(
+                    row["date_logged"],
+                    row["time_logged"],
+                    row["time_zone_offset"],
+                )
+
+        result = db.session.execute(statement, chunk)
+        update_rollups(chunk)
+        update_sketches(chunk)
+        update_latest_observations(row["device_id"] for row in chunk)
+
+        if ids is not None:
+            inserted = {tuple(row[1:]): row.id for row in result}
+            ids.extend(inserted[get_key(row)] for row in chunk)
+
+    return ids
+
+
+def natural_key(observation):
+    """Gets the natural key of an observation.
+
+    Args:
+        observation: An Observation instance, a validated row or a result
+            row selecting the key's columns.
+
+    Returns:
+        tuple: The device id and the UTC time of the observation.
+    """
+
+    if isinstance(observation, dict):
+        get = observation.get
+    else:
+        get = partial(getattr, observation)
+
+    observed_at_utc = get("observed_at_utc", None)
+    if observed_at_utc is None:
+        # Not set until the observation is inserted
+        observed_at_utc = utc_timestamp(
+            get("date_logged"), get("time_logged"), get("time_zone_offset")
+        )
+
+    return get("device_id"), observed_at_utc
+
+
+def get_recent_keys():
+    """Gets the filter of natural keys recently ingested by this worker.
+
+    Returns:
+        RotatingBloomFilter: The filter for the current app.
+    """
+
+    with _extension_lock:
+        keys = current_app.extensions.get("recent_observation_keys")
+
+        if keys is None:
+            keys = current_app.extensions["recent_observation_keys"] = (
+                RotatingBloomFilter(get_config().dedupe_filter_capacity)
+            )
+
+        return keys
+
+
+def find_duplicates(keys, check_all=False):
+    """Finds the observations in a batch that are already stored or repeat an
+    earlier observation in the batch.
+
+    Args:
+        keys (list): The natural key of each observation in the batch.
+        check_all (bool, optional): Whether to look up every key, rather than
+            only those that may have been ingested recently.
+
+    Returns:
+        dict: The id of the stored observation each duplicate matches, or
+        None if it repeats one earlier in the batch, keyed by its index.
+    """
+
+    recent = get_recent_keys()
+    duplicates = {}
+    first_indexes = {}
+    candidates = []
+
+    for index, key in enumerate(keys):
+        if key in first_indexes:
+            duplicates[index] = None
+            continue
+
+        first_indexes[key] = index
+        if check_all or key in recent:
+            candidates.append(key)
+
+    columns = [Observation.__table__.c[name] for name in NATURAL_KEY]
+
+    for start in range(0, len(candidates), BULK_CHUNK_SIZE):
+        stored = db.session.execute(
+            select(Observation.id, *columns).where(
+                tuple_(*columns).in_(
+                    candidates[start : start + BULK_CHUNK_SIZE]
+                )
+            )
+        )
+        for row in stored:
+            duplicates[first_indexes[natural_key(row)]] = row.id
+
+    return duplicates
+
+
+def save_new(keys, save):
+    """Saves the observations in a batch that aren't duplicates, and commits
+    them.
+
+    Args:
+        keys (list): The natural key of each observation in the batch.
+        save (callable): Adds the observations that aren't duplicates to the
+            session, given the duplicates as returned by find_duplicates.
+
+    Returns:
+        tuple: The result of save and the duplicates.
+    """
+
+    try:
+        duplicates = find_duplicates(keys)
+        result = save(duplicates)
+        db.session.commit()
+    except IntegrityError:
+        # A key this worker hadn't seen was already stored, e.g. by another
+        # worker, so look up every key.
+        db.session.rollback()
+        duplicates = find_duplicates(keys, check_all=True)
+        result = save(duplicates)
+        db.session.commit()
+
+    recent = get_recent_keys()
+    for key in keys:
+        recent.add(key)
+
+    return result, duplicates
+
+
+def insert_new_rows(rows):
+    """Inserts the observations in a batch that aren't duplicates, and
+    commits them.
+
+    Args:
+        rows (list): Rows returned from validate_rows.
+
+    Returns:
+        tuple: The ids of the inserted rows as returned by insert_rows, and
+        the duplicates as returned by find_duplicates.
+    """
+
+    # The UTC time is part of the natural key, so is worked out once here
+    # rather than again when the rows are inserted.
+    keys = []
+    for row in rows:
+        key = natural_key(row)
+        row["observed_at_utc"] = key[1]
+        keys.append(key)
+
+    return save_new(
+        keys,
+        lambda duplicates: insert_rows(
+            [row for index, row in enumerate(rows) if index not in duplicates]
+        ),
+    )
+
+
+def ingest_rows(rows):
+    """Validates and inserts observations a chunk at a time, so that only one
+    chunk of rows is held in memory however many there are.
+
+    Each chunk is committed once inserted. If the upload can't be parsed to
+    the end, the rows before the error are still inserted, and as duplicates
+    are skipped the whole upload can be sent again once it has been fixed.
+
+    Args:
+        rows (iterable): The observations supplied by the client.
+
+    Returns:
+        dict: A summary with the number of accepted, duplicate and rejected
+        rows, the first and last ids inserted, the indexes of up to
+        MAX_REPORTED_ERRORS duplicates and the errors of up to
+        MAX_REPORTED_ERRORS rejected rows, keyed by index. If the upload
+        couldn't be parsed to the end, a message says why.
+    """
+
+    summary = {
+        "accepted": 0,
+        "duplicates": 0,
+        "rejected": 0,
+        "first_id": None,
+        "last_id": None,
+        "duplicate_rows": [],
+        "errors": {},
+    }
+    chunk = []
+    chunk_indexes = []
+
+    def flush():
+        ids, duplicates = insert_new_rows(chunk)
+        summary["accepted"] += len(chunk) - len(duplicates)
+        summary["duplicates"] += len(duplicates)
+        for index in sorted(duplicates):
+            if len(summary["duplicate_rows"]) < MAX_REPORTED_ERRORS:
+                summary["duplicate_rows"].append(chunk_indexes[index])
+        if ids:
+            if summary["first_id"] is None:
+                summary["first_id"] = ids[0]
+            summary["last_id"] = ids[-1]
+        chunk.clear()
+        chunk_indexes.clear()
+
+    try:
+        for index, row in enumerate(rows):
+            converted, row_errors = validate_row(row)
+
+            if row_errors:
+                summary["rejected"] += 1
+                if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+                    summary["errors"][index] = row_errors
+                continue
+
+            chunk.append(converted)
+            chunk_indexes.append(index)
+            if len(chunk) == BULK_CHUNK_SIZE:
+                flush()
+    except InvalidUploadError as error:
+        summary["message"] = str(error)
+
+    if chunk:
+        flush()
+
+    return summary
+
+
+def _lines(stream):
+    """Splits a binary stream into lines, keeping their endings, reading
+    UPLOAD_READ_SIZE bytes at a time."""
+
+    pending = b""
+
+    while True:
+        data = stream.read(UPLOAD_READ_SIZE)
+        if not data:
+            break
+
+        *lines, pending = (pending + data).split(b"\n")
+        for line in lines:
+            yield line + b"\n"
+
+    if pending:
+        yield pending
+
+
+def read_csv(stream, charset=None):
+    """Parses observations from a CSV upload with a header row.
+
+    Empty cells are treated as missing values.
+
+    Args:
+        stream: The binary request body.
+        charset (str, optional): The body's encoding. Defaults to UTF-8.
+
+    Raises:
+        InvalidUploadError: If the body can't be decoded or parsed as CSV.
+
+    Yields:
+        dict: The observations, with values as strings.
+    """
+
+    try:
+        reader = csv.reader(
+            codecs.iterdecode(_lines(stream), charset or "utf-8")
+        )
+        header = next(reader, None)
+
+        for record in reader:
+            if not record:
+                continue
+            if len(record) != len(header):
+                yield MalformedRecord(
+                    f"Expected {len(header)} values but found {len(record)}."
+                )
+                continue
+
+            yield {
+                name: value
+                for name, value in zip(header, record)
+                if value != ""
+            }
+    except (LookupError, UnicodeDecodeError, csv.Error) as error:
+        raise InvalidUploadError(f"Invalid CSV upload: {error}") from error
+
+
+def read_ndjson(stream, charset=None):
+    """Parses observations from an NDJSON upload, with one JSON object per
+    line. Lines that aren't valid JSON are rejected individually.
+
+    Args:
+        stream: The binary request body.
+        charset (str, optional): Unused, as JSON is always UTF-8.
+
+    Yields:
+        The observations.
+    """
+
+    for line in _lines(stream):
+        if not line.strip():
+            continue
+
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield MalformedRecord("Invalid JSON.")
+
+
+def read_msgpack(stream, charset=None):
+    """Parses observations from an upload of consecutive MessagePack maps.
+
+    Args:
+        stream: The binary request body.
+        charset (str, optional): Unused.
+
+    Raises:
+        InvalidUploadError: If the body isn't valid MessagePack.
+
+    Yields:
+        The observations.
+    """
+
+    unpacker = msgpack.Unpacker(stream, raw=False, read_size=UPLOAD_READ_SIZE)
+
+    try:
+        yield from unpacker
+    except (ValueError, msgpack.UnpackException) as error:
+        raise InvalidUploadError(
+            f"Invalid MessagePack upload: {error}"
+        ) from error
+
+
+# Readers for each streamed upload format, by media type.
+INGEST_READERS = {
+    "text/csv": read_csv,
+    "application/x-ndjson": read_ndjson,
+    "application/msgpack": read_msgpack,
+    "application/x-msgpack": read_msgpack,
+}
@@ -0,0 +1,265 @@
+"""Asynchronous write-behind ingest of observations.
+
+Committing every observation in its own transaction makes high volumes of
+single-reading posts bound by fsync and lock contention. In async mode the
+create route only validates and enqueues an observation, and a background
+writer drains the queue, inserting observations in batched transactions.
+
+The queue is bounded, so when the writer falls behind new observations are
+refused rather than buffered without limit. Each enqueued observation gets a
+receipt that can be used to check whether it has been written.
+"""
+
+import atexit
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import current_app
+
+from cache import invalidate_responses
+from config import get_config
+from ingest import insert_new_rows
+from models import db
+
+logger = logging.getLogger(__name__)
+
+# The number of receipts remembered, after which the oldest are forgotten.
+MAX_RECEIPTS = 100000
+
+# Guards creating the queue for an app.
+_extension_lock = threading.Lock()
+
+QUEUED = "queued"
+COMMITTED = "committed"
+DUPLICATE = "duplicate"
+FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    """Raised when an observation can't be enqueued because the queue is
+    full."""
+
+
+class IngestQueue:
+    """A bounded queue of observations written to the database in batches by
+    a background thread."""
+
+    def __init__(self, app, max_size, batch_size, flush_interval):
+        """Initialises the queue.
+
+        Args:
+            app (Flask): The app whose database observations are written to.
+            max_size (int): The maximum number of observations waiting to be
+                written.
+            batch_size (int): The maximum number of observations written in
+                each transaction.
+            flush_interval (float): The longest time in seconds an observation
+                waits for a batch to fill before it is written.
+        """
+
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_size)
+        self._receipts = OrderedDict()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="ingest-writer", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, row, timeout):
+        """Enqueues a validated observation to be written.
+
+        Args:
+            row (dict): The observation, as returned by ingest.validate_row.
+            timeout (float): The longest time in seconds to wait for space in
+                the queue.
+
+        Raises:
+            QueueFullError: If the queue is still full after the timeout, or
+                the writer has been shut down.
+
+        Returns:
+            str: The receipt id for the observation.
+        """
+
+        if self._stopped.is_set():
+            raise QueueFullError("Ingest queue has been shut down")
+
+        receipt_id = uuid.uuid4().hex
+        self._set_receipt(receipt_id, {"status": QUEUED})
+
+        try:
+            self._queue.put((receipt_id, row), timeout=timeout)
+        except queue.Full as error:
+            with self._lock:
+                del self._receipts[receipt_id]
+            raise QueueFullError("Ingest queue is full") from error
+
+        return receipt_id
+
+    def status(self, receipt_id):
+        """Gets the status of an enqueued observation.
+
+        Args:
+            receipt_id (str): The receipt id returned by submit.
+
+        Returns:
+            dict: The status of the observation, or None if the receipt is
+            unknown.
+        """
+
+        with self._lock:
+            receipt = self._receipts.get(receipt_id)
+            return dict(receipt) if receipt is not None else None
+
+    def shutdown(self, timeout=None):
+        """Stops accepting observations and waits for the writer to finish
+        writing everything that has been enqueued.
+
+        Args:
+            timeout (float, optional): The longest time in seconds to wait.
+        """
+
+        self._stopped.set()
+        self._thread.join(timeout)
+
+    def _set_receipt(self, receipt_id, receipt):
+        """Records the status of an observation."""
+
+        with self._lock:
+            self._receipts[receipt_id] = receipt
+            self._receipts.move_to_end(receipt_id)
+
+            while len(self._receipts) > MAX_RECEIPTS:
+                self._receipts.popitem(last=False)
+
+    def _next_batch(self):
+        """Waits for observations and collects them into a batch.
+
+        Returns:
+            list: Up to batch_size (receipt id, row) pairs, which is empty if
+            nothing was enqueued before the flush interval elapsed.
+        """
+
+        batch = []
+        deadline = None
+
+        while len(batch) < self.batch_size:
+            if deadline is None:
+                timeout = self.flush_interval
+            else:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+            # The first observation in the batch starts the flush interval.
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+
+        return batch
+
+    def _write(self, batch):
+        """Inserts a batch of observations in a single transaction, skipping
+        any duplicates.
+
+        Args:
+            batch (list): (receipt id, row) pairs.
+
+        Returns:
+            list: The receipt for each observation in the batch.
+        """
+
+        try:
+            ids, duplicates = insert_new_rows([row for _, row in batch])
+        except Exception:
+            db.session.rollback()
+            raise
+
+        ids = iter(ids or ())
+        receipts = []
+        for index in range(len(batch)):
+            if index in duplicates:
+                receipt = {"status": DUPLICATE}
+                observation_id = duplicates[index]
+            else:
+                receipt = {"status": COMMITTED}
+                observation_id = next(ids, None)
+            if observation_id is not None:
+                receipt["observation_id"] = observation_id
+            receipts.append(receipt)
+
+        return receipts
+
+    def _run(self):
+        """Writes batches of observations until shut down and the queue has
+        been drained."""
+
+        while not (self._stopped.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+
+            if not batch:
+                continue
+
+            with self.app.app_context():
+                try:
+                    results = [(batch, self._write(batch))]
+                except Exception:
+                    # Retry observations one at a time so that a bad one
+                    # doesn't cause the rest of the batch to be lost.
+                    logger.exception("Failed to write batch, retrying singly")
+                    results = []
+                    for item in batch:
+                        try:
+                            results.append(([item], self._write([item])))
+                        except Exception:
+                            logger.exception("Failed to write observation")
+                            self._set_receipt(
+                                item[0],
+                                {
+                                    "status": FAILED,
+                                    "error": "Failed to write observation",
+                                },
+                            )
+
+                for items, receipts in results:
+                    for (receipt_id, _), receipt in zip(items, receipts):
+                        self._set_receipt(receipt_id, receipt)
+
+                invalidate_responses()
+
+
+def get_ingest_queue():
+    """Gets the ingest queue for the current app, starting it if needed.
+
+    Returns:
+        IngestQueue: The app's ingest queue.
+    """
+
+    with _extension_lock:
+        ingest_queue = current_app.extensions.get("ingest_queue")
+
+        if ingest_queue is None:
+            app_config = get_config()
+            ingest_queue = current_app.extensions["ingest_queue"] = IngestQueue(
+                current_app._get_current_object(),
+                app_config.ingest_queue_size,
+                app_config.ingest_batch_size,
+                app_config.ingest_flush_interval,
+            )
+
+            # Write out anything still queued when the process exits.
+            atexit.register(ingest_queue.shutdown)
+
+        return ingest_queue
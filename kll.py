@@ -0,0 +1,267 @@
+"""KLL sketches for estimating quantiles of a stream in bounded space.
+
+A KLL sketch (Karnin, Lang and Liberty, 2016) keeps a hierarchy of
+compactors. New values go into level 0, and when the sketch is full, the
+lowest level over its capacity is sorted and every other item is promoted to
+the next level, where each item stands for twice as many values. The top
+level holds k items and each level below holds two thirds as many as the one
+above, so a sketch of any number of values holds fewer than 3k items.
+
+Sketches with the same k can be merged without losing accuracy, so they can
+be kept per device and day and combined for any set of devices and days.
+
+The rank of an estimated quantile, as a fraction of the values, is within
+rank_error(k) of the one requested with 99% confidence, e.g. about 1.3% for
+the default k of 200. The minimum and maximum are kept exactly.
+"""
+
+import math
+import random
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+# The number of items in the top level, which sets the accuracy.
+DEFAULT_K = 200
+
+# The smallest capacity of any level.
+MIN_CAPACITY = 2
+
+# Each level holds this fraction of the items of the level above.
+CAPACITY_RATIO = 2 / 3
+
+# The version, k, number of values, minimum, maximum and number of levels at
+# the start of a serialised sketch, followed by the size of each level and
+# then the items of every level, all little-endian.
+_HEADER = struct.Struct("<BHQddB")
+_VERSION = 1
+
+
+def rank_error(k=DEFAULT_K):
+    """Gets the normalised rank error of quantiles estimated by a sketch.
+
+    Args:
+        k (int, optional): The size of the sketch.
+
+    Returns:
+        float: The error, as a fraction of the values, that estimates stay
+        within with 99% confidence.
+    """
+
+    # The empirical bound for KLL sketches measured by Apache DataSketches.
+    return 2.296 / k**0.9723
+
+
+class KLLSketch:
+    """A mergeable sketch of the distribution of a stream of numbers."""
+
+    def __init__(self, k=DEFAULT_K, rng=random):
+        """Initialises an empty sketch.
+
+        Args:
+            k (int, optional): The number of items in the top level.
+            rng (optional): The source of the random choices made when
+                compacting, e.g. a seeded random.Random for repeatable
+                results.
+        """
+
+        self.k = k
+        self.n = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.levels = [[]]
+        self._rng = rng
+
+    def __len__(self):
+        return self.n
+
+    def _capacity(self, level):
+        """Gets the number of items a level holds before being compacted."""
+
+        depth = len(self.levels) - level - 1
+
+        return max(MIN_CAPACITY, math.ceil(self.k * CAPACITY_RATIO**depth))
+
+    def _compress(self):
+        """Compacts levels until the sketch is within its capacity."""
+
+        while sum(map(len, self.levels)) >= sum(
+            self._capacity(level) for level in range(len(self.levels))
+        ):
+            level = next(
+                level
+                for level, items in enumerate(self.levels)
+                if len(items) >= self._capacity(level)
+            )
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+
+            # Promote every other item from a random offset, leaving the
+            # smallest behind if there is an odd number of them.
+            items = sorted(self.levels[level])
+            odd = len(items) % 2
+            offset = odd + self._rng.getrandbits(1)
+            self.levels[level + 1].extend(items[offset::2])
+            self.levels[level] = items[:odd]
+
+    def update(self, value):
+        """Adds a value to the sketch.
+
+        Args:
+            value (float): The value.
+        """
+
+        value = float(value)
+        self.levels[0].append(value)
+        self.n += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+        if len(self.levels[0]) >= self._capacity(0):
+            self._compress()
+
+    def update_many(self, values):
+        """Adds values to the sketch, as update does one at a time but
+        compacting only when the bottom level fills.
+
+        Args:
+            values (iterable): The values.
+        """
+
+        values = [float(value) for value in values]
+        if not values:
+            return
+
+        self.n += len(values)
+        self.min = min(self.min, *values)
+        self.max = max(self.max, *values)
+
+        start = 0
+        while start < len(values):
+            room = max(1, self._capacity(0) - len(self.levels[0]))
+            self.levels[0].extend(values[start : start + room])
+            start += room
+
+            if len(self.levels[0]) >= self._capacity(0):
+                self._compress()
+
+    def merge(self, other):
+        """Adds the values summarised by another sketch to this one.
+
+        Args:
+            other (KLLSketch): The sketch to merge in, which is unchanged.
+        """
+
+        if not other.n:
+            return
+
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, items in enumerate(other.levels):
+            self.levels[level].extend(items)
+
+        self.k = min(self.k, other.k)
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+
+    def quantiles(self, fractions):
+        """Estimates the values at the given ranks.
+
+        Args:
+            fractions (list): Ranks between 0 and 1, e.g. 0.5 for the
+                median.
+
+        Returns:
+            list: The estimated value at each rank, or None for each if the
+            sketch is empty.
+        """
+
+        if not self.n:
+            return [None] * len(fractions)
+
+        weighted = sorted(
+            (value, 1 << level)
+            for level, items in enumerate(self.levels)
+            for value in items
+        )
+        values = [value for value, _ in weighted]
+        ranks = []
+        total = 0
+        for _, weight in weighted:
+            total += weight
+            ranks.append(total)
+
+        estimates = []
+        for fraction in fractions:
+            if fraction <= 0:
+                estimates.append(self.min)
+            elif fraction >= 1:
+                estimates.append(self.max)
+            else:
+                estimates.append(values[bisect_left(ranks, fraction * self.n)])
+
+        return estimates
+
+    def to_bytes(self):
+        """Serialises the sketch compactly.
+
+        Returns:
+            bytes: The serialised sketch.
+        """
+
+        sizes = array("I", map(len, self.levels))
+        items = array("d")
+        for level in self.levels:
+            items.extend(level)
+
+        if sys.byteorder == "big":
+            sizes.byteswap()
+            items.byteswap()
+
+        header = _HEADER.pack(
+            _VERSION, self.k, self.n, self.min, self.max, len(self.levels)
+        )
+
+        return header + sizes.tobytes() + items.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data, rng=random):
+        """Loads a sketch serialised with to_bytes.
+
+        Args:
+            data (bytes): The serialised sketch.
+            rng (optional): The source of randomness for the loaded sketch.
+
+        Raises:
+            ValueError: If the data isn't a serialised sketch.
+
+        Returns:
+            KLLSketch: The sketch.
+        """
+
+        version, k, n, minimum, maximum, level_count = _HEADER.unpack_from(data)
+        if version != _VERSION:
+            raise ValueError(f"Unsupported sketch version: {version}")
+
+        sizes = array("I")
+        items_start = _HEADER.size + level_count * sizes.itemsize
+        sizes.frombytes(data[_HEADER.size : items_start])
+        items = array("d")
+        items.frombytes(data[items_start:])
+
+        if sys.byteorder == "big":
+            sizes.byteswap()
+            items.byteswap()
+
+        sketch = cls(k, rng)
+        sketch.n, sketch.min, sketch.max = n, minimum, maximum
+        sketch.levels = []
+        start = 0
+        for size in sizes:
+            sketch.levels.append(items[start : start + size].tolist())
+            start += size
+
+        return sketch
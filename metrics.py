@@ -0,0 +1,331 @@
+"""Request timing and SQL instrumentation, exposed in the Prometheus text
+format.
+
+Hooks registered on the API blueprint time each request, and SQLAlchemy
+engine events count the statements executed while handling it and the time
+spent in the database. Together with the serialisation time and response
+size, these are recorded in histograms labelled by route.
+
+Requests slower than a configurable threshold are logged along with the SQL
+they executed.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets.
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+
+
+def _escape(value):
+    """Escapes a label value for the Prometheus text format."""
+
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace('"', '\\"')
+        .replace("\n", "\\n")
+    )
+
+
+def _format_labels(labels):
+    """Formats label name/value pairs for the Prometheus text format."""
+
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in labels) + "}"
+
+
+class Histogram:
+    """A thread-safe histogram of observed values, split by label values."""
+
+    def __init__(self, name, description, label_names, buckets):
+        """Initialises the histogram.
+
+        Args:
+            name (str): The metric name.
+            description (str): The help text for the metric.
+            label_names (tuple): The names of the labels values are split by.
+            buckets (tuple): The ascending upper bounds of the buckets.
+        """
+
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        """Records a value.
+
+        Args:
+            value (float): The observed value.
+            label_values: A value for each of the histogram's labels.
+        """
+
+        with self._lock:
+            series = self._series.get(label_values)
+
+            if series is None:
+                # Bucket counts, then the sum and count of all values.
+                series = self._series[label_values] = [0] * len(self.buckets)
+                series += [0, 0]
+
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def clear(self):
+        """Forgets every recorded value."""
+
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        """Renders the histogram in the Prometheus text format.
+
+        Returns:
+            list: The lines of the exposition.
+        """
+
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+
+        with self._lock:
+            series = sorted(self._series.items())
+
+        for label_values, values in series:
+            labels = list(zip(self.label_names, label_values))
+
+            for bound, count in zip(self.buckets, values):
+                bucket_labels = _format_labels(labels + [("le", f"{bound:g}")])
+                lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+
+            bucket_labels = _format_labels(labels + [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{bucket_labels} {values[-1]}")
+            lines.append(
+                f"{self.name}_sum{_format_labels(labels)} {values[-2]}"
+            )
+            lines.append(
+                f"{self.name}_count{_format_labels(labels)} {values[-1]}"
+            )
+
+        return lines
+
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time taken to handle requests.",
+    ("endpoint", "method", "status"),
+    LATENCY_BUCKETS,
+)
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes",
+    "Size of response bodies, excluding streamed responses.",
+    ("endpoint",),
+    SIZE_BUCKETS,
+)
+SQL_STATEMENTS = Histogram(
+    "db_statements_per_request",
+    "Number of SQL statements executed per request.",
+    ("endpoint",),
+    COUNT_BUCKETS,
+)
+SQL_DURATION = Histogram(
+    "db_duration_seconds_per_request",
+    "Time spent executing SQL statements per request.",
+    ("endpoint",),
+    LATENCY_BUCKETS,
+)
+SERIALIZATION_DURATION = Histogram(
+    "serialization_duration_seconds",
+    "Time spent serialising response bodies per request.",
+    ("endpoint",),
+    LATENCY_BUCKETS,
+)
+
+HISTOGRAMS = (
+    REQUEST_DURATION,
+    RESPONSE_SIZE,
+    SQL_STATEMENTS,
+    SQL_DURATION,
+    SERIALIZATION_DURATION,
+)
+
+
+class _RequestStats:
+    """Statistics collected while handling a single request."""
+
+    def __init__(self):
+        """Starts timing the request."""
+
+        self.start = time.perf_counter()
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.serialization_seconds = None
+        self.queries = [] if get_config().slow_request_ms > 0 else None
+
+
+def _request_stats():
+    """Gets the statistics for the current request, if it is being
+    instrumented."""
+
+    if not has_request_context():
+        return None
+
+    return g.get("request_stats")
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(
+    conn, cursor, statement, parameters, context, executemany
+):
+    """Notes when a statement starts executing."""
+
+    if _request_stats() is not None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(
+    conn, cursor, statement, parameters, context, executemany
+):
+    """Adds a finished statement to the current request's statistics."""
+
+    stats = _request_stats()
+    starts = conn.info.get("query_start")
+
+    if stats is None or not starts:
+        return
+
+    seconds = time.perf_counter() - starts.pop()
+    stats.statements += 1
+    stats.sql_seconds += seconds
+
+    if stats.queries is not None:
+        stats.queries.append((seconds, statement))
+
+
+@contextmanager
+def serialization_timer():
+    """Context manager that records the time taken to serialise the current
+    request's response."""
+
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        stats = _request_stats()
+        if stats is not None:
+            stats.serialization_seconds = (stats.serialization_seconds or 0) + (
+                time.perf_counter() - start
+            )
+
+
+def _start_request():
+    """Starts collecting statistics for a request."""
+
+    g.request_stats = _RequestStats()
+
+
+def _finish_request(response):
+    """Records the statistics for a finished request."""
+
+    stats = g.pop("request_stats", None)
+
+    if stats is None:
+        return response
+
+    seconds = time.perf_counter() - stats.start
+    endpoint = request.endpoint or "unknown"
+
+    REQUEST_DURATION.observe(
+        seconds, endpoint, request.method, str(response.status_code)
+    )
+    SQL_STATEMENTS.observe(stats.statements, endpoint)
+    SQL_DURATION.observe(stats.sql_seconds, endpoint)
+
+    if stats.serialization_seconds is not None:
+        SERIALIZATION_DURATION.observe(stats.serialization_seconds, endpoint)
+
+    # Streamed responses don't have a length until they've been sent.
+    if not response.is_streamed and response.content_length is not None:
+        RESPONSE_SIZE.observe(response.content_length, endpoint)
+
+    slow_request_ms = get_config().slow_request_ms
+
+    if stats.queries is not None and seconds * 1000 >= slow_request_ms:
+        logger.warning(
+            "Slow request: %s %s took %.1f ms with %d SQL statements "
+            "(%.1f ms)\n%s",
+            request.method,
+            request.full_path,
+            seconds * 1000,
+            stats.statements,
+            stats.sql_seconds * 1000,
+            "\n".join(
+                f"  [{query_seconds * 1000:.1f} ms] {statement}"
+                for query_seconds, statement in stats.queries
+            ),
+        )
+
+    return response
+
+
+def instrument(blueprint):
+    """Registers hooks that record metrics for every request handled by a
+    blueprint.
+
+    Args:
+        blueprint (Blueprint): The blueprint to instrument.
+    """
+
+    blueprint.before_request(_start_request)
+    blueprint.after_request(_finish_request)
+
+
+def render_metrics():
+    """Renders every metric in the Prometheus text format.
+
+    Returns:
+        str: The exposition.
+    """
+
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+
+    return "\n".join(lines) + "\n"
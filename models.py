@@ -1,8 +1,120 @@
 """Database models for the API."""
 
+import functools
+import re
+from datetime import datetime, timedelta, timezone
+
 from flask_sqlalchemy import SQLAlchemy
 
-db = SQLAlchemy()
+from replicas import RoutingSession
+from spatial import grid_cell
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+# The columns that identify an observation independently of its id.
+NATURAL_KEY = ("device_id", "observed_at_utc")
+
+# The number of distinct time zone offsets whose parsed values are kept.
+# Devices report from a handful of zones, so each offset is parsed once.
+UTC_OFFSET_CACHE_SIZE = 256
+
+# Matches time zone offsets such as "+03:00", "-0530" or "UTC+00:00".
+UTC_OFFSET_PATTERN = re.compile(
+    r"^(?:UTC|GMT|Z)?\s*"
+    r"(?:(?P<sign>[+-])(?P<hours>\d{1,2}):?(?P<minutes>\d{2})?)?$"
+)
+
+
+@functools.lru_cache(maxsize=UTC_OFFSET_CACHE_SIZE)
+def parse_utc_offset(offset):
+    """Parses a time zone offset string into a timedelta.
+
+    Args:
+        offset (str): The offset, e.g. "+03:00" or "UTC-05:30".
+
+    Raises:
+        ValueError: If the offset is not in a recognised format.
+
+    Returns:
+        timedelta: The offset from UTC.
+    """
+
+    match = UTC_OFFSET_PATTERN.match(offset.strip())
+
+    if not match or not offset.strip():
+        raise ValueError(f"Invalid time zone offset: {offset!r}")
+
+    if match["sign"] is None:
+        return timedelta(0)
+
+    hours = int(match["hours"])
+    minutes = int(match["minutes"] or 0)
+    if hours > 14 or minutes > 59:
+        raise ValueError(f"Invalid time zone offset: {offset!r}")
+
+    delta = timedelta(hours=hours, minutes=minutes)
+
+    return -delta if match["sign"] == "-" else delta
+
+
+def utc_timestamp(date_logged, time_logged, time_zone_offset):
+    """Converts an observation's local date, time and offset to a naive UTC
+    datetime.
+
+    Args:
+        date_logged (date): The local date of the observation.
+        time_logged (time): The local time of the observation.
+        time_zone_offset (str): The offset of the local time from UTC.
+
+    Returns:
+        datetime: The time of the observation in UTC.
+    """
+
+    local = datetime.combine(date_logged, time_logged.replace(tzinfo=None))
+
+    return local - parse_utc_offset(time_zone_offset)
+
+
+def parse_utc_datetime(value):
+    """Parses an ISO 8601 datetime as a naive UTC datetime.
+
+    Args:
+        value (str): The datetime to parse. It is assumed to be in UTC if no
+            offset is given.
+
+    Raises:
+        ValueError: If the value is not a valid datetime.
+
+    Returns:
+        datetime: The equivalent UTC datetime without time zone information.
+    """
+
+    parsed = datetime.fromisoformat(value)
+
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return parsed
+
+
+def _default_observed_at_utc(context):
+    """Column default that derives observed_at_utc from the inserted row."""
+
+    parameters = context.get_current_parameters()
+
+    return utc_timestamp(
+        parameters["date_logged"],
+        parameters["time_logged"],
+        parameters["time_zone_offset"],
+    )
+
+
+def _default_grid_cell(context):
+    """Column default that derives grid_cell from the inserted row."""
+
+    parameters = context.get_current_parameters()
+
+    return grid_cell(parameters["latitude"], parameters["longitude"])
 
 
 class Observation(db.Model):
@@ -25,6 +137,29 @@ class Observation(db.Model):
     device_id = db.Column(
         db.Integer, db.ForeignKey("device.id"), nullable=False
     )
+    # The observation time normalised to UTC, so that observations logged in
+    # different time zones can be compared. This is populated on insert.
+    observed_at_utc = db.Column(
+        db.DateTime, nullable=False, default=_default_observed_at_utc
+    )
+    # The spatial grid cell containing the location, used to prune location
+    # queries. This is populated on insert.
+    grid_cell = db.Column(
+        db.Integer, nullable=False, default=_default_grid_cell
+    )
+
+    __table_args__ = (
+        # Supports the stable ordering used by keyset pagination and date range
+        # filters.
+        db.Index("ix_observation_keyset", "date_logged", "time_logged", "id"),
+        db.Index("ix_observation_observed_at", "observed_at_utc"),
+        # A device takes one reading at a time, so this is unique, which lets
+        # retried posts of the same reading be recognised.
+        db.Index(
+            "uq_observation_device_observed_at", *NATURAL_KEY, unique=True
+        ),
+        db.Index("ix_observation_grid_cell", "grid_cell"),
+    )
 
 
 class Device(db.Model):
@@ -36,3 +171,64 @@ class Device(db.Model):
     country = db.Column(db.String(100), nullable=False)
     status = db.Column(db.String(15), nullable=False)
     battery_level = db.Column(db.Integer, nullable=False)
+    # The device's most recent observation by UTC time, maintained as
+    # observations are inserted (see devices.update_latest_observations)
+    last_observation_id = db.Column(db.Integer, nullable=True)
+
+
+class ObservationRollup(db.Model):
+    """Pre-aggregated metrics for a device over an hour or a day, maintained
+    as observations are created."""
+
+    device_id = db.Column(
+        db.Integer, db.ForeignKey("device.id"), primary_key=True
+    )
+    granularity = db.Column(db.String(5), primary_key=True)  # hour or day
+    bucket_start = db.Column(db.DateTime, primary_key=True)  # In UTC
+    count = db.Column(db.Integer, nullable=False)
+    water_temp_sum = db.Column(db.BigInteger, nullable=False)
+    water_temp_min = db.Column(db.Integer, nullable=False)
+    water_temp_max = db.Column(db.Integer, nullable=False)
+    air_temp_sum = db.Column(db.BigInteger, nullable=False)
+    air_temp_min = db.Column(db.Integer, nullable=False)
+    air_temp_max = db.Column(db.Integer, nullable=False)
+    wind_speed_sum = db.Column(db.BigInteger, nullable=False)
+    wind_speed_min = db.Column(db.Integer, nullable=False)
+    wind_speed_max = db.Column(db.Integer, nullable=False)
+    wind_direction_sum = db.Column(db.BigInteger, nullable=False)
+    wind_direction_min = db.Column(db.Integer, nullable=False)
+    wind_direction_max = db.Column(db.Integer, nullable=False)
+    humidity_sum = db.Column(db.BigInteger, nullable=False)
+    humidity_min = db.Column(db.Integer, nullable=False)
+    humidity_max = db.Column(db.Integer, nullable=False)
+    haze_percent_sum = db.Column(db.BigInteger, nullable=False)
+    haze_percent_min = db.Column(db.Integer, nullable=False)
+    haze_percent_max = db.Column(db.Integer, nullable=False)
+    precipitation_mm_sum = db.Column(db.BigInteger, nullable=False)
+    precipitation_mm_min = db.Column(db.Integer, nullable=False)
+    precipitation_mm_max = db.Column(db.Integer, nullable=False)
+    radiation_bq_sum = db.Column(db.BigInteger, nullable=False)
+    radiation_bq_min = db.Column(db.Integer, nullable=False)
+    radiation_bq_max = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        # Supports reading the rollups for all devices over a time range.
+        db.Index("ix_observation_rollup_bucket", "granularity", "bucket_start"),
+    )
+
+
+class ObservationSketch(db.Model):
+    """A quantile sketch of one metric of a device's observations over a UTC
+    day, maintained as observations are created."""
+
+    device_id = db.Column(
+        db.Integer, db.ForeignKey("device.id"), primary_key=True
+    )
+    metric = db.Column(db.String(20), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)  # In UTC
+    sketch = db.Column(db.LargeBinary, nullable=False)  # A serialised KLLSketch
+
+    __table_args__ = (
+        # Supports reading the sketches for all devices over a range of days.
+        db.Index("ix_observation_sketch_day", "metric", "day"),
+    )
@@ -0,0 +1,249 @@
+"""Keyset (cursor) pagination for observation and device queries."""
+
+import base64
+import json
+from datetime import date, time
+
+from sqlalchemy import and_, or_
+
+from models import Observation
+
+# Number of observations returned per page when a cursor is supplied without
+# an explicit limit, and the largest page a client is allowed to request.
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# The columns that define the stable ordering pages are taken from. The id is
+# included as a tie-breaker so that every row has a unique position.
+KEYSET_ORDER = (
+    Observation.date_logged,
+    Observation.time_logged,
+    Observation.id,
+)
+
+
+def keyset_key(row):
+    """Gets the position of an observation row in the keyset ordering."""
+
+    return (row.date_logged, row.time_logged, row.id)
+
+
+def keyset_columns(field_names):
+    """Gets the keyset columns that need selecting alongside a set of fields
+    for rows to be ordered and paged through.
+
+    Args:
+        field_names (tuple): The observation fields being selected.
+
+    Returns:
+        list: The keyset columns not among the fields.
+    """
+
+    return [c for c in KEYSET_ORDER if c.key not in field_names]
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+class InvalidLimitError(ValueError):
+    """Raised when a page limit isn't a whole number in the allowed range."""
+
+
+def parse_limit(value):
+    """Parses the page limit supplied by a client.
+
+    Args:
+        value (str): The limit, or None if none was supplied.
+
+    Raises:
+        InvalidLimitError: If the limit isn't a whole number between 1 and
+            MAX_PAGE_SIZE.
+
+    Returns:
+        int: The limit, or DEFAULT_PAGE_SIZE if none was supplied.
+    """
+
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+
+    message = f"Limit must be a whole number between 1 and {MAX_PAGE_SIZE}"
+
+    try:
+        limit = int(value)
+    except ValueError as error:
+        raise InvalidLimitError(message) from error
+
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise InvalidLimitError(message)
+
+    return limit
+
+
+def _encode_key(key):
+    """Encodes a list of JSON values as an opaque, URL-safe cursor."""
+
+    payload = json.dumps(key, separators=(",", ":")).encode("utf-8")
+
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def _decode_key(cursor):
+    """Decodes a cursor produced by _encode_key.
+
+    Raises:
+        ValueError: If the cursor isn't valid base64-encoded JSON.
+    """
+
+    padded = cursor + "=" * (-len(cursor) % 4)
+
+    return json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+
+
+def encode_cursor(observation):
+    """Builds an opaque cursor pointing just after the given observation.
+
+    Args:
+        observation: The last observation on the current page.
+
+    Returns:
+        str: A URL-safe cursor string.
+    """
+
+    return _encode_key(
+        [
+            observation.date_logged.isoformat(),
+            observation.time_logged.isoformat(),
+            observation.id,
+        ]
+    )
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor produced by encode_cursor.
+
+    Args:
+        cursor (str): The cursor supplied by the client.
+
+    Raises:
+        InvalidCursorError: If the cursor is malformed.
+
+    Returns:
+        tuple: The (date_logged, time_logged, id) key of the last row seen.
+    """
+
+    try:
+        date_logged, time_logged, observation_id = _decode_key(cursor)
+
+        if not isinstance(observation_id, int):
+            raise InvalidCursorError("Invalid cursor")
+
+        return (
+            date.fromisoformat(date_logged),
+            time.fromisoformat(time_logged),
+            observation_id,
+        )
+    except (TypeError, ValueError) as error:
+        raise InvalidCursorError("Invalid cursor") from error
+
+
+def _fetch_all(query):
+    """Runs a query against the database."""
+
+    return query.all()
+
+
+def paginate(query, limit, cursor=None, fetch=None):
+    """Fetches a single page of observations using keyset pagination.
+
+    Rather than skipping rows with OFFSET, which gets slower the deeper a
+    client pages, each page seeks directly past the last row of the previous
+    page so that every page costs the same.
+
+    Args:
+        query: An Observation query with any filters already applied.
+        limit (int): The maximum number of observations to return.
+        cursor (str, optional): The cursor returned with the previous page.
+        fetch (callable, optional): Runs the final query and returns its rows
+            in keyset order. Defaults to running it against the database.
+
+    Raises:
+        InvalidCursorError: If the cursor is malformed.
+
+    Returns:
+        tuple: The observations on the page and the cursor for the next page,
+        which is None when there are no more results.
+    """
+
+    if fetch is None:
+        fetch = _fetch_all
+
+    if cursor:
+        date_logged, time_logged, observation_id = decode_cursor(cursor)
+
+        # The leading date predicate is redundant but lets the database seek
+        # straight to the right place in an index on date_logged.
+        query = query.filter(
+            Observation.date_logged >= date_logged,
+            or_(
+                Observation.date_logged > date_logged,
+                and_(
+                    Observation.date_logged == date_logged,
+                    or_(
+                        Observation.time_logged > time_logged,
+                        and_(
+                            Observation.time_logged == time_logged,
+                            Observation.id > observation_id,
+                        ),
+                    ),
+                ),
+            ),
+        )
+
+    # Fetch one extra row so we know whether there is another page without a
+    # separate COUNT query.
+    rows = fetch(query.order_by(*KEYSET_ORDER).limit(limit + 1))
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+
+    return rows, None
+
+
+def paginate_by_id(query, id_column, limit, cursor=None):
+    """Fetches a single page of rows ordered by id using keyset pagination.
+
+    Args:
+        query: A query with any filters already applied.
+        id_column: The primary key column to order and seek by, which must
+            also be the first column selected.
+        limit (int): The maximum number of rows to return.
+        cursor (str, optional): The cursor returned with the previous page.
+
+    Raises:
+        InvalidCursorError: If the cursor is malformed.
+
+    Returns:
+        tuple: The rows on the page and the cursor for the next page, which
+        is None when there are no more results.
+    """
+
+    if cursor:
+        try:
+            (last_id,) = _decode_key(cursor)
+        except (TypeError, ValueError) as error:
+            raise InvalidCursorError("Invalid cursor") from error
+
+        if not isinstance(last_id, int):
+            raise InvalidCursorError("Invalid cursor")
+
+        query = query.filter(id_column > last_id)
+
+    rows = query.order_by(id_column).limit(limit + 1).all()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, _encode_key([rows[-1][0]])
+
+    return rows, None
@@ -0,0 +1,393 @@
+"""Admission control, so that one client can't starve the others.
+
+Each user gets a token bucket for reads and another for writes, so a client
+polling expensive reads can't use up the budget sensor gateways need to
+ingest. A bucket holds up to its burst of tokens and refills at its rate per
+second, and every request takes one token. A request that finds the bucket
+empty gets a 429 with a Retry-After of how long until a token is available.
+
+Expensive queries are also capped at a number running at once. A query that
+would exceed the cap is refused with a 503 rather than queued, as a queue of
+slow queries only makes them all slower.
+
+The limiter state lives in a backend. The in-memory backend is per process,
+so each worker enforces the limits separately. The SQLite backend keeps the
+state in a file shared by every worker on the host, as a local stand-in for a
+shared store such as Redis.
+"""
+
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, g, jsonify, request
+
+from config import get_config
+
+# The number of idle buckets the in-memory backend keeps. An evicted bucket
+# would have refilled anyway, unless its user has been idle only briefly.
+MAX_BUCKETS = 10000
+
+# How long a slot for an expensive query is held in the SQLite backend before
+# it is assumed the worker holding it died.
+SLOT_LEASE_SECONDS = 300
+
+# Guards creating the limiter backend for an app.
+_extension_lock = threading.Lock()
+
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def _refill(tokens, updated_at, now, rate, burst):
+    """Gets the tokens in a bucket after refilling it for the time elapsed.
+
+    Args:
+        tokens (float): The tokens in the bucket when last updated, or None
+            for a new bucket, which starts full.
+        updated_at (float): When the bucket was last updated.
+        now (float): The current time.
+        rate (float): The tokens added per second.
+        burst (int): The most tokens the bucket holds.
+
+    Returns:
+        float: The tokens now in the bucket.
+    """
+
+    if tokens is None:
+        return burst
+
+    return min(burst, tokens + max(0, now - updated_at) * rate)
+
+
+def _take(tokens, rate):
+    """Takes a token from a bucket if it has one.
+
+    Args:
+        tokens (float): The tokens in the bucket.
+        rate (float): The tokens added per second.
+
+    Returns:
+        tuple: The tokens left, and the seconds until a token is available,
+        which is 0 if one was taken.
+    """
+
+    if tokens >= 1:
+        return tokens - 1, 0
+
+    return tokens, (1 - tokens) / rate
+
+
+class MemoryBackend:
+    """Limiter state held in the memory of the current process."""
+
+    def __init__(self):
+        """Initialises the backend with no buckets or slots taken."""
+
+        self._buckets = OrderedDict()
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """Takes a token from a bucket.
+
+        Args:
+            key (str): The bucket.
+            rate (float): The tokens added to the bucket per second.
+            burst (int): The most tokens the bucket holds.
+
+        Returns:
+            float: 0 if a token was taken, otherwise the seconds until one
+            will be available.
+        """
+
+        now = time.monotonic()
+
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (None, now))
+            tokens, wait = _take(
+                _refill(tokens, updated_at, now, rate, burst), rate
+            )
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+
+            while len(self._buckets) > MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+
+        return wait
+
+    def acquire(self, name, limit):
+        """Takes one of a limited number of slots.
+
+        Args:
+            name (str): The group of slots.
+            limit (int): The number of slots in the group.
+
+        Returns:
+            The slot to release once done, or None if every slot is taken.
+        """
+
+        with self._lock:
+            if self._slots.get(name, 0) >= limit:
+                return None
+
+            self._slots[name] = self._slots.get(name, 0) + 1
+            return name
+
+    def release(self, slot):
+        """Releases a slot taken with acquire."""
+
+        with self._lock:
+            self._slots[slot] -= 1
+
+
+class SQLiteBackend:
+    """Limiter state held in a SQLite database, shared by every process that
+    opens the same file."""
+
+    def __init__(self, path, timeout):
+        """Creates the tables if needed.
+
+        Args:
+            path (str): The path of the database file.
+            timeout (float): The seconds to wait for another process to
+                finish updating the state.
+        """
+
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+        with self._transaction() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit_bucket "
+                "(key TEXT PRIMARY KEY, tokens REAL, updated_at REAL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit_slot "
+                "(id INTEGER PRIMARY KEY, name TEXT, expires_at REAL)"
+            )
+
+    @contextmanager
+    def _transaction(self):
+        """Runs a transaction on this thread's connection, holding the write
+        lock from the start so that the state read can't change before it is
+        written back."""
+
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def take(self, key, rate, burst):
+        """Takes a token from a bucket.
+
+        Args:
+            key (str): The bucket.
+            rate (float): The tokens added to the bucket per second.
+            burst (int): The most tokens the bucket holds.
+
+        Returns:
+            float: 0 if a token was taken, otherwise the seconds until one
+            will be available.
+        """
+
+        # Wall clock time, as monotonic clocks aren't comparable between
+        # processes.
+        now = time.time()
+
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT tokens, updated_at FROM rate_limit_bucket "
+                "WHERE key = ?",
+                (key,),
+            ).fetchone()
+            tokens, updated_at = row or (None, now)
+            tokens, wait = _take(
+                _refill(tokens, updated_at, now, rate, burst), rate
+            )
+            connection.execute(
+                "INSERT INTO rate_limit_bucket (key, tokens, updated_at) "
+                "VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+                "tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (key, tokens, now),
+            )
+
+        return wait
+
+    def acquire(self, name, limit):
+        """Takes one of a limited number of slots.
+
+        Slots are leased for SLOT_LEASE_SECONDS, so those held by a worker
+        that died are eventually freed.
+
+        Args:
+            name (str): The group of slots.
+            limit (int): The number of slots in the group.
+
+        Returns:
+            The slot to release once done, or None if every slot is taken.
+        """
+
+        now = time.time()
+
+        with self._transaction() as connection:
+            connection.execute(
+                "DELETE FROM rate_limit_slot WHERE expires_at <= ?", (now,)
+            )
+            (taken,) = connection.execute(
+                "SELECT COUNT(*) FROM rate_limit_slot WHERE name = ?", (name,)
+            ).fetchone()
+
+            if taken >= limit:
+                return None
+
+            return connection.execute(
+                "INSERT INTO rate_limit_slot (name, expires_at) VALUES (?, ?)",
+                (name, now + SLOT_LEASE_SECONDS),
+            ).lastrowid
+
+    def release(self, slot):
+        """Releases a slot taken with acquire."""
+
+        with self._transaction() as connection:
+            connection.execute(
+                "DELETE FROM rate_limit_slot WHERE id = ?", (slot,)
+            )
+
+
+# Creates each backend from the configuration.
+RATE_LIMIT_BACKENDS = {
+    "memory": lambda app_config: MemoryBackend(),
+    "sqlite": lambda app_config: SQLiteBackend(
+        app_config.rate_limit_database,
+        app_config.sqlite_busy_timeout_ms / 1000,
+    ),
+}
+
+
+def get_limiter_backend():
+    """Gets the limiter backend for the current app, creating it if needed.
+
+    Returns:
+        The configured backend.
+    """
+
+    with _extension_lock:
+        backend = current_app.extensions.get("rate_limiter")
+
+        if backend is None:
+            app_config = get_config()
+            backend = current_app.extensions["rate_limiter"] = (
+                RATE_LIMIT_BACKENDS[app_config.rate_limit_backend](app_config)
+            )
+
+        return backend
+
+
+def _budget():
+    """Gets the budget the current request is charged to, with its rate and
+    burst."""
+
+    app_config = get_config()
+
+    if request.method in READ_METHODS:
+        return (
+            "read",
+            app_config.rate_limit_read_rate,
+            app_config.rate_limit_read_burst,
+        )
+
+    return (
+        "write",
+        app_config.rate_limit_write_rate,
+        app_config.rate_limit_write_burst,
+    )
+
+
+def _retry_response(message, status, seconds):
+    """Builds a response telling the client to retry after some seconds."""
+
+    response = jsonify(message=message)
+    response.headers["Retry-After"] = str(max(1, math.ceil(seconds)))
+
+    return response, status
+
+
+def check_rate_limit(user):
+    """Charges the current request to the user's budget for its method.
+
+    Args:
+        user (str): Who the request is made by.
+
+    Returns:
+        tuple: A 429 response if the budget is used up, otherwise None.
+    """
+
+    budget, rate, burst = _budget()
+
+    if rate <= 0:
+        return None
+
+    wait = get_limiter_backend().take(f"{budget}:{user}", rate, burst)
+
+    if wait:
+        return _retry_response(
+            f"Too many {budget} requests, please slow down", 429, wait
+        )
+
+    return None
+
+
+def limit_concurrency(f):
+    """Decorator to cap the number of expensive queries running at once.
+
+    The slot taken is released by release_query_slot when the request is torn
+    down, which for a response streamed with its context is once it has been
+    sent.
+    """
+
+    @wraps(f)
+    def decorator(*args, **kwargs):
+        limit = get_config().max_concurrent_queries
+
+        if limit > 0:
+            slot = get_limiter_backend().acquire("expensive_queries", limit)
+
+            if slot is None:
+                return _retry_response(
+                    "The server is busy, please retry", 503, 1
+                )
+
+            g.query_slot = slot
+
+        return f(*args, **kwargs)
+
+    return decorator
+
+
+def release_query_slot(error=None):
+    """Releases the slot for an expensive query held by the request, if any.
+
+    Registered to run when each request is torn down.
+    """
+
+    slot = g.pop("query_slot", None)
+
+    if slot is not None:
+        get_limiter_backend().release(slot)
@@ -0,0 +1,323 @@
+"""Read/write splitting across the primary database and its replicas.
+
+The session sends the queries made while handling a GET request to one of the
+replicas listed in DATABASE_REPLICA_URIS, taking turns between the replicas
+request by request. Everything else, i.e. writes, requests with other methods,
+and work outside a request such as the ingest queue and the utility scripts,
+uses the primary.
+
+Replicas lag behind the primary, so a client that has just written could read
+stale data. Reads by a client within READ_YOUR_WRITES_SECONDS of its last
+write therefore go to the primary too, and bypass the response cache, which
+may hold a response read from a replica. Writes are remembered by each worker,
+so this relies on a client's requests reaching the same worker, or on the
+window being longer than the replication lag.
+
+Each replica is checked with a trivial query every
+REPLICA_HEALTH_CHECK_SECONDS, and one that fails the check, or fails a query
+with a connection error, is ejected until it passes a later check. Reads fall
+back to the primary if every replica has been ejected.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from sqlalchemy.sql.expression import UpdateBase
+
+from config import config
+from ratelimit import READ_METHODS
+
+# The number of recent writers each worker remembers. A writer forgotten
+# early only reads from a replica sooner than it would otherwise.
+MAX_WRITERS = 10000
+
+# The query run to check that a replica is up.
+HEALTH_CHECK_QUERY = "SELECT 1"
+
+
+def check_replica(engine):
+    """Checks whether a replica can be queried.
+
+    Args:
+        engine (Engine): The replica's engine.
+
+    Returns:
+        bool: Whether the health check query succeeded.
+    """
+
+    try:
+        with engine.connect() as connection:
+            connection.execute(text(HEALTH_CHECK_QUERY))
+    except SQLAlchemyError:
+        return False
+
+    return True
+
+
+class ReplicaSet:
+    """The replicas of an app's database, with their health and the clients
+    that have written recently."""
+
+    def __init__(self, engines, read_your_writes_seconds, check_seconds):
+        """Initialises the set with every replica yet to be checked.
+
+        Args:
+            engines (list): The engine of each replica.
+            read_your_writes_seconds (float): How long a client's reads go to
+                the primary after it writes.
+            check_seconds (float): How often each replica is checked.
+        """
+
+        self.engines = list(engines)
+        self.read_your_writes_seconds = read_your_writes_seconds
+        self.check_seconds = check_seconds
+        self._next = 0
+        self._health = {}
+        self._writes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record_write(self, client):
+        """Notes that a client has just written.
+
+        Args:
+            client (str): Who made the write.
+        """
+
+        with self._lock:
+            self._writes[client] = time.monotonic()
+            self._writes.move_to_end(client)
+
+            while len(self._writes) > MAX_WRITERS:
+                self._writes.popitem(last=False)
+
+    def wrote_recently(self, client):
+        """Checks whether a client wrote within the read-your-writes window.
+
+        Args:
+            client (str): Who is reading.
+
+        Returns:
+            bool: Whether the client's reads should go to the primary.
+        """
+
+        with self._lock:
+            written_at = self._writes.get(client)
+
+        return (
+            written_at is not None
+            and time.monotonic() - written_at < self.read_your_writes_seconds
+        )
+
+    def eject(self, engine):
+        """Stops using a replica until it passes its next health check.
+
+        Args:
+            engine (Engine): The replica's engine.
+        """
+
+        with self._lock:
+            self._health[engine] = (False, time.monotonic())
+
+    def is_healthy(self, engine):
+        """Checks whether a replica can be used, running its health check if
+        it is due.
+
+        Args:
+            engine (Engine): The replica's engine.
+
+        Returns:
+            bool: Whether the replica passed its last health check.
+        """
+
+        now = time.monotonic()
+
+        with self._lock:
+            healthy, checked_at = self._health.get(engine, (None, None))
+
+        if healthy is not None and now - checked_at < self.check_seconds:
+            return healthy
+
+        healthy = check_replica(engine)
+
+        with self._lock:
+            self._health[engine] = (healthy, now)
+
+        return healthy
+
+    def choose(self):
+        """Chooses the next healthy replica in turn.
+
+        Returns:
+            Engine: The replica's engine, or None if none are healthy.
+        """
+
+        with self._lock:
+            start = self._next
+            self._next = (start + 1) % len(self.engines)
+
+        for offset in range(len(self.engines)):
+            engine = self.engines[(start + offset) % len(self.engines)]
+
+            if self.is_healthy(engine):
+                return engine
+
+        return None
+
+    def watch(self):
+        """Ejects a replica as soon as a query on it fails to connect."""
+
+        for engine in self.engines:
+
+            def _eject_on_error(context, engine=engine):
+                if context.is_disconnect or isinstance(
+                    context.sqlalchemy_exception, OperationalError
+                ):
+                    self.eject(engine)
+
+            event.listen(engine, "handle_error", _eject_on_error)
+
+    def dispose(self):
+        """Closes the pooled connections to every replica."""
+
+        for engine in self.engines:
+            engine.dispose()
+
+
+def configure_replicas(app, app_config=config):
+    """Creates the engines for the configured replicas of an app's database.
+
+    Args:
+        app (Flask): The app.
+        app_config (Config, optional): The configuration listing the
+            replicas. Defaults to the configuration loaded from .env.
+
+    Returns:
+        ReplicaSet: The replicas, or None if there aren't any.
+    """
+
+    if not app_config.database_replica_uris:
+        return None
+
+    replicas = app.extensions["database_replicas"] = ReplicaSet(
+        [
+            create_engine(
+                uri,
+                echo=app_config.database_echo,
+                **app_config.engine_options(uri),
+            )
+            for uri in app_config.database_replica_uris
+        ],
+        app_config.read_your_writes_seconds,
+        app_config.replica_health_check_seconds,
+    )
+    replicas.watch()
+
+    return replicas
+
+
+def get_replica_set():
+    """Gets the replicas of the current app's database.
+
+    Returns:
+        ReplicaSet: The replicas, or None if there aren't any.
+    """
+
+    return current_app.extensions.get("database_replicas")
+
+
+def _client():
+    """Identifies who is making the current request."""
+
+    return g.get("user") or request.remote_addr
+
+
+def record_write(response):
+    """Notes that the client made a write, if the current request could have
+    written.
+
+    Registered to run after each request.
+    """
+
+    replicas = get_replica_set()
+
+    if replicas is not None and request.method not in READ_METHODS:
+        replicas.record_write(_client())
+
+    return response
+
+
+def client_wrote_recently():
+    """Checks whether the client making the current request has written
+    within the read-your-writes window, so must read from the primary.
+
+    Returns:
+        bool: Whether the client wrote recently. Always False without
+        replicas, as every read is then from the primary anyway.
+    """
+
+    replicas = get_replica_set()
+
+    return replicas is not None and replicas.wrote_recently(_client())
+
+
+def choose_replica():
+    """Chooses the replica to read from for the current request.
+
+    Returns:
+        Engine: The replica's engine, or None to use the primary.
+    """
+
+    replicas = get_replica_set()
+
+    if (
+        replicas is None
+        or request.method not in READ_METHODS
+        or client_wrote_recently()
+    ):
+        return None
+
+    return replicas.choose()
+
+
+class RoutingSession(Session):
+    """A session that reads from a replica while handling GET requests.
+
+    The replica is chosen on the first query in a request, so that every read
+    in the request sees the same replica. Once the session writes, it uses the
+    primary for the rest of the request, so that it can read back what it
+    wrote.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        """Gets the engine for a query, which is the chosen replica for reads
+        where one should be used, and otherwise the primary."""
+
+        if bind is None and has_request_context():
+            if self._flushing or isinstance(clause, UpdateBase):
+                self.info["replica"] = None
+            elif "replica" not in self.info:
+                self.info["replica"] = choose_replica()
+
+            if self.info["replica"] is not None:
+                return self.info["replica"]
+
+        return super().get_bind(
+            mapper=mapper, clause=clause, bind=bind, **kwargs
+        )
+
+
+def forget_replica(error=None):
+    """Lets the next request using the same session choose its own replica.
+
+    Registered to run when each request is torn down.
+    """
+
+    extension = current_app.extensions.get("sqlalchemy")
+
+    if extension is not None and extension.session.registry.has():
+        extension.session.info.pop("replica", None)
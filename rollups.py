@@ -0,0 +1,350 @@
+"""Incrementally maintained hourly and daily rollups of observation metrics.
+
+Each time observations are created, the count, sum, min and max of every
+metric are merged into a rollup row per device and bucket in the same
+transaction. Aggregate queries can then read one row per bucket rather than
+every raw observation.
+"""
+
+import functools
+import itertools
+from operator import attrgetter, itemgetter
+
+from sqlalchemy import event, func
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from aggregates import AGGREGATE_METRICS, bucket_expression
+from archive import archived_observations
+from models import Observation, ObservationRollup, db, parse_utc_datetime
+
+# Functions truncating a UTC timestamp to the start of its rollup bucket.
+GRANULARITIES = {
+    "hour": lambda timestamp: timestamp.replace(
+        minute=0, second=0, microsecond=0
+    ),
+    "day": lambda timestamp: timestamp.replace(
+        hour=0, minute=0, second=0, microsecond=0
+    ),
+}
+
+# The rollup granularity each aggregate bucket size is served from.
+BUCKET_GRANULARITIES = {"hour": "hour", "day": "day", "month": "day"}
+
+# The query parameters, besides those choosing the aggregation, that rollups
+# can still answer. An observed_to bound can't be, as it is inclusive and so
+# always includes part of the bucket starting at that time.
+ROLLUP_FILTERS = {"device_id", "observed_from"}
+
+
+def _fields(observations, names):
+    """Reads fields from each of a set of Observation instances or
+    dictionaries.
+
+    Args:
+        observations (iterable): Observation instances or dictionaries.
+        names (tuple): The names of the fields to read.
+
+    Yields:
+        tuple: The values of the fields of each observation.
+    """
+
+    get_item, get_attribute = itemgetter(*names), attrgetter(*names)
+
+    for observation in observations:
+        if isinstance(observation, dict):
+            yield get_item(observation)
+        else:
+            yield get_attribute(observation)
+
+
+def _add_totals(totals, key, count, sums, mins, maxes):
+    """Adds the count, sums, minima and maxima of some observations to the
+    running totals of a bucket."""
+
+    bucket = totals.get(key)
+
+    if bucket is None:
+        totals[key] = [count, list(sums), list(mins), list(maxes)]
+        return
+
+    bucket[0] += count
+    bucket_sums, bucket_mins, bucket_maxes = bucket[1:]
+    for index, value in enumerate(sums):
+        bucket_sums[index] += value
+        if mins[index] < bucket_mins[index]:
+            bucket_mins[index] = mins[index]
+        if maxes[index] > bucket_maxes[index]:
+            bucket_maxes[index] = maxes[index]
+
+
+def rollup_deltas(observations):
+    """Combines observations into rollup rows for each device and bucket.
+
+    The observations are totalled by hour, and the hourly totals then by day,
+    so that each observation is only read once.
+
+    Args:
+        observations (iterable): Observation instances or dictionaries with
+            device_id, observed_at_utc and every metric populated.
+
+    Returns:
+        dict: Rollup column values keyed by (device_id, granularity,
+        bucket_start).
+    """
+
+    hours = {}
+    truncate_hour = GRANULARITIES["hour"]
+
+    names = ("device_id", "observed_at_utc", *AGGREGATE_METRICS)
+
+    for device_id, observed_at, *values in _fields(observations, names):
+        key = (device_id, truncate_hour(observed_at))
+        _add_totals(hours, key, 1, values, values, values)
+
+    days = {}
+    truncate_day = GRANULARITIES["day"]
+
+    for (device_id, hour), totals in hours.items():
+        _add_totals(days, (device_id, truncate_day(hour)), *totals)
+
+    deltas = {}
+
+    for granularity, totals in (("hour", hours), ("day", days)):
+        for (device_id, bucket_start), bucket in totals.items():
+            count, sums, mins, maxes = bucket
+            delta = deltas[(device_id, granularity, bucket_start)] = {
+                "device_id": device_id,
+                "granularity": granularity,
+                "bucket_start": bucket_start,
+                "count": count,
+            }
+            for index, metric in enumerate(AGGREGATE_METRICS):
+                delta[f"{metric}_sum"] = sums[index]
+                delta[f"{metric}_min"] = mins[index]
+                delta[f"{metric}_max"] = maxes[index]
+
+    return deltas
+
+
+@functools.lru_cache
+def _upsert_statement(dialect_name):
+    """Builds an insert that merges into an existing rollup row.
+
+    Args:
+        dialect_name (str): The name of the database dialect in use.
+
+    Raises:
+        NotImplementedError: If the database is not supported.
+
+    Returns:
+        The upsert statement, to be executed with a list of rollup rows.
+    """
+
+    table = ObservationRollup.__table__
+
+    if dialect_name == "sqlite":
+        statement = sqlite.insert(table)
+        new = statement.excluded
+        # SQLite's multi-argument min() and max() are scalar functions.
+        least, greatest = func.min, func.max
+    elif dialect_name == "postgresql":
+        statement = postgresql.insert(table)
+        new = statement.excluded
+        least, greatest = func.least, func.greatest
+    elif dialect_name in ("mysql", "mariadb"):
+        statement = mysql.insert(table)
+        new = statement.inserted
+        least, greatest = func.least, func.greatest
+    else:
+        raise NotImplementedError(
+            f"Rollups are not supported for {dialect_name} databases"
+        )
+
+    updates = {"count": table.c.count + new.count}
+    for metric in AGGREGATE_METRICS:
+        updates[f"{metric}_sum"] = (
+            table.c[f"{metric}_sum"] + new[f"{metric}_sum"]
+        )
+        updates[f"{metric}_min"] = least(
+            table.c[f"{metric}_min"], new[f"{metric}_min"]
+        )
+        updates[f"{metric}_max"] = greatest(
+            table.c[f"{metric}_max"], new[f"{metric}_max"]
+        )
+
+    if isinstance(statement, mysql.Insert):
+        return statement.on_duplicate_key_update(updates)
+
+    return statement.on_conflict_do_update(
+        index_elements=list(table.primary_key.columns), set_=updates
+    )
+
+
+def update_rollups(observations, session=None):
+    """Merges newly created observations into the rollup tables.
+
+    This should be called in the same transaction that inserts the
+    observations, and the caller is responsible for committing the session.
+    Observations added through the ORM are rolled up automatically when the
+    session is flushed, so this only needs calling for Core inserts.
+
+    Args:
+        observations (iterable): Observation instances or dictionaries with
+            device_id, observed_at_utc and every metric populated.
+        session (Session, optional): The session to use. Defaults to
+            db.session.
+    """
+
+    session = session or db.session
+    deltas = rollup_deltas(observations)
+
+    if deltas:
+        dialect_name = session.get_bind().dialect.name
+        session.execute(_upsert_statement(dialect_name), list(deltas.values()))
+
+
+@event.listens_for(Session, "after_flush")
+def _rollup_flushed_observations(session, flush_context):
+    """Rolls up observations inserted through the ORM as part of the same
+    flush."""
+
+    # At this point the session's new list still holds the objects that were
+    # just inserted.
+    observations = [
+        instance
+        for instance in session.new
+        if isinstance(instance, Observation)
+    ]
+
+    if observations:
+        update_rollups(observations, session)
+
+
+def can_use_rollups(args):
+    """Checks whether an aggregate request can be answered from rollups.
+
+    Rollups only hold whole buckets, so a time range has to start on a bucket
+    boundary and no filters on individual observations can be applied.
+
+    Args:
+        args (MultiDict): The request query parameters.
+
+    Returns:
+        bool: True if the rollups give the same answer as the raw
+        observations.
+    """
+
+    bucket = args.get("bucket", "day")
+    truncate = GRANULARITIES[BUCKET_GRANULARITIES[bucket]]
+    filters = set(args) - {"bucket", "group_by", "metrics"}
+
+    if not filters <= ROLLUP_FILTERS:
+        return False
+
+    if "observed_from" in args:
+        try:
+            observed_from = parse_utc_datetime(args["observed_from"])
+        except ValueError:
+            return False
+
+        if truncate(observed_from) != observed_from:
+            return False
+
+    return True
+
+
+def rollup_query(
+    bucket,
+    metrics,
+    group_by_device=False,
+    device_id=None,
+    observed_from=None,
+):
+    """Builds a query aggregating rollup rows into the requested buckets.
+
+    The result rows have the same columns as aggregates.aggregate_query, so
+    they can be formatted with aggregates.format_aggregates.
+
+    Args:
+        bucket (str): One of aggregates.BUCKETS.
+        metrics (list): The names of the metrics to aggregate.
+        group_by_device (bool): Whether to aggregate each device separately.
+        device_id (int, optional): Only include this device.
+        observed_from (datetime, optional): Only include buckets starting at
+            or after this time.
+
+    Returns:
+        Query: The aggregate query.
+    """
+
+    dialect_name = db.session.get_bind().dialect.name
+    bucket_column = bucket_expression(
+        ObservationRollup.bucket_start, bucket, dialect_name
+    ).label("bucket")
+
+    group_by = [bucket_column]
+    if group_by_device:
+        group_by.append(ObservationRollup.device_id)
+
+    count = func.sum(ObservationRollup.count)
+    columns = [*group_by, count.label("count")]
+    for metric in metrics:
+        total = func.sum(getattr(ObservationRollup, f"{metric}_sum"))
+        columns += [
+            func.min(getattr(ObservationRollup, f"{metric}_min")).label(
+                f"{metric}_min"
+            ),
+            func.max(getattr(ObservationRollup, f"{metric}_max")).label(
+                f"{metric}_max"
+            ),
+            (total * 1.0 / count).label(f"{metric}_avg"),
+        ]
+
+    query = db.session.query(*columns).filter(
+        ObservationRollup.granularity == BUCKET_GRANULARITIES[bucket]
+    )
+
+    if device_id is not None:
+        query = query.filter(ObservationRollup.device_id == device_id)
+    if observed_from is not None:
+        query = query.filter(ObservationRollup.bucket_start >= observed_from)
+
+    return query.group_by(*group_by).order_by(*group_by)
+
+
+def rebuild_rollups(chunk_size=10000):
+    """Recreates every rollup from the raw observations, including those in
+    archived months, e.g. after a backfill.
+
+    Observations are read and merged a chunk at a time so that memory use
+    stays bounded. The caller is responsible for committing the session.
+
+    Args:
+        chunk_size (int): The number of observations merged at a time.
+
+    Returns:
+        int: The number of observations rolled up.
+    """
+
+    db.session.query(ObservationRollup).delete()
+
+    names = ("device_id", "observed_at_utc", *AGGREGATE_METRICS)
+    rows = db.session.query(
+        *(getattr(Observation, name) for name in names)
+    ).yield_per(chunk_size)
+
+    total = 0
+    chunk = []
+    for row in itertools.chain(
+        archived_observations(names), (row._asdict() for row in rows)
+    ):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            update_rollups(chunk)
+            total += len(chunk)
+            chunk = []
+
+    update_rollups(chunk)
+
+    return total + len(chunk)
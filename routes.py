@@ -1,19 +1,95 @@
 """Defines routes and handler functions."""
 
 from datetime import datetime, timedelta, timezone
+from functools import partial
 
 import jwt
-from flask import Blueprint, jsonify, request
+from flask import (
+    Blueprint,
+    Response,
+    jsonify,
+    request,
+    stream_with_context,
+    url_for,
+)
 from marshmallow import ValidationError
 
+from aggregates import (
+    AGGREGATE_METRICS,
+    BUCKETS,
+    aggregate_query,
+    combine_aggregates,
+    format_aggregates,
+)
+from archive import fetch_all, get_archive_catalog, query_month
 from auth import token_required
-from config import config
-from models import Observation, db
+from cache import cached_response, invalidate_responses
+from config import get_config
+from devices import device_query
+from downsample import (
+    DEFAULT_SERIES_POINTS,
+    MAX_SERIES_POINTS,
+    downsample_series,
+)
+from export import EXPORT_FORMATS, EXPORT_GENERATORS
+from filters import (
+    DEVICE_FILTERS,
+    OBSERVATION_FILTERS,
+    SKETCH_FILTERS,
+    InvalidFilterError,
+)
+from ingest import (
+    INGEST_READERS,
+    ingest_rows,
+    natural_key,
+    save_new,
+    validate_row,
+)
+from ingest_queue import QUEUED, QueueFullError, get_ingest_queue
+from metrics import instrument, render_metrics, serialization_timer
+from models import Device, Observation, ObservationSketch, db
+from pagination import (
+    InvalidCursorError,
+    InvalidLimitError,
+    decode_cursor,
+    keyset_columns,
+    keyset_key,
+    paginate,
+    paginate_by_id,
+    parse_limit,
+)
+from ratelimit import limit_concurrency, release_query_slot
+from replicas import forget_replica, record_write
+from rollups import can_use_rollups, rollup_query
 from schemas import DeviceSchema, ObservationSchema
+from serializers import (
+    InvalidFieldsError,
+    device_serializer,
+    observation_serializer,
+    parse_fields,
+)
+from sketches import (
+    DEFAULT_PERCENTILES,
+    SKETCH_GROUPS,
+    SKETCH_METRICS,
+    format_stats,
+    merge_sketches,
+)
 
 # Create a Flask Blueprint for the routes
 api = Blueprint("api", __name__)
 
+# Record the latency, SQL statements and response size of every request
+instrument(api)
+
+# Free the slot taken by an expensive query once its response has been sent
+api.teardown_request(release_query_slot)
+
+# Let each request choose a replica to read from, and send the reads of
+# clients that have just written to the primary
+api.teardown_request(forget_replica)
+api.after_request(record_write)
+
 
 @api.route("/login", methods=["GET"])
 def login():
@@ -24,14 +100,15 @@ def login():
     """
 
     auth = request.authorization
+    app_config = get_config()
 
     if auth:
         if (
-            auth.username == config.website_user
-            and auth.password == config.website_password
+            auth.username == app_config.website_user
+            and auth.password == app_config.website_password
         ):
             expires_at = datetime.now(timezone.utc) + timedelta(
-                minutes=config.jwt_expiry_minutes
+                minutes=app_config.jwt_expiry_minutes
             )
             token = jwt.encode(
                 {
@@ -40,7 +117,7 @@ def login():
                     "iat": datetime.now(timezone.utc),
                     "exp": expires_at,
                 },
-                config.secret_key,
+                app_config.secret_key,
             )
 
             return jsonify(
@@ -70,6 +147,7 @@ def create_device():
         # Add the new device to the database
         db.session.add(device)
         db.session.commit()
+        invalidate_responses()
 
         return DeviceSchema().jsonify(device), 201
     except ValidationError as error:
@@ -78,15 +156,83 @@ def create_device():
         return jsonify(error.messages), 400
 
 
+@api.route("/devices", methods=["GET"])
+@token_required
+@cached_response
+def get_devices():
+    """Retrieves a page of devices, optionally filtered on any of their
+    columns, e.g. by status, country and battery level.
+
+    With embed=latest_observation, each device includes its most recent
+    observation, read in the same query through the device's latest
+    observation pointer.
+
+    Returns:
+        Response: A JSON page of devices and the cursor for the next page.
+    """
+
+    filters = DEVICE_FILTERS.parse(request.args, ("limit", "cursor", "embed"))
+    cursor = request.args.get("cursor")
+    embed = request.args.get("embed")
+
+    try:
+        limit = parse_limit(request.args.get("limit"))
+    except InvalidLimitError as error:
+        return jsonify(message=str(error)), 400
+    if embed not in (None, "latest_observation"):
+        return jsonify(message="Can only embed latest_observation"), 400
+
+    include_latest = embed == "latest_observation"
+    devices = device_serializer()
+    observations = observation_serializer()
+    columns = list(devices.columns)
+    if include_latest:
+        columns += observations.columns
+
+    try:
+        rows, next_cursor = paginate_by_id(
+            device_query(columns, filters, include_latest),
+            Device.id,
+            limit,
+            cursor,
+        )
+    except InvalidCursorError as error:
+        return jsonify(message=str(error)), 400
+
+    with serialization_timer():
+        results = devices.dump(rows)
+
+        if include_latest:
+            split = len(devices.columns)
+            for result, row in zip(results, rows):
+                latest = row[split:]
+                result["latest_observation"] = (
+                    None if latest[0] is None else observations.dump_row(latest)
+                )
+
+        response = jsonify(devices=results, next_cursor=next_cursor)
+
+    return response, 200
+
+
 @api.route("/observations", methods=["POST"])
 @token_required
 def create_observation():
     """Creates a new Observation record.
 
+    With mode=async, the observation is validated and queued to be written in
+    the background, and a receipt for checking its status is returned. If the
+    device already has an observation at the same date and time, e.g. as the
+    post is a retry, that observation is returned instead of a new one.
+
     Returns:
-        Response: A JSON representation of the created observation.
+        Response: A JSON representation of the created observation, or a
+        receipt in async mode.
     """
 
+    if request.args.get("mode") == "async":
+        return _enqueue_observation(request.get_json())
+
     # Loading the request JSON into an Observation instance using the schema
     # will carry out basic validation, ensuring all fields are provided or else
     # raising an exception. We could further expand this by ensuring values
@@ -95,117 +241,616 @@ def create_observation():
         # Attempt to load the request JSON into an Observation using the schema
         observation = ObservationSchema().load(request.get_json())
 
-        # Add the new observation to the database
-        db.session.add(observation)
-        db.session.commit()
+        # Add the new observation to the database, unless it's a duplicate
+        (stored,), created = _save_observations([observation])
+        if not created:
+            return ObservationSchema().jsonify(stored), 200
+
+        invalidate_responses()
 
-        return ObservationSchema().jsonify(observation), 201
+        return ObservationSchema().jsonify(stored), 201
     except ValidationError as error:
         # Return any validation errors as JSON along with a Bad Request status
         # code.
         return jsonify(error.messages), 400
 
 
+def _enqueue_observation(data):
+    """Validates an observation and queues it to be written in the background.
+
+    Args:
+        data (dict): The observation supplied by the client.
+
+    Returns:
+        Response: A JSON receipt for the observation.
+    """
+
+    row, errors = validate_row(data)
+    if errors:
+        return jsonify(errors), 400
+
+    try:
+        receipt_id = get_ingest_queue().submit(
+            row, timeout=get_config().ingest_enqueue_timeout
+        )
+    except QueueFullError as error:
+        # Tell the client to back off until the writer has caught up.
+        response = jsonify(message=str(error))
+        response.headers["Retry-After"] = "1"
+        return response, 503
+
+    response = jsonify(receipt_id=receipt_id, status=QUEUED)
+    response.headers["Location"] = url_for(
+        "api.get_receipt", receipt_id=receipt_id
+    )
+
+    return response, 202
+
+
+@api.route("/observations/receipts/<receipt_id>", methods=["GET"])
+@token_required
+def get_receipt(receipt_id):
+    """Gets the status of an observation created in async mode.
+
+    Args:
+        receipt_id (str): The receipt id returned when it was created.
+
+    Returns:
+        Response: A JSON representation of the status of the observation.
+    """
+
+    receipt = get_ingest_queue().status(receipt_id)
+
+    if receipt is None:
+        return jsonify(message="Receipt not found"), 404
+
+    return jsonify(receipt_id=receipt_id, **receipt)
+
+
 @api.route("/observations/create-many", methods=["POST"])
 @token_required
 def create_multiple_observations():
     """Create multiple new observation records.
 
+    With mode=bulk, rows are validated and inserted without building ORM
+    instances, valid rows are accepted even if others fail validation and a
+    summary is returned in place of the created observations. Bulk uploads
+    may also be sent as CSV, NDJSON or MessagePack, which are parsed and
+    inserted incrementally rather than loaded into memory whole.
+
+    Observations that duplicate a stored observation or an earlier one in the
+    batch aren't inserted. The stored observation is returned in their place,
+    or in bulk mode they are counted as duplicates.
+
     Returns:
-        Response: A JSON list of the created observations.
+        Response: A JSON list of the created observations, or a summary of the
+        ingest in bulk mode.
     """
 
+    if request.args.get("mode") == "bulk":
+        reader = INGEST_READERS.get(request.mimetype)
+        if reader is not None:
+            return _bulk_create_observations(
+                reader(request.stream, request.mimetype_params.get("charset"))
+            )
+
+        rows = request.get_json()
+        if not isinstance(rows, list):
+            return jsonify(message="Expected a list of observations"), 400
+
+        return _bulk_create_observations(rows)
+
     try:
         observations = ObservationSchema(many=True).load(request.get_json())
-        db.session.add_all(observations)
-        db.session.commit()
+        stored, created = _save_observations(observations)
+        if not created:
+            return ObservationSchema(many=True).jsonify(stored), 200
 
-        return ObservationSchema(many=True).jsonify(observations), 201
+        invalidate_responses()
+
+        return ObservationSchema(many=True).jsonify(stored), 201
     except ValidationError as error:
-        return jsonify(error.messages, 400)
+        return jsonify(error.messages), 400
+
+
+def _save_observations(observations):
+    """Adds loaded observations to the database, skipping duplicates.
+
+    Args:
+        observations (list): Observation instances loaded by the schema.
+
+    Returns:
+        tuple: The stored observation for each one given, which for a
+        duplicate is the observation it duplicates, and the number created.
+    """
+
+    keys = [natural_key(observation) for observation in observations]
+
+    def save(duplicates):
+        new = []
+        for index, observation in enumerate(observations):
+            if index not in duplicates:
+                db.session.add(observation)
+                new.append(observation)
+        return new
+
+    new, duplicates = save_new(keys, save)
+
+    by_key = {natural_key(observation): observation for observation in new}
+    stored_ids = [id_ for id_ in duplicates.values() if id_ is not None]
+    if stored_ids:
+        by_key.update(
+            (natural_key(observation), observation)
+            for observation in Observation.query.filter(
+                Observation.id.in_(stored_ids)
+            )
+        )
+
+    return [by_key[key] for key in keys], len(new)
+
+
+def _bulk_create_observations(rows):
+    """Validates and inserts a batch of observations using the bulk ingest
+    path.
+
+    Args:
+        rows (iterable): The observations supplied by the client.
+
+    Returns:
+        Response: A JSON summary of the accepted and rejected rows.
+    """
+
+    summary = ingest_rows(rows)
+
+    if summary["accepted"]:
+        invalidate_responses()
+
+    # Fail the request if the upload couldn't be read to the end, or if none
+    # of the rows could be accepted and none were already stored.
+    if "message" in summary:
+        status_code = 400
+    elif summary["rejected"] and not (
+        summary["accepted"] or summary["duplicates"]
+    ):
+        status_code = 400
+    else:
+        status_code = 201
+
+    return jsonify(summary), status_code
+
+
+@api.errorhandler(InvalidFilterError)
+def handle_invalid_filter(error):
+    """Returns invalid filter errors as JSON with a Bad Request status code."""
+
+    return jsonify(message=str(error)), 400
+
+
+def _parse_filters(*parameters):
+    """Parses the observation filters supplied in the request query string.
+
+    Args:
+        *parameters (str): The route's own query string parameters, which
+            aren't filters.
+
+    Raises:
+        InvalidFilterError: If a filter is invalid or a parameter is unknown.
+
+    Returns:
+        dict: The parsed value of each filter given.
+    """
+
+    return OBSERVATION_FILTERS.parse(request.args, parameters)
+
+
+def _first(filters, *names):
+    """Gets the value of the first of the named filters that was given."""
+
+    return next((filters[name] for name in names if name in filters), None)
+
+
+def _archived_months(filters):
+    """Gets the archived months that may hold observations in the date range
+    of the filters.
+
+    Args:
+        filters (dict): The parsed observation filters.
+
+    Returns:
+        list: ArchivedMonth entries ordered by month.
+    """
+
+    return get_archive_catalog().months(
+        date_from=_first(
+            filters, "date_from", "date_logged__gt", "date_logged"
+        ),
+        date_to=_first(filters, "date_to", "date_logged__lt", "date_logged"),
+        observed_from=_first(
+            filters, "observed_from", "observed_at_utc__gt", "observed_at_utc"
+        ),
+        observed_to=_first(
+            filters, "observed_to", "observed_at_utc__lt", "observed_at_utc"
+        ),
+    )
+
+
+def _filter_observations(query, filters):
+    """Applies the observation filters supplied in the request query string.
+
+    Args:
+        query: The Observation query to filter.
+        filters (dict): The parsed observation filters.
+
+    Raises:
+        InvalidFilterError: If the filters can't be applied together.
+
+    Returns:
+        Query: The filtered query.
+    """
+
+    return OBSERVATION_FILTERS.apply(query, filters)
 
 
 # START: New GET (parameterised queries)
 @api.route("/observations", methods=["GET"])
 @token_required
+@cached_response
+@limit_concurrency
 def get_observations():
     """Retrieves observations based on filtering criteria.
 
+    When a limit or cursor is supplied, results are returned one page at a
+    time along with a cursor for fetching the next page. A comma-separated
+    list of fields limits the columns selected and output for each
+    observation. Responses are cached until the next write, and carry an ETag
+    for conditional requests.
+
     Returns:
         Response: A JSON representation of the filtered observations.
     """
 
-    # These are the parameters we would be querying on
-    date_from = request.args.get("date_from")  # Format: YYYY-MM-DD
-    date_to = request.args.get("date_to")  # Format: YYYY-MM-DD
-    min_latitude = request.args.get("min_latitude", type=float)
-    max_latitude = request.args.get("max_latitude", type=float)
-    min_longitude = request.args.get("min_longitude", type=float)
-    max_longitude = request.args.get("max_longitude", type=float)
-
-    # Extraction of the min or max filters for other numeric fields
-    filters = {
-        "min_water_temp": request.args.get("min_water_temp", type=int),
-        "max_water_temp": request.args.get("max_water_temp", type=int),
-        "min_air_temp": request.args.get("min_air_temp", type=int),
-        "max_air_temp": request.args.get("max_air_temp", type=int),
-        "min_wind_speed": request.args.get("min_wind_speed", type=int),
-        "max_wind_speed": request.args.get("max_wind_speed", type=int),
-        "min_humidity": request.args.get("min_humidity", type=int),
-        "max_humidity": request.args.get("max_humidity", type=int),
-        "min_haze_percent": request.args.get("min_haze_percent", type=int),
-        "max_haze_percent": request.args.get("max_haze_percent", type=int),
-        "min_precipitation_mm": request.args.get(
-            "min_precipitation_mm", type=int
-        ),
-        "max_precipitation_mm": request.args.get(
-            "max_precipitation_mm", type=int
-        ),
-        "min_radiation_bq": request.args.get("min_radiation_bq", type=int),
-        "max_radiation_bq": request.args.get("max_radiation_bq", type=int),
-    }
-
-    # the biulding of the query
-    query = Observation.query
-
-    # This is where we apply date range filtering
-    if date_from:
-        query = query.filter(Observation.date_logged >= date_from)
-    if date_to:
-        query = query.filter(Observation.date_logged <= date_to)
-
-    # latitude/longitude range filtering
-    if min_latitude is not None:
-        query = query.filter(Observation.latitude >= min_latitude)
-    if max_latitude is not None:
-        query = query.filter(Observation.latitude <= max_latitude)
-    if min_longitude is not None:
-        query = query.filter(Observation.longitude >= min_longitude)
-    if max_longitude is not None:
-        query = query.filter(Observation.longitude <= max_longitude)
-
-    # numeric filters dynamically
-    for key, value in filters.items():
-        if value is not None:
-            parts = key.split("_")
-            if len(parts) == 3:
-                op, field_part_1, field_part_2 = parts
-                field_name = f"{field_part_1}_{field_part_2}"
-                print(field_name)
-            elif len(parts) == 2:
-                op, field_name = parts
-            else:
-                continue
-
-            field = getattr(Observation, field_name, None)
-            if field is not None:
-                if op == "min":
-                    query = query.filter(field >= value)
-                elif op == "max":
-                    query = query.filter(field <= value)
-
-    # We execute the query
-    observations = query.all()
-
-    # Then we turn the results into a json response format
-    return ObservationSchema(many=True).jsonify(observations), 200
+    filters = _parse_filters("limit", "cursor", "fields")
+    cursor = request.args.get("cursor")
+
+    try:
+        field_names = parse_fields(
+            request.args.get("fields"), ObservationSchema
+        )
+    except InvalidFieldsError as error:
+        return jsonify(message=str(error)), 400
+
+    # the biulding of the query, selecting only the serialised columns so
+    # that rows can be dumped without loading ORM objects
+    serializer = observation_serializer(field_names)
+    query = _filter_observations(Observation.query, filters).with_entities(
+        *serializer.columns
+    )
+
+    # Only the archived months overlapping the requested dates are read
+    months = _archived_months(filters)
+
+    if "limit" not in request.args and "cursor" not in request.args:
+        # We execute the query
+        observations = fetch_all(query, months)
+
+        # Then we turn the results into a json response format
+        with serialization_timer():
+            response = jsonify(serializer.dump(observations))
+
+        return response, 200
+
+    try:
+        limit = parse_limit(request.args.get("limit"))
+    except InvalidLimitError as error:
+        return jsonify(message=str(error)), 400
+
+    # The cursor is built from the sort key of the last row, so select any of
+    # its columns that weren't requested too. They come after the requested
+    # columns, where the serialiser ignores them.
+    query = query.add_columns(*keyset_columns(serializer.field_names))
+
+    try:
+        # Months logged before the cursor hold nothing further to page through
+        if cursor and months:
+            cursor_date = decode_cursor(cursor)[0]
+            months = [m for m in months if m.max_date_logged >= cursor_date]
+
+        observations, next_cursor = paginate(
+            query,
+            limit,
+            cursor,
+            fetch=partial(fetch_all, months=months, key=keyset_key),
+        )
+    except InvalidCursorError as error:
+        return jsonify(message=str(error)), 400
+
+    with serialization_timer():
+        response = jsonify(
+            observations=serializer.dump(observations),
+            next_cursor=next_cursor,
+        )
+
+    return response, 200
+
+
+@api.route("/observations/export", methods=["GET"])
+@token_required
+@limit_concurrency
+def export_observations():
+    """Streams every observation matching the filtering criteria as NDJSON or
+    CSV.
+
+    Accepts the same filters and fields as get_observations. Rows are read
+    from the database and written to the response in batches, so memory use
+    stays bounded however many observations match.
+
+    Returns:
+        Response: A streamed NDJSON or CSV response.
+    """
+
+    filters = _parse_filters("format", "fields")
+    export_format = request.args.get("format", "ndjson")
+
+    if export_format not in EXPORT_FORMATS:
+        return (
+            jsonify(
+                message="Format must be one of: " + ", ".join(EXPORT_FORMATS)
+            ),
+            400,
+        )
+
+    try:
+        field_names = parse_fields(
+            request.args.get("fields"), ObservationSchema
+        )
+    except InvalidFieldsError as error:
+        return jsonify(message=str(error)), 400
+
+    query = _filter_observations(Observation.query, filters)
+    generate = EXPORT_GENERATORS[export_format]
+    months = _archived_months(filters)
+
+    return Response(
+        stream_with_context(generate(query, field_names, months)),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={
+            "Content-Disposition": (
+                f"attachment; filename=observations.{export_format}"
+            )
+        },
+    )
+
+
+@api.route("/observations/aggregate", methods=["GET"])
+@token_required
+@cached_response
+@limit_concurrency
+def aggregate_observations():
+    """Aggregates observations matching the filtering criteria into time
+    buckets.
+
+    Accepts the same filters as get_observations, plus the bucket size, an
+    optional grouping by device and a comma-separated list of metrics. Where
+    only filters on the device and a start time are given, the aggregates are
+    read from the rollup tables rather than the raw observations.
+
+    Returns:
+        Response: A JSON list with the count and min/max/avg of each metric in
+        each bucket.
+    """
+
+    filters = _parse_filters("bucket", "group_by", "metrics")
+    bucket = request.args.get("bucket", "day")
+    group_by = request.args.get("group_by")
+    metrics = request.args.get("metrics")
+    metrics = metrics.split(",") if metrics else list(AGGREGATE_METRICS)
+
+    if bucket not in BUCKETS:
+        return (
+            jsonify(message="Bucket must be one of: " + ", ".join(BUCKETS)),
+            400,
+        )
+    if group_by not in (None, "device_id"):
+        return jsonify(message="Can only group by device_id"), 400
+
+    unknown_metrics = [m for m in metrics if m not in AGGREGATE_METRICS]
+    if unknown_metrics:
+        return (
+            jsonify(message="Unknown metrics: " + ", ".join(unknown_metrics)),
+            400,
+        )
+
+    group_by_device = group_by == "device_id"
+
+    # Serve the aggregates from the rollup tables where they give the same
+    # answer, as they only need reading one row per device and bucket.
+    if can_use_rollups(request.args):
+        query = rollup_query(
+            bucket,
+            metrics,
+            group_by_device,
+            device_id=filters.get("device_id"),
+            observed_from=filters.get("observed_from"),
+        )
+        rows = query.all()
+    else:
+        query = _filter_observations(
+            aggregate_query(bucket, metrics, group_by_device), filters
+        )
+        rows = query.all()
+
+        # Aggregate each archived month separately, in SQLite as that's where
+        # they're queried, then merge the buckets with the observation table's.
+        months = _archived_months(filters)
+        if months:
+            archive_query = _filter_observations(
+                aggregate_query(bucket, metrics, group_by_device, "sqlite"),
+                filters,
+            )
+            archived = [
+                query_month(archive_query.statement, month) for month in months
+            ]
+            rows = combine_aggregates(
+                [rows, *archived], metrics, group_by_device
+            )
+
+    with serialization_timer():
+        response = jsonify(format_aggregates(rows, metrics, group_by_device))
+
+    return response
+
+
+@api.route("/observations/series", methods=["GET"])
+@token_required
+@cached_response
+@limit_concurrency
+def get_series():
+    """Retrieves one metric of a device's observations as a time series,
+    downsampled for charting.
+
+    Accepts the same filters as get_observations, of which device_id is
+    required, plus the metric and the number of points to return. Series with
+    more points than requested are reduced with Largest-Triangle-Three-Buckets,
+    which keeps the peaks and troughs that a chart needs to show.
+
+    Returns:
+        Response: A JSON object with the series as [timestamp, value] pairs.
+    """
+
+    filters = _parse_filters("metric", "points")
+    device_id = filters.get("device_id")
+    metric = request.args.get("metric")
+    points = request.args.get("points", DEFAULT_SERIES_POINTS)
+
+    if device_id is None:
+        return jsonify(message="A device_id is required"), 400
+    if metric not in AGGREGATE_METRICS:
+        return (
+            jsonify(
+                message="Metric must be one of: " + ", ".join(AGGREGATE_METRICS)
+            ),
+            400,
+        )
+
+    try:
+        points = int(points)
+    except ValueError:
+        points = None
+
+    if points is None or not 3 <= points <= MAX_SERIES_POINTS:
+        return (
+            jsonify(
+                message="Points must be a whole number between 3 and "
+                f"{MAX_SERIES_POINTS}"
+            ),
+            400,
+        )
+
+    series = downsample_series(
+        _filter_observations(Observation.query, filters),
+        metric,
+        points,
+        _archived_months(filters),
+    )
+
+    with serialization_timer():
+        response = jsonify(device_id=device_id, metric=metric, points=series)
+
+    return response
+
+
+def _parse_list(name, default, parse=str):
+    """Parses a comma-separated query string parameter.
+
+    Args:
+        name (str): The parameter.
+        default (tuple): The values if it isn't given.
+        parse (callable, optional): Parses each value, raising ValueError if
+            it is invalid.
+
+    Returns:
+        list: The parsed values.
+    """
+
+    value = request.args.get(name)
+
+    return [parse(part) for part in value.split(",")] if value else default
+
+
+@api.route("/observations/stats", methods=["GET"])
+@token_required
+@cached_response
+def get_stats():
+    """Estimates percentiles of observation metrics from their sketches.
+
+    Accepts filters on the device and on the UTC day (date_from and date_to),
+    plus comma-separated lists of metrics, percentiles and the columns to
+    group by, device_id and/or day. The sketches for each device and day in
+    range are merged, so that the estimates for any set of devices and days
+    take milliseconds, with a rank error of kll.rank_error().
+
+    Returns:
+        Response: A JSON list with the count, min, max and percentiles of each
+        metric in each group.
+    """
+
+    filters = SKETCH_FILTERS.parse(
+        request.args, ("metrics", "percentiles", "group_by")
+    )
+    metrics = _parse_list("metrics", list(SKETCH_METRICS))
+    group_by = tuple(_parse_list("group_by", ()))
+
+    try:
+        percentiles = _parse_list(
+            "percentiles", list(DEFAULT_PERCENTILES), float
+        )
+    except ValueError:
+        percentiles = None
+    if not percentiles or not all(0 <= p <= 100 for p in percentiles):
+        return (
+            jsonify(message="Percentiles must be numbers from 0 to 100"),
+            400,
+        )
+
+    unknown_metrics = [m for m in metrics if m not in SKETCH_METRICS]
+    if unknown_metrics:
+        return (
+            jsonify(
+                message="Metrics must be among: " + ", ".join(SKETCH_METRICS)
+            ),
+            400,
+        )
+    if not set(group_by) <= set(SKETCH_GROUPS):
+        return (
+            jsonify(message="Can only group by: " + ", ".join(SKETCH_GROUPS)),
+            400,
+        )
+
+    query = SKETCH_FILTERS.apply(
+        db.session.query(
+            ObservationSketch.device_id,
+            ObservationSketch.metric,
+            ObservationSketch.day,
+            ObservationSketch.sketch,
+        ).filter(ObservationSketch.metric.in_(metrics)),
+        filters,
+    )
+    groups = merge_sketches(query, metrics, group_by)
+
+    with serialization_timer():
+        response = jsonify(format_stats(groups, metrics, percentiles, group_by))
+
+    return response
+
+
+@api.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Exposes request and database metrics for Prometheus to scrape.
+
+    Returns:
+        Response: The metrics in the Prometheus text format.
+    """
+
+    return Response(
+        render_metrics(), mimetype="text/plain; version=0.0.4; charset=utf-8"
+    )
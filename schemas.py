@@ -1,9 +1,10 @@
 """Marshmallow schemas for serialising and deserialising JSON data."""
 
 from flask_marshmallow import Marshmallow
+from marshmallow import ValidationError, validates
 
 import app
-from models import Device, Observation
+from models import Device, Observation, parse_utc_offset
 
 ma = Marshmallow(app)
 
@@ -36,6 +37,15 @@ class ObservationSchema(ma.SQLAlchemyAutoSchema):
             "device_id",
         )
 
+    @validates("time_zone_offset")
+    def validate_time_zone_offset(self, value):
+        """Ensures the time zone offset can be converted to UTC."""
+
+        try:
+            parse_utc_offset(value)
+        except ValueError as error:
+            raise ValidationError("Not a valid time zone offset.") from error
+
 
 class DeviceSchema(ma.SQLAlchemyAutoSchema):
     """Schema definition for serialising Device entities."""
@@ -0,0 +1,287 @@
+"""Quantile sketches of observation metrics per device and UTC day.
+
+Percentiles can't be combined like sums or maxima, so the rollups can't
+answer them, and computing them exactly means sorting every raw observation
+in the range. Instead, a KLL sketch of each metric in SKETCH_METRICS is kept
+per device and day, and updated in the same transaction that creates the
+observations. Sketches are small and mergeable, so the percentiles for any set
+of devices and days are estimated by merging a sketch per device and day,
+within the rank error given by kll.rank_error.
+"""
+
+import itertools
+from operator import attrgetter, itemgetter
+
+from sqlalchemy import bindparam, event, insert, select, tuple_, update
+from sqlalchemy.orm import Session
+
+from archive import archived_observations
+from kll import KLLSketch
+from models import Observation, ObservationSketch, db
+
+# The metrics that sketches are kept for.
+SKETCH_METRICS = ("radiation_bq", "wind_speed")
+
+# The percentiles estimated when none are requested.
+DEFAULT_PERCENTILES = (50, 95, 99)
+
+# What the stats can be grouped by.
+SKETCH_GROUPS = ("device_id", "day")
+
+# The number of sketches read or written in each statement.
+SKETCH_CHUNK_SIZE = 500
+
+
+def _fields(observations, names):
+    """Reads fields from each of a set of Observation instances or
+    dictionaries.
+
+    Args:
+        observations (iterable): Observation instances or dictionaries.
+        names (tuple): The names of the fields to read.
+
+    Yields:
+        tuple: The values of the fields of each observation.
+    """
+
+    get_item, get_attribute = itemgetter(*names), attrgetter(*names)
+
+    for observation in observations:
+        if isinstance(observation, dict):
+            yield get_item(observation)
+        else:
+            yield get_attribute(observation)
+
+
+def sketch_values(observations):
+    """Groups the values of the sketched metrics by the sketch they belong to.
+
+    Args:
+        observations (iterable): Observation instances or dictionaries with
+            device_id, observed_at_utc and every metric populated.
+
+    Returns:
+        dict: The values to add to each sketch, keyed by (device_id, metric,
+        day).
+    """
+
+    values = {}
+
+    names = ("device_id", "observed_at_utc", *SKETCH_METRICS)
+
+    for device_id, observed_at, *metric_values in _fields(observations, names):
+        day = observed_at.date()
+
+        for metric, value in zip(SKETCH_METRICS, metric_values):
+            values.setdefault((device_id, metric, day), []).append(value)
+
+    return values
+
+
+def _key_columns():
+    """Gets the columns identifying a sketch."""
+
+    table = ObservationSketch.__table__
+
+    return table.c.device_id, table.c.metric, table.c.day
+
+
+def update_sketches(observations, session=None):
+    """Adds newly created observations to their sketches.
+
+    This should be called in the same transaction that inserts the
+    observations, and the caller is responsible for committing the session.
+    Observations added through the ORM are sketched automatically when the
+    session is flushed, so this only needs calling for Core inserts.
+
+    The stored sketches are locked while they're updated, where the database
+    supports it. SQLite doesn't need to, as inserting the observations has
+    already taken its write lock.
+
+    Args:
+        observations (iterable): Observation instances or dictionaries with
+            device_id, observed_at_utc and every metric populated.
+        session (Session, optional): The session to use. Defaults to
+            db.session.
+    """
+
+    session = session or db.session
+    values = sketch_values(observations)
+    keys = list(values)
+    table = ObservationSketch.__table__
+    columns = _key_columns()
+    stored = {}
+
+    for start in range(0, len(keys), SKETCH_CHUNK_SIZE):
+        rows = session.execute(
+            select(*columns, table.c.sketch)
+            .where(
+                tuple_(*columns).in_(keys[start : start + SKETCH_CHUNK_SIZE])
+            )
+            .with_for_update()
+        )
+        for device_id, metric, day, data in rows:
+            stored[(device_id, metric, day)] = KLLSketch.from_bytes(data)
+
+    inserts, updates = [], []
+    for key, key_values in values.items():
+        sketch = stored[key] if key in stored else KLLSketch()
+        sketch.update_many(key_values)
+
+        device_id, metric, day = key
+        row = {
+            "key_device_id": device_id,
+            "key_metric": metric,
+            "key_day": day,
+            "sketch": sketch.to_bytes(),
+        }
+        (updates if key in stored else inserts).append(row)
+
+    if inserts:
+        session.execute(
+            insert(table).values(
+                device_id=bindparam("key_device_id"),
+                metric=bindparam("key_metric"),
+                day=bindparam("key_day"),
+            ),
+            inserts,
+        )
+    if updates:
+        session.execute(
+            update(table).where(
+                table.c.device_id == bindparam("key_device_id"),
+                table.c.metric == bindparam("key_metric"),
+                table.c.day == bindparam("key_day"),
+            ),
+            updates,
+        )
+
+
+@event.listens_for(Session, "after_flush")
+def _sketch_flushed_observations(session, flush_context):
+    """Sketches observations inserted through the ORM as part of the same
+    flush."""
+
+    observations = [
+        instance
+        for instance in session.new
+        if isinstance(instance, Observation)
+    ]
+
+    if observations:
+        update_sketches(observations, session)
+
+
+def merge_sketches(rows, metrics, group_by=()):
+    """Merges stored sketches into one per group and metric.
+
+    Args:
+        rows (iterable): Rows with device_id, metric, day and sketch columns.
+        metrics (list): The names of the metrics to merge.
+        group_by (tuple, optional): The columns in SKETCH_GROUPS to merge each
+            combination of separately.
+
+    Returns:
+        dict: The merged KLLSketch of each metric, keyed by the group's
+        values in group_by order.
+    """
+
+    groups = {}
+
+    for row in rows:
+        group = tuple(getattr(row, column) for column in group_by)
+        sketches = groups.get(group)
+        if sketches is None:
+            sketches = groups[group] = {
+                metric: KLLSketch() for metric in metrics
+            }
+
+        sketches[row.metric].merge(KLLSketch.from_bytes(row.sketch))
+
+    return dict(sorted(groups.items()))
+
+
+def _number(value):
+    """Gives whole numbers as integers, as the metrics are integer columns."""
+
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def format_stats(groups, metrics, percentiles, group_by=()):
+    """Converts merged sketches to JSON-serialisable dictionaries.
+
+    Args:
+        groups (dict): The merged sketches, as returned by merge_sketches.
+        metrics (list): The names of the metrics.
+        percentiles (list): The percentiles to estimate, between 0 and 100.
+        group_by (tuple, optional): The columns the sketches were grouped by.
+
+    Returns:
+        list: A dictionary per group.
+    """
+
+    fractions = [percentile / 100 for percentile in percentiles]
+    results = []
+
+    for group, sketches in groups.items():
+        result = {}
+        for column, value in zip(group_by, group):
+            result[column] = value.isoformat() if column == "day" else value
+        result["count"] = max(len(sketch) for sketch in sketches.values())
+
+        for metric in metrics:
+            sketch = sketches[metric]
+            stats = {"min": None, "max": None}
+            if len(sketch):
+                stats = {"min": _number(sketch.min), "max": _number(sketch.max)}
+            for percentile, estimate in zip(
+                percentiles, sketch.quantiles(fractions)
+            ):
+                stats[f"p{percentile:g}"] = _number(estimate)
+            result[metric] = stats
+
+        results.append(result)
+
+    return results
+
+
+def rebuild_sketches(chunk_size=10000):
+    """Recreates every sketch from the raw observations, including those in
+    archived months, e.g. after a backfill.
+
+    Observations in the observation table are read in the order of their
+    sketches, so that each sketch is written once per source. The caller is
+    responsible for committing the session.
+
+    Args:
+        chunk_size (int): The number of observations read at a time.
+
+    Returns:
+        int: The number of observations sketched.
+    """
+
+    db.session.query(ObservationSketch).delete()
+
+    names = ("device_id", "observed_at_utc", *SKETCH_METRICS)
+    rows = (
+        db.session.query(*(getattr(Observation, name) for name in names))
+        .order_by(Observation.device_id, Observation.observed_at_utc)
+        .yield_per(chunk_size)
+    )
+
+    total = 0
+    chunk = []
+    for row in itertools.chain(
+        archived_observations(names), (row._asdict() for row in rows)
+    ):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            update_sketches(chunk)
+            total += len(chunk)
+            chunk = []
+
+    update_sketches(chunk)
+
+    return total + len(chunk)
@@ -0,0 +1,298 @@
+"""Spatial indexing of observation locations.
+
+The globe is divided into a fixed grid of cells, numbered row by row from the
+south-west corner. Each observation stores the number of the cell it falls in,
+so that a bounding box translates into a handful of contiguous ranges of cell
+numbers that an index on the cell column can seek to, rather than four
+independent range predicates on unindexed floats.
+"""
+
+import math
+import sqlite3
+
+from sqlalchemy import Float, and_, event, or_
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement, func
+
+# The size of each grid cell in degrees of latitude and longitude.
+GRID_CELL_DEGREES = 0.5
+GRID_ROWS = int(180 / GRID_CELL_DEGREES)
+GRID_COLUMNS = int(360 / GRID_CELL_DEGREES)
+
+# Bounding boxes covering more rows of the grid than this aren't pruned by
+# cell, as the predicate would be long and not very selective.
+MAX_PRUNED_ROWS = 64
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def _grid_row(latitude):
+    """Gets the grid row a latitude falls in."""
+
+    row = math.floor((latitude + 90) / GRID_CELL_DEGREES)
+
+    return min(max(row, 0), GRID_ROWS - 1)
+
+
+def _grid_column(longitude):
+    """Gets the grid column a longitude in the range [-180, 180] falls in."""
+
+    column = math.floor((longitude + 180) / GRID_CELL_DEGREES)
+
+    return min(max(column, 0), GRID_COLUMNS - 1)
+
+
+def grid_cell(latitude, longitude):
+    """Gets the number of the grid cell containing a location.
+
+    Args:
+        latitude (float): The latitude in degrees.
+        longitude (float): The longitude in degrees.
+
+    Returns:
+        int: The grid cell number.
+    """
+
+    return _grid_row(latitude) * GRID_COLUMNS + _grid_column(longitude)
+
+
+def cell_ranges(min_latitude, max_latitude, min_longitude, max_longitude):
+    """Gets the ranges of grid cells that cover a bounding box.
+
+    Args:
+        min_latitude (float): The southern edge of the box.
+        max_latitude (float): The northern edge of the box.
+        min_longitude (float): The western edge of the box.
+        max_longitude (float): The eastern edge of the box. If this is less
+            than min_longitude, the box crosses the antimeridian.
+
+    Returns:
+        list: Inclusive (first, last) cell number ranges, or None if the box
+        is too large to be worth pruning by cell.
+    """
+
+    first_row, last_row = _grid_row(min_latitude), _grid_row(max_latitude)
+
+    if last_row - first_row + 1 > MAX_PRUNED_ROWS:
+        return None
+
+    if min_longitude <= max_longitude:
+        columns = [(_grid_column(min_longitude), _grid_column(max_longitude))]
+    else:
+        columns = [
+            (0, _grid_column(max_longitude)),
+            (_grid_column(min_longitude), GRID_COLUMNS - 1),
+        ]
+
+    ranges = []
+    for row in range(first_row, last_row + 1):
+        for first_column, last_column in columns:
+            first = row * GRID_COLUMNS + first_column
+            last = row * GRID_COLUMNS + last_column
+
+            # Merge ranges that follow on from each other, e.g. when the box
+            # spans every longitude.
+            if ranges and ranges[-1][1] + 1 >= first:
+                ranges[-1] = (ranges[-1][0], last)
+            else:
+                ranges.append((first, last))
+
+    return ranges
+
+
+def cell_predicate(column, ranges):
+    """Builds a predicate matching grid cells in any of the given ranges.
+
+    Args:
+        column: The grid cell column.
+        ranges (list): Ranges returned by cell_ranges.
+
+    Returns:
+        The SQL predicate.
+    """
+
+    return or_(
+        *(
+            column == first if first == last else column.between(first, last)
+            for first, last in ranges
+        )
+    )
+
+
+def radius_bounds(latitude, longitude, radius_km):
+    """Gets a bounding box containing every point within a distance of a
+    location.
+
+    Args:
+        latitude (float): The latitude of the centre in degrees.
+        longitude (float): The longitude of the centre in degrees.
+        radius_km (float): The distance from the centre in kilometres.
+
+    Returns:
+        tuple: The (min_latitude, max_latitude, min_longitude, max_longitude)
+        of the box, with min_longitude greater than max_longitude if it crosses
+        the antimeridian.
+    """
+
+    delta_latitude = radius_km / KM_PER_DEGREE
+    min_latitude = max(latitude - delta_latitude, -90.0)
+    max_latitude = min(latitude + delta_latitude, 90.0)
+
+    # Near the poles a circle can cover every longitude.
+    widest = max(abs(min_latitude), abs(max_latitude))
+    if widest >= 90.0:
+        return min_latitude, max_latitude, -180.0, 180.0
+
+    delta_longitude = delta_latitude / math.cos(math.radians(widest))
+    if delta_longitude >= 180.0:
+        return min_latitude, max_latitude, -180.0, 180.0
+
+    min_longitude = longitude - delta_longitude
+    max_longitude = longitude + delta_longitude
+    if min_longitude < -180.0:
+        min_longitude += 360.0
+    if max_longitude > 180.0:
+        max_longitude -= 360.0
+
+    return min_latitude, max_latitude, min_longitude, max_longitude
+
+
+def haversine(latitude_1, longitude_1, latitude_2, longitude_2):
+    """Calculates the great-circle distance between two locations.
+
+    Args:
+        latitude_1 (float): The latitude of the first location in degrees.
+        longitude_1 (float): The longitude of the first location in degrees.
+        latitude_2 (float): The latitude of the second location in degrees.
+        longitude_2 (float): The longitude of the second location in degrees.
+
+    Returns:
+        float: The distance in kilometres.
+    """
+
+    phi_1, phi_2 = math.radians(latitude_1), math.radians(latitude_2)
+    delta_phi = phi_2 - phi_1
+    delta_lambda = math.radians(longitude_2 - longitude_1)
+
+    a = (
+        math.sin(delta_phi / 2) ** 2
+        + math.cos(phi_1) * math.cos(phi_2) * math.sin(delta_lambda / 2) ** 2
+    )
+
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class haversine_km(FunctionElement):
+    """SQL function computing the great-circle distance in kilometres between
+    two locations given as (latitude, longitude, latitude, longitude)."""
+
+    type = Float()
+    inherit_cache = True
+
+
+@compiles(haversine_km)
+def _compile_haversine_km(element, compiler, **kw):
+    """Compiles the haversine formula using standard SQL math functions."""
+
+    latitude_1, longitude_1, latitude_2, longitude_2 = element.clauses
+    phi_1, phi_2 = func.radians(latitude_1), func.radians(latitude_2)
+    delta_phi = func.radians(latitude_2 - latitude_1)
+    delta_lambda = func.radians(longitude_2 - longitude_1)
+
+    sin_phi = func.sin(delta_phi / 2)
+    sin_lambda = func.sin(delta_lambda / 2)
+
+    a = sin_phi * sin_phi + (
+        func.cos(phi_1) * func.cos(phi_2) * sin_lambda * sin_lambda
+    )
+    expression = 2 * EARTH_RADIUS_KM * func.asin(func.least(1.0, func.sqrt(a)))
+
+    return compiler.process(expression, **kw)
+
+
+@compiles(haversine_km, "sqlite")
+def _compile_haversine_km_sqlite(element, compiler, **kw):
+    """Compiles to a call to the Python implementation, as SQLite's math
+    functions are an optional build feature."""
+
+    return f"haversine_km({compiler.process(element.clauses, **kw)})"
+
+
+@event.listens_for(Engine, "connect")
+def _register_sqlite_functions(dbapi_connection, connection_record):
+    """Registers the haversine function on new SQLite connections."""
+
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_function(
+            "haversine_km", 4, haversine, deterministic=True
+        )
+
+
+def bounding_box_predicate(
+    cell_column,
+    min_latitude,
+    max_latitude,
+    min_longitude,
+    max_longitude,
+):
+    """Builds a predicate that prunes a bounding box query by grid cell.
+
+    Args:
+        cell_column: The grid cell column.
+        min_latitude (float): The southern edge of the box.
+        max_latitude (float): The northern edge of the box.
+        min_longitude (float): The western edge of the box.
+        max_longitude (float): The eastern edge of the box.
+
+    Returns:
+        The SQL predicate, or None if the box is too large to prune.
+    """
+
+    ranges = cell_ranges(
+        min_latitude, max_latitude, min_longitude, max_longitude
+    )
+
+    if ranges is None:
+        return None
+
+    return cell_predicate(cell_column, ranges)
+
+
+def radius_predicate(
+    cell_column,
+    latitude_column,
+    longitude_column,
+    latitude,
+    longitude,
+    radius_km,
+):
+    """Builds a predicate matching locations within a distance of a point.
+
+    Candidate grid cells are filtered first so that the exact distance only
+    needs calculating for nearby rows.
+
+    Args:
+        cell_column: The grid cell column.
+        latitude_column: The latitude column.
+        longitude_column: The longitude column.
+        latitude (float): The latitude of the centre in degrees.
+        longitude (float): The longitude of the centre in degrees.
+        radius_km (float): The distance from the centre in kilometres.
+
+    Returns:
+        The SQL predicate.
+    """
+
+    distance = haversine_km(
+        latitude, longitude, latitude_column, longitude_column
+    )
+    prune = bounding_box_predicate(
+        cell_column, *radius_bounds(latitude, longitude, radius_km)
+    )
+
+    if prune is None:
+        return distance <= radius_km
+
+    return and_(prune, distance <= radius_km)
@@ -0,0 +1,265 @@
+"""Tests for the archiving of old observations."""
+
+import datetime
+import json
+import os
+
+import pytest
+
+from archive import ArchiveCatalog, archive_old_months
+from conftest import AUTH_HEADERS, make_observation
+from models import Observation, db
+from rollups import rebuild_rollups
+from sketches import rebuild_sketches
+
+# With two whole months kept before the current one, January and February are
+# archived and March onwards stays in the observation table.
+TODAY = datetime.date(2024, 5, 15)
+AGE_MONTHS = 2
+
+# Read requests whose responses shouldn't change when observations are
+# archived, including ranges falling across the archived months' edges.
+READ_REQUESTS = [
+    "/observations?date_from=2024-02-01&date_to=2024-03-31",
+    "/observations?observed_from=2024-01-31T23:00:00&max_water_temp=12",
+    "/observations?near=10,20&radius_km=50&fields=id,water_temp",
+    "/observations/export",
+    "/observations/export?format=csv&fields=date_logged,air_temp",
+    "/observations/aggregate?bucket=day",
+    "/observations/aggregate?bucket=month&group_by=device_id",
+    "/observations/aggregate?bucket=hour&observed_to=2024-03-01T00:30:00",
+    "/observations/series?device_id=1&metric=air_temp&points=5",
+]
+
+
+def make_day_observation(day, time_logged="12:00:00", **overrides):
+    """Builds valid observation request data for a day, with values and a
+    device that vary from day to day."""
+
+    observation_data = {
+        "date_logged": day.isoformat(),
+        "time_logged": time_logged,
+        "water_temp": day.day % 15,
+        "air_temp": 20 + day.day % 7,
+        "device_id": 1 + day.day % 2,
+    }
+    observation_data.update(overrides)
+
+    return make_observation(**observation_data)
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    """Fixture for a catalog in an empty archive directory."""
+
+    return ArchiveCatalog(str(tmp_path / "archive"))
+
+
+@pytest.fixture
+def num_devices():
+    """Fixture for the two devices the observations alternate between."""
+
+    return 2
+
+
+@pytest.fixture
+def cache_responses():
+    """Fixture to disable response caching, so reads before and after
+    archiving are compared."""
+
+    return False
+
+
+@pytest.fixture
+def client(app, catalog):
+    """Fixture to set up an authenticated test client backed by a database
+    holding observations from January to April, including some logged near
+    midnight in other time zones."""
+
+    app.extensions["archive_catalog"] = catalog
+
+    client = app.test_client()
+    start = datetime.date(2024, 1, 1)
+    observations = [
+        make_day_observation(start + datetime.timedelta(days=days))
+        for days in range(0, 120, 3)
+    ]
+    observations += [
+        # Logged on the 1st of March but observed in February in UTC
+        make_day_observation(
+            datetime.date(2024, 3, 1),
+            "00:30:00",
+            time_zone_offset="UTC+02:00",
+        ),
+        # Logged on the 29th of February but observed in March in UTC
+        make_day_observation(
+            datetime.date(2024, 2, 29),
+            "23:30:00",
+            time_zone_offset="UTC-02:00",
+        ),
+    ]
+    response = client.post(
+        "/observations/create-many",
+        json=observations,
+        query_string={"mode": "bulk"},
+        headers=AUTH_HEADERS,
+    )
+    assert response.status_code == 201
+
+    return client
+
+
+def _read_all(client, url):
+    """Gets a response body, paging through paginated responses. Unpaginated
+    observations are sorted, as their order is unspecified."""
+
+    if not url.startswith("/observations?"):
+        return client.get(url, headers=AUTH_HEADERS).get_data(as_text=True)
+    if "limit=" not in url:
+        observations = client.get(url, headers=AUTH_HEADERS).json
+        return sorted(observations, key=lambda o: o["id"])
+
+    observations = []
+    cursor = ""
+    while cursor is not None:
+        response = client.get(f"{url}&cursor={cursor}", headers=AUTH_HEADERS)
+        assert response.status_code == 200
+        observations.extend(response.json["observations"])
+        cursor = response.json["next_cursor"]
+
+    return observations
+
+
+def test_archive_old_months(client, catalog):
+    """Tests that months older than the age are moved into archive files and
+    out of the observation table."""
+
+    total = Observation.query.count()
+
+    archived = archive_old_months(catalog, AGE_MONTHS, TODAY)
+
+    assert list(archived) == [
+        datetime.date(2024, 1, 1),
+        datetime.date(2024, 2, 1),
+    ]
+    assert Observation.query.count() == total - sum(archived.values())
+    assert (
+        Observation.query.filter(
+            Observation.date_logged < datetime.date(2024, 3, 1)
+        ).count()
+        == 0
+    )
+
+    entries = catalog.entries()
+    assert [entry.month for entry in entries] == list(archived)
+    assert [entry.rows for entry in entries] == list(archived.values())
+    assert entries[1].max_date_logged == datetime.date(2024, 2, 29)
+    assert entries[1].max_observed_at_utc == datetime.datetime(
+        2024, 3, 1, 1, 30
+    )
+    assert all(os.path.exists(entry.path) for entry in entries)
+
+    # Archiving again has nothing further to do
+    assert archive_old_months(catalog, AGE_MONTHS, TODAY) == {}
+
+
+def test_reads_include_archived_months(client, catalog):
+    """Tests that reads give the same results once months are archived."""
+
+    requests = READ_REQUESTS + [
+        "/observations?fields=id",
+        "/observations?limit=7&fields=id,date_logged",
+    ]
+    before = [_read_all(client, url) for url in requests]
+
+    archive_old_months(catalog, AGE_MONTHS, TODAY)
+
+    after = [_read_all(client, url) for url in requests]
+
+    for url, expected, actual in zip(requests, before, after):
+        assert actual == expected, url
+
+
+def test_reads_prune_archived_months(client, catalog, mocker):
+    """Tests that only archived months in the requested range are read."""
+
+    archive_old_months(catalog, AGE_MONTHS, TODAY)
+    query_month = mocker.spy(__import__("archive"), "query_month")
+
+    response = client.get(
+        "/observations?date_from=2024-03-01", headers=AUTH_HEADERS
+    )
+    assert response.status_code == 200
+    assert query_month.call_count == 0
+
+    response = client.get(
+        "/observations?observed_from=2024-02-10T00:00:00"
+        "&observed_to=2024-03-05T00:00:00",
+        headers=AUTH_HEADERS,
+    )
+    assert response.status_code == 200
+    assert [call.args[1].month for call in query_month.call_args_list] == [
+        datetime.date(2024, 2, 1)
+    ]
+
+
+def test_archive_late_observations(client, catalog):
+    """Tests that observations received for an archived month are merged into
+    its archive file on the next run."""
+
+    archive_old_months(catalog, AGE_MONTHS, TODAY)
+    previous, _ = catalog.entries()
+
+    client.post(
+        "/observations",
+        json=make_day_observation(datetime.date(2024, 1, 2), water_temp=99),
+        headers=AUTH_HEADERS,
+    )
+    url = "/observations?date_from=2024-01-01&date_to=2024-01-31"
+    assert len(client.get(url, headers=AUTH_HEADERS).json) == previous.rows + 1
+
+    assert archive_old_months(catalog, AGE_MONTHS, TODAY) == {
+        datetime.date(2024, 1, 1): 1
+    }
+
+    entry, _ = catalog.entries()
+    assert entry.rows == previous.rows + 1
+    assert not os.path.exists(previous.path)
+
+    observations = client.get(url, headers=AUTH_HEADERS).json
+    assert len(observations) == previous.rows + 1
+    assert [o["water_temp"] for o in observations].count(99) == 1
+
+    with open(catalog.path, encoding="utf-8") as file:
+        assert len(json.load(file)) == 2
+
+
+def test_rebuild_rollups_includes_archived_months(client, catalog):
+    """Tests that rebuilding the rollups after archiving keeps the archived
+    months in the aggregates."""
+
+    requests = [url for url in READ_REQUESTS if "/aggregate" in url]
+    before = [_read_all(client, url) for url in requests]
+
+    archive_old_months(catalog, AGE_MONTHS, TODAY)
+    rebuild_rollups(chunk_size=7)
+    db.session.commit()
+
+    after = [_read_all(client, url) for url in requests]
+
+    for url, expected, actual in zip(requests, before, after):
+        assert actual == expected, url
+
+
+def test_rebuild_sketches_includes_archived_months(client, catalog):
+    """Tests that rebuilding the sketches after archiving keeps the archived
+    days in the stats."""
+
+    url = "/observations/stats?group_by=day&percentiles=0,50,100"
+    before = _read_all(client, url)
+
+    archive_old_months(catalog, AGE_MONTHS, TODAY)
+    rebuild_sketches(chunk_size=7)
+    db.session.commit()
+
+    assert _read_all(client, url) == before
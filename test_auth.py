@@ -0,0 +1,110 @@
+"""Tests for the authentication functionality."""
+
+import datetime
+
+import jwt
+import pytest
+from flask import Flask
+
+from auth import TokenCache, get_token_cache, token_required
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Fixture to set up a test client with a single protected route."""
+
+    monkeypatch.setattr("config.config.secret_key", "test_secret")
+
+    app = Flask(__name__)
+    app.config["TESTING"] = True
+
+    @app.route("/protected")
+    @token_required
+    def protected():
+        return "OK"
+
+    with app.app_context():
+        yield app.test_client()
+
+
+def make_token(expires_in):
+    """Encodes a token expiring the given number of seconds from now."""
+
+    expires_at = datetime.datetime.now(
+        datetime.timezone.utc
+    ) + datetime.timedelta(seconds=expires_in)
+
+    return jwt.encode({"user": "user", "exp": expires_at}, "test_secret")
+
+
+def freeze_clock(mocker, now):
+    """Fixes the time seen by the token cache and by PyJWT's expiry check."""
+
+    class FrozenDatetime(datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return now.astimezone(tz)
+
+    mocker.patch("auth.time.time", return_value=now.timestamp())
+    mocker.patch("jwt.api_jwt.datetime", FrozenDatetime)
+
+
+def test_token_required_caches_verified_tokens(client, mocker):
+    """Tests that a token is only verified once while it is cached."""
+
+    decode = mocker.spy(jwt, "decode")
+    headers = {"Authorization": f"Bearer {make_token(60)}"}
+
+    for _ in range(3):
+        assert client.get("/protected", headers=headers).status_code == 200
+
+    assert decode.call_count == 1
+    assert get_token_cache().hits == 2
+    assert get_token_cache().misses == 1
+
+
+def test_token_required_rejects_expired_cached_token(client, mocker):
+    """Tests that a cached token is rejected once it has expired."""
+
+    headers = {"Authorization": f"Bearer {make_token(60)}"}
+    assert client.get("/protected", headers=headers).status_code == 200
+
+    freeze_clock(
+        mocker,
+        datetime.datetime.now(datetime.timezone.utc)
+        + datetime.timedelta(seconds=61),
+    )
+    response = client.get("/protected", headers=headers)
+
+    assert response.status_code == 401
+    assert response.json["message"] == "Token has expired"
+
+
+def test_token_required_rejects_invalid_token(client):
+    """Tests that a token signed with another secret is never cached."""
+
+    token = jwt.encode({"user": "user"}, "other_secret")
+    headers = {"Authorization": f"Bearer {token}"}
+
+    for _ in range(2):
+        response = client.get("/protected", headers=headers)
+        assert response.status_code == 401
+        assert response.json["message"] == "Token is invalid"
+
+    assert get_token_cache().hits == 0
+
+
+def test_token_cache_evicts_least_recently_used():
+    """Tests that the cache stays within its maximum size."""
+
+    cache = TokenCache(max_size=2)
+    claims = {"exp": datetime.datetime.now().timestamp() + 60}
+
+    cache.put("a", claims)
+    cache.put("b", claims)
+    cache.get("a")
+    cache.put("c", claims)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == claims
+    assert cache.get("c") == claims
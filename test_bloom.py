@@ -0,0 +1,29 @@
+"""Tests for the Bloom filters used to spot recently ingested keys."""
+
+from bloom import BloomFilter, RotatingBloomFilter
+
+
+def test_bloom_filter():
+    """Tests that added keys are always found and the false positive rate is
+    close to the one the filter was sized for."""
+
+    bloom = BloomFilter(10000, error_rate=0.01)
+    for number in range(10000):
+        bloom.add((1, number))
+
+    assert all((1, number) in bloom for number in range(10000))
+
+    false_positives = sum((2, number) in bloom for number in range(10000))
+    assert false_positives < 200
+
+
+def test_rotating_bloom_filter():
+    """Tests that the rotating filter remembers the latest keys, and forgets
+    the oldest ones once two more generations have been added."""
+
+    bloom = RotatingBloomFilter(1000)
+    for number in range(2500):
+        bloom.add(number)
+
+    assert all(number in bloom for number in range(1000, 2500))
+    assert sum(number in bloom for number in range(1000)) < 50
@@ -0,0 +1,201 @@
+"""Tests for the downsampled series endpoint."""
+
+import datetime
+import math
+
+import pytest
+
+from conftest import AUTH_HEADERS, make_observation_row
+from downsample import archived_rows, lttb
+from models import db
+
+
+def _reference_lttb(points, threshold):
+    """A straightforward, non-streaming LTTB to check the streaming version
+    against."""
+
+    if len(points) <= threshold:
+        return list(points)
+
+    middle_count, bucket_count = len(points) - 2, threshold - 2
+    sampled = [points[0]]
+
+    for i in range(bucket_count):
+        start = i * middle_count // bucket_count + 1
+        end = (i + 1) * middle_count // bucket_count + 1
+        following = points[
+            end : (i + 2) * middle_count // bucket_count + 1
+        ] or [points[-1]]
+        average_x = sum(p[0] for p in following) / len(following)
+        average_y = sum(p[1] for p in following) / len(following)
+        previous = sampled[-1]
+
+        sampled.append(
+            max(
+                points[start:end],
+                key=lambda p: abs(
+                    (previous[0] - average_x) * (p[1] - previous[1])
+                    - (previous[0] - p[0]) * (average_y - previous[1])
+                ),
+            )
+        )
+
+    sampled.append(points[-1])
+
+    return sampled
+
+
+@pytest.fixture
+def num_devices():
+    """Fixture for a second device, which has no observations."""
+
+    return 2
+
+
+@pytest.fixture
+def client(app):
+    """Fixture to set up an authenticated test client with one device that
+    has an observation every minute for a day, with a single spike in the air
+    temperature."""
+
+    start = datetime.datetime(2024, 1, 1)
+
+    db.session.add_all(
+        make_observation_row(
+            date_logged=(start + datetime.timedelta(minutes=i)).date(),
+            time_logged=(start + datetime.timedelta(minutes=i)).time(),
+            air_temp=100 if i == 700 else 10 + i % 5,
+        )
+        for i in range(1440)
+    )
+    db.session.commit()
+
+    return app.test_client()
+
+
+def test_lttb_matches_reference():
+    """Tests that streaming LTTB selects the same points as a reference
+    implementation over the whole series."""
+
+    points = [(x, math.sin(x / 10) * x + (x % 7)) for x in range(1003)]
+
+    for threshold in (3, 4, 10, 100, 1001):
+        sampled = list(lttb(iter(points), len(points), threshold))
+
+        assert sampled == _reference_lttb(points, threshold)
+        assert len(sampled) == threshold
+
+
+def test_lttb_short_series():
+    """Tests that series no longer than the threshold are returned as they
+    are."""
+
+    points = [(0, 1), (1, 5), (2, 3)]
+
+    assert list(lttb(iter(points), 3, 3)) == points
+    assert list(lttb(iter([]), 0, 3)) == []
+
+
+def test_lttb_miscounted_series():
+    """Tests that a series with fewer points than counted, e.g. where rows
+    were deleted in between, still keeps its first and last points."""
+
+    points = [(x, x % 3) for x in range(50)]
+
+    sampled = list(lttb(iter(points), 100, 10))
+
+    assert sampled[0] == points[0]
+    assert sampled[-1] == points[-1]
+    assert len(sampled) <= 10
+
+
+def test_archived_rows(mocker):
+    """Tests that archived months are merged in order across their
+    overlapping edges, and that each is only loaded once the rows of the month
+    before it have been consumed."""
+
+    months = {
+        "january": [(1, "a"), (5, "b"), (31, "c")],
+        "february": [(30, "d"), (40, "e"), (59, "f")],
+        "march": [],
+        "april": [(91, "g")],
+    }
+    query_month = mocker.patch(
+        "downsample.query_month",
+        side_effect=lambda statement, month: months[month],
+    )
+
+    rows = archived_rows("statement", list(months))
+
+    assert [next(rows) for _ in range(2)] == [(1, "a"), (5, "b")]
+    assert query_month.call_count == 2
+    assert list(rows) == [(30, "d"), (31, "c"), (40, "e"), (59, "f"), (91, "g")]
+
+
+def test_get_series(client):
+    """Tests that a day of observations is downsampled to the requested
+    number of points, keeping the first, last and spike."""
+
+    response = client.get(
+        "/observations/series?device_id=1&metric=air_temp&points=50",
+        headers=AUTH_HEADERS,
+    )
+
+    assert response.status_code == 200
+    assert response.json["device_id"] == 1
+    assert response.json["metric"] == "air_temp"
+
+    points = response.json["points"]
+    assert len(points) == 50
+    assert points[0] == ["2024-01-01T00:00:00", 10]
+    assert points[-1] == ["2024-01-01T23:59:00", 10 + 1439 % 5]
+    assert ["2024-01-01T11:40:00", 100] in points
+    assert [p[0] for p in points] == sorted(p[0] for p in points)
+
+
+def test_get_series_filters(client):
+    """Tests that the other filters narrow the series."""
+
+    response = client.get(
+        "/observations/series?device_id=1&metric=water_temp&points=100"
+        "&observed_from=2024-01-01T12:00:00&observed_to=2024-01-01T12:09:00",
+        headers=AUTH_HEADERS,
+    )
+
+    assert response.status_code == 200
+    assert response.json["points"] == [
+        [f"2024-01-01T12:0{i}:00", 10] for i in range(10)
+    ]
+
+    response = client.get(
+        "/observations/series?device_id=2&metric=water_temp",
+        headers=AUTH_HEADERS,
+    )
+
+    assert response.status_code == 200
+    assert response.json["points"] == []
+
+
+@pytest.mark.parametrize(
+    "query_string",
+    [
+        "metric=air_temp",
+        "device_id=1",
+        "device_id=1&metric=name",
+        "device_id=1&metric=air_temp&points=2",
+        "device_id=1&metric=air_temp&points=0",
+        "device_id=1&metric=air_temp&points=-5",
+        "device_id=1&metric=air_temp&points=abc",
+        "device_id=1&metric=air_temp&points=",
+        "device_id=1&metric=air_temp&points=100000",
+    ],
+)
+def test_get_series_invalid(client, query_string):
+    """Tests that a missing device or an invalid metric or point count is
+    rejected."""
+
+    response = client.get(
+        f"/observations/series?{query_string}", headers=AUTH_HEADERS
+    )
+
+    assert response.status_code == 400
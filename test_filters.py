@@ -0,0 +1,167 @@
+"""Tests for the declarative query filters."""
+
+import datetime
+
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from conftest import AUTH_HEADERS, make_device, make_observation_row
+from filters import DEVICE_FILTERS, OBSERVATION_FILTERS, InvalidFilterError
+from models import Observation, db
+
+
+@pytest.fixture
+def num_devices():
+    """Fixture to start without devices, so they can be added with differing
+    statuses and battery levels."""
+
+    return 0
+
+
+@pytest.fixture
+def cache_responses():
+    """Fixture to disable response caching, so each read runs its filters."""
+
+    return False
+
+
+@pytest.fixture
+def client(app):
+    """Fixture to set up an authenticated test client backed by a database
+    holding observations from two devices."""
+
+    db.session.add_all(
+        make_device(
+            number,
+            status="Online" if number % 2 else "Offline",
+            battery_level=number * 10,
+        )
+        for number in range(1, 5)
+    )
+    db.session.add_all(
+        make_observation_row(
+            date_logged=datetime.date(2024, 1, day),
+            water_temp=day,
+            wind_direction=day * 30,
+            device_id=1 + day % 2,
+        )
+        for day in range(1, 11)
+    )
+    db.session.commit()
+
+    return app.test_client()
+
+
+def _water_temps(client, query_string):
+    """Gets the water temperatures of the observations matching filters."""
+
+    response = client.get(
+        "/observations",
+        query_string={**query_string, "fields": "water_temp"},
+        headers=AUTH_HEADERS,
+    )
+    assert response.status_code == 200, response.json
+
+    return sorted(o["water_temp"] for o in response.json)
+
+
+@pytest.mark.parametrize(
+    "query_string, expected",
+    [
+        ({"water_temp": "3"}, [3]),
+        ({"water_temp__in": "2,4,99"}, [2, 4]),
+        ({"min_water_temp": "3", "max_water_temp": "5"}, [3, 4, 5]),
+        ({"water_temp__gt": "8"}, [9, 10]),
+        ({"water_temp__lt": "3"}, [1, 2]),
+        ({"min_wind_direction": "240"}, [8, 9, 10]),
+        ({"device_id__in": "1", "water_temp__lt": "6"}, [2, 4]),
+        ({"date_from": "2024-01-09"}, [9, 10]),
+        ({"date_logged__in": "2024-01-01,2024-01-10"}, [1, 10]),
+        ({"observed_to": "2024-01-02T14:00:00+02:00"}, [1, 2]),
+        ({"time_zone_offset": "UTC+00:00", "max_water_temp": "1"}, [1]),
+    ],
+)
+def test_observation_filters(client, query_string, expected):
+    """Tests each operator on observation columns of different types."""
+
+    assert _water_temps(client, query_string) == expected
+
+
+@pytest.mark.parametrize(
+    "query_string, message",
+    [
+        ({"min_water_temperature": "1"}, "Unknown parameters: "),
+        ({"min_water_temp": "1.5"}, "min_water_temp must be an integer"),
+        ({"min_water_temp": " 1"}, "min_water_temp must be an integer"),
+        ({"max_latitude": "nan"}, "max_latitude must be a number"),
+        ({"max_latitude": "1e999"}, "max_latitude must be a number"),
+        ({"date_from": "01/02/2024"}, "date_from must be a date"),
+        ({"observed_from": "yesterday"}, "observed_from must be a date"),
+        ({"device_id__in": "1,x"}, "device_id__in must be a comma-separated"),
+        ({"device_id": ["1", "2"]}, "device_id can only be given once"),
+        ({"near": "10"}, "near must be a location given as latitude"),
+        ({"near": "10,20", "radius_km": "0"}, "radius_km must be a positive"),
+    ],
+)
+def test_observation_filters_invalid(client, query_string, message):
+    """Tests that unknown parameters and invalid values are rejected."""
+
+    for path in ("/observations", "/observations/aggregate"):
+        response = client.get(
+            path, query_string=query_string, headers=AUTH_HEADERS
+        )
+
+        assert response.status_code == 400
+        assert response.json["message"].startswith(message)
+
+
+def test_route_parameters_allowed_per_route():
+    """Tests that a route's own parameters are only allowed on that route."""
+
+    args = MultiDict({"bucket": "day", "min_humidity": "5"})
+
+    assert OBSERVATION_FILTERS.parse(args, ("bucket",)) == {"min_humidity": 5}
+    with pytest.raises(InvalidFilterError, match="Unknown parameters: bucket"):
+        OBSERVATION_FILTERS.parse(args, ("limit",))
+
+
+def test_device_filters(client):
+    """Tests that devices share the filters, built from their columns."""
+
+    response = client.get(
+        "/devices",
+        query_string={"status__in": "Online", "battery_level__gt": "10"},
+        headers=AUTH_HEADERS,
+    )
+
+    assert response.status_code == 200
+    assert [d["name"] for d in response.json["devices"]] == ["DV-003"]
+
+    response = client.get(
+        "/devices", query_string={"embed": "all"}, headers=AUTH_HEADERS
+    )
+    assert response.status_code == 400
+
+    response = client.get(
+        "/devices", query_string={"min_status": "a"}, headers=AUTH_HEADERS
+    )
+    assert response.json["message"] == "Unknown parameters: min_status"
+
+    assert "last_observation_id" not in DEVICE_FILTERS.filters
+
+
+def test_filter_predicates_reused(client):
+    """Tests that the same combination of filters reuses its predicate and
+    produces the same SQL whatever the values."""
+
+    statements = []
+    for minimum, maximum in (("1", "5"), ("3", "8")):
+        filters = OBSERVATION_FILTERS.parse(
+            MultiDict({"max_water_temp": maximum, "min_water_temp": minimum})
+        )
+        query = OBSERVATION_FILTERS.apply(Observation.query, filters)
+        statements.append(str(query.statement))
+        assert query.count() == int(maximum) - int(minimum) + 1
+
+    assert statements[0] == statements[1]
+    assert OBSERVATION_FILTERS._compile.cache_info().hits >= 1
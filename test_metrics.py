@@ -0,0 +1,98 @@
+"""Tests for the request metrics."""
+
+import logging
+
+import pytest
+
+from conftest import AUTH_HEADERS
+from metrics import HISTOGRAMS, Histogram
+
+
+@pytest.fixture
+def num_devices():
+    """Fixture to start with an empty database."""
+
+    return 0
+
+
+@pytest.fixture
+def client(db_client):
+    """Fixture to set up an authenticated test client backed by an empty
+    database, with no metrics recorded yet."""
+
+    for histogram in HISTOGRAMS:
+        histogram.clear()
+
+    return db_client
+
+
+def test_histogram_render():
+    """Tests that histograms render cumulative buckets, the sum and the
+    count in the Prometheus text format."""
+
+    histogram = Histogram("test_seconds", "A test.", ("route",), (0.1, 1))
+    histogram.observe(0.05, 'say "hi"')
+    histogram.observe(0.5, 'say "hi"')
+    histogram.observe(5, 'say "hi"')
+
+    assert histogram.render() == [
+        "# HELP test_seconds A test.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{route="say \\"hi\\"",le="0.1"} 1',
+        'test_seconds_bucket{route="say \\"hi\\"",le="1"} 2',
+        'test_seconds_bucket{route="say \\"hi\\"",le="+Inf"} 3',
+        'test_seconds_sum{route="say \\"hi\\""} 5.55',
+        'test_seconds_count{route="say \\"hi\\""} 3',
+    ]
+
+
+def test_metrics_endpoint(client):
+    """Tests that requests to the API are recorded and exposed."""
+
+    response = client.get(
+        "/observations?min_humidity=1&limit=10", headers=AUTH_HEADERS
+    )
+    assert response.status_code == 200
+
+    metrics = client.get("/metrics")
+
+    assert metrics.status_code == 200
+    assert metrics.mimetype == "text/plain"
+
+    text = metrics.get_data(as_text=True)
+    assert (
+        'http_request_duration_seconds_count{endpoint="api.get_observations",'
+        'method="GET",status="200"} 1'
+    ) in text
+    assert (
+        'db_statements_per_request_count{endpoint="api.get_observations"} 1'
+    ) in text
+    assert (
+        'serialization_duration_seconds_count{endpoint="api.get_observations"}'
+        " 1"
+    ) in text
+    assert (
+        'http_response_size_bytes_count{endpoint="api.get_observations"} 1'
+    ) in text
+
+    # The one query run to fetch the observations
+    assert (
+        'db_statements_per_request_bucket{endpoint="api.get_observations",'
+        'le="0"} 0'
+    ) in text
+    assert (
+        'db_statements_per_request_bucket{endpoint="api.get_observations",'
+        'le="1"} 1'
+    ) in text
+
+
+def test_slow_request_log(client, monkeypatch, caplog):
+    """Tests that requests over the threshold are logged with their SQL."""
+
+    monkeypatch.setattr("config.config.slow_request_ms", 0.001)
+
+    with caplog.at_level(logging.WARNING, logger="metrics"):
+        client.get("/observations?min_humidity=1", headers=AUTH_HEADERS)
+
+    assert "Slow request: GET /observations?min_humidity=1" in caplog.text
+    assert "FROM observation" in caplog.text
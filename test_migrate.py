@@ -0,0 +1,133 @@
+"""Tests for the migration script."""
+
+from sqlalchemy import create_engine, inspect, text
+
+from models import Observation
+from utils.migrate import drop_index, migrate
+
+# The tables as they were before any columns or indexes were added.
+ORIGINAL_SCHEMA = (
+    """
+    CREATE TABLE device (
+        id INTEGER NOT NULL PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        city VARCHAR(100) NOT NULL,
+        country VARCHAR(100) NOT NULL,
+        status VARCHAR(15) NOT NULL,
+        battery_level INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE observation (
+        id INTEGER NOT NULL PRIMARY KEY,
+        date_logged DATE NOT NULL,
+        time_logged TIME NOT NULL,
+        time_zone_offset VARCHAR(80) NOT NULL,
+        latitude FLOAT NOT NULL,
+        longitude FLOAT NOT NULL,
+        water_temp INTEGER NOT NULL,
+        air_temp INTEGER NOT NULL,
+        wind_speed INTEGER NOT NULL,
+        wind_direction INTEGER NOT NULL,
+        humidity INTEGER NOT NULL,
+        haze_percent INTEGER NOT NULL,
+        precipitation_mm INTEGER NOT NULL,
+        radiation_bq INTEGER NOT NULL,
+        device_id INTEGER NOT NULL REFERENCES device (id)
+    )
+    """,
+)
+
+
+def test_migrate_original_schema(tmp_path):
+    """Tests that a database created before any migrations is brought up to
+    date, with repeated readings removed, and that migrating again changes
+    nothing."""
+
+    uri = f"sqlite:///{tmp_path / 'old.db'}"
+    engine = create_engine(uri)
+
+    with engine.begin() as connection:
+        for statement in ORIGINAL_SCHEMA:
+            connection.execute(text(statement))
+        connection.execute(
+            text(
+                "INSERT INTO device VALUES "
+                "(1, 'DV-001', 'London', 'United Kingdom', 'Online', 50)"
+            )
+        )
+        # The second and third are the same reading, at 11:00 UTC.
+        for time_logged, offset in (
+            ("10:00:00.000000", "UTC+00:00"),
+            ("12:00:00.000000", "UTC+01:00"),
+            ("11:00:00.000000", "UTC+00:00"),
+        ):
+            connection.execute(
+                text(
+                    "INSERT INTO observation (date_logged, time_logged, "
+                    "time_zone_offset, latitude, longitude, water_temp, "
+                    "air_temp, wind_speed, wind_direction, humidity, "
+                    "haze_percent, precipitation_mm, radiation_bq, device_id) "
+                    "VALUES ('2024-01-01', :time, :offset, 51.5, -0.1, "
+                    "10, 20, 5, 180, 50, 10, 0, 3, 1)"
+                ),
+                {"time": time_logged, "offset": offset},
+            )
+
+    for _ in range(2):
+        migrate(uri)
+
+    with engine.connect() as connection:
+        ids = connection.execute(
+            text("SELECT id FROM observation ORDER BY id")
+        ).scalars()
+        assert list(ids) == [1, 2]
+
+        (latest,) = connection.execute(
+            text("SELECT last_observation_id FROM device")
+        ).one()
+        assert latest == 2
+
+        indexes = {
+            index["name"]: index["unique"]
+            for index in inspect(connection).get_indexes("observation")
+        }
+        assert indexes["uq_observation_device_observed_at"]
+
+        columns = {
+            column["name"]: column["nullable"]
+            for column in inspect(connection).get_columns("observation")
+        }
+        assert set(Observation.__table__.c.keys()) <= set(columns)
+        assert not columns["observed_at_utc"]
+        assert not columns["grid_cell"]
+        assert "last_observation_id" in {
+            column["name"]
+            for column in inspect(connection).get_columns("device")
+        }
+
+    engine.dispose()
+
+
+def test_drop_index(tmp_path):
+    """Tests that an index is dropped if it exists, and that dropping it again
+    changes nothing."""
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'index.db'}")
+
+    with engine.begin() as connection:
+        for statement in ORIGINAL_SCHEMA:
+            connection.execute(text(statement))
+        connection.execute(
+            text(
+                "CREATE INDEX ix_observation_device ON observation (device_id)"
+            )
+        )
+
+    for _ in range(2):
+        drop_index(engine, Observation.__table__, "ix_observation_device")
+
+    with engine.connect() as connection:
+        assert inspect(connection).get_indexes("observation") == []
+
+    engine.dispose()
@@ -0,0 +1,213 @@
+"""Tests for the per-user rate limits and the cap on expensive queries."""
+
+import datetime
+
+import pytest
+
+from app import create_app
+from config import Config
+from conftest import make_observation_row
+from models import db
+from ratelimit import SLOT_LEASE_SECONDS, MemoryBackend, SQLiteBackend
+
+
+@pytest.fixture
+def cache_responses():
+    """Fixture to disable response caching, so each read is a request."""
+
+    return False
+
+
+@pytest.fixture
+def client(app, mocker, monkeypatch):
+    """Fixture to set up a test client backed by a database holding a few
+    observations, whose bearer tokens are the user's name."""
+
+    mocker.patch(
+        "jwt.decode", side_effect=lambda token, *args, **kwargs: {"user": token}
+    )
+    monkeypatch.setattr("config.config.rate_limit_backend", "memory")
+
+    db.session.add_all(
+        make_observation_row(
+            date_logged=datetime.date(2024, 1, day), water_temp=day
+        )
+        for day in range(1, 4)
+    )
+    db.session.commit()
+
+    return app.test_client()
+
+
+def _headers(user):
+    """Builds the headers authenticating a request as the given user."""
+
+    return {"Authorization": f"Bearer {user}"}
+
+
+def test_rate_limit_per_user_and_budget(client, monkeypatch):
+    """Tests that each user's reads are limited separately from their writes
+    and from other users."""
+
+    monkeypatch.setattr("config.config.rate_limit_read_rate", 0.5)
+    monkeypatch.setattr("config.config.rate_limit_read_burst", 2)
+
+    statuses = [
+        client.get("/devices", headers=_headers("alice")).status_code
+        for _ in range(3)
+    ]
+    assert statuses == [200, 200, 429]
+
+    response = client.get("/observations", headers=_headers("alice"))
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+    assert response.json["message"].startswith("Too many read requests")
+
+    response = client.get("/devices", headers=_headers("bob"))
+    assert response.status_code == 200
+
+    response = client.post(
+        "/devices",
+        json={
+            "name": "DV-002",
+            "city": "Leeds",
+            "country": "United Kingdom",
+            "status": "Online",
+            "battery_level": 90,
+        },
+        headers=_headers("alice"),
+    )
+    assert response.status_code == 201
+
+
+def test_rate_limit_disabled(client, monkeypatch):
+    """Tests that a rate of 0 disables the limit."""
+
+    monkeypatch.setattr("config.config.rate_limit_read_rate", 0)
+    monkeypatch.setattr("config.config.rate_limit_read_burst", 0)
+
+    response = client.get("/devices", headers=_headers("alice"))
+    assert response.status_code == 200
+
+
+def test_rate_limits_follow_app_config(mocker, tmp_path):
+    """Tests that apps created with different configurations apply their own
+    limits rather than sharing the settings loaded from .env."""
+
+    mocker.patch(
+        "jwt.decode", side_effect=lambda token, *args, **kwargs: {"user": token}
+    )
+
+    statuses = {}
+    for rate in (0, 0.5):
+        app = create_app(
+            Config(
+                SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / f'{rate}.db'}",
+                SQLALCHEMY_ECHO="False",
+                RATE_LIMIT_BACKEND="memory",
+                RATE_LIMIT_READ_PER_SECOND=str(rate),
+                RATE_LIMIT_READ_BURST="1",
+            )
+        )
+        client = app.test_client()
+
+        with app.app_context():
+            db.create_all()
+
+        statuses[rate] = [
+            client.get("/devices", headers=_headers("alice")).status_code
+            for _ in range(2)
+        ]
+
+        with app.app_context():
+            db.engine.dispose()
+
+    assert statuses == {0: [200, 200], 0.5: [200, 429]}
+
+
+def test_concurrent_queries_capped(client, monkeypatch):
+    """Tests that expensive queries beyond the cap are refused until a
+    streamed response holding a slot has been sent."""
+
+    monkeypatch.setattr("config.config.max_concurrent_queries", 1)
+
+    export = client.get("/observations/export", headers=_headers("alice"))
+    assert export.status_code == 200
+
+    response = client.get("/observations", headers=_headers("bob"))
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+    # Cheap routes aren't capped.
+    assert client.get("/devices", headers=_headers("bob")).status_code == 200
+
+    assert len(export.get_data(as_text=True).splitlines()) == 3
+
+    response = client.get("/observations", headers=_headers("bob"))
+    assert response.status_code == 200
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path, mocker):
+    """Fixture to create each backend with a clock that only moves when the
+    test advances it."""
+
+    clock = mocker.patch("ratelimit.time")
+    clock.monotonic.return_value = clock.time.return_value = 1000.0
+
+    if request.param == "memory":
+        yield MemoryBackend(), clock
+    else:
+        yield SQLiteBackend(str(tmp_path / "ratelimit.db"), 5), clock
+
+
+def test_backend_token_bucket(backend):
+    """Tests that a bucket allows a burst, then refills at its rate."""
+
+    backend, clock = backend
+
+    assert [backend.take("read:a", 2, 3) for _ in range(3)] == [0, 0, 0]
+    assert backend.take("read:a", 2, 3) == pytest.approx(0.5)
+    assert backend.take("read:b", 2, 3) == 0
+
+    clock.monotonic.return_value = clock.time.return_value = 1000.5
+
+    assert backend.take("read:a", 2, 3) == 0
+    assert backend.take("read:a", 2, 3) == pytest.approx(0.5)
+
+
+def test_backend_slots(backend):
+    """Tests that only a limited number of slots can be held at once."""
+
+    backend, _ = backend
+
+    first = backend.acquire("queries", 2)
+    second = backend.acquire("queries", 2)
+
+    assert first is not None and second is not None
+    assert backend.acquire("queries", 2) is None
+    assert backend.acquire("other", 2) is not None
+
+    backend.release(first)
+    assert backend.acquire("queries", 2) is not None
+
+
+def test_sqlite_backend_shared(tmp_path, mocker):
+    """Tests that workers opening the same file share their limits, and that
+    slots held by a worker that died are freed once their lease expires."""
+
+    clock = mocker.patch("ratelimit.time")
+    clock.time.return_value = 1000.0
+    path = str(tmp_path / "ratelimit.db")
+    first, second = SQLiteBackend(path, 5), SQLiteBackend(path, 5)
+
+    assert first.take("write:a", 1, 1) == 0
+    assert second.take("write:a", 1, 1) == pytest.approx(1)
+
+    assert first.acquire("queries", 1) is not None
+    assert second.acquire("queries", 1) is None
+
+    clock.time.return_value += SLOT_LEASE_SECONDS
+    assert second.acquire("queries", 1) is not None
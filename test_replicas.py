@@ -0,0 +1,200 @@
+"""Tests for splitting reads and writes between the primary database and its
+replicas, using SQLite files as stand-ins."""
+
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine
+
+from app import api_blueprint as api
+from cache import ResponseCache
+from models import Device, db
+from replicas import configure_replicas
+
+
+def _create_database(path, name):
+    """Creates a database file holding a single device with the given name,
+    so that responses show which database served them."""
+
+    engine = create_engine(f"sqlite:///{path}")
+    db.metadata.create_all(engine)
+
+    with engine.begin() as connection:
+        connection.execute(
+            Device.__table__.insert().values(
+                name=name,
+                city="London",
+                country="United Kingdom",
+                status="Online",
+                battery_level=50,
+            )
+        )
+
+    engine.dispose()
+
+
+def _replica_uri(path):
+    """Builds the URI opening a replica read-only, which fails if the file
+    doesn't exist rather than creating it."""
+
+    return f"sqlite:///file:{path}?mode=ro&uri=true"
+
+
+@pytest.fixture
+def create_client(tmp_path, mocker, monkeypatch):
+    """Fixture to create test clients backed by a primary database and
+    replicas, whose bearer tokens are the user's name."""
+
+    mocker.patch(
+        "jwt.decode", side_effect=lambda token, *args, **kwargs: {"user": token}
+    )
+    clock = mocker.patch("replicas.time")
+    clock.monotonic.return_value = 1000.0
+    apps = []
+
+    def _create_client(replicas, cache_size=0):
+        """Creates the databases and a client using the given number of
+        replicas and response cache size, returning the client and the
+        app's ReplicaSet."""
+
+        primary = tmp_path / "primary.db"
+        _create_database(primary, "Primary")
+        for index in range(replicas):
+            _create_database(
+                tmp_path / f"replica{index}.db", f"Replica {index}"
+            )
+
+        monkeypatch.setattr(
+            "config.config.database_replica_uris",
+            [
+                _replica_uri(tmp_path / f"replica{index}.db")
+                for index in range(replicas)
+            ],
+        )
+
+        app = Flask(__name__)
+        app.config["TESTING"] = True
+        app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{primary}"
+        db.init_app(app)
+        app.register_blueprint(api)
+        app.extensions["response_cache"] = ResponseCache(cache_size, 60)
+        apps.append(app)
+
+        return app.test_client(), configure_replicas(app)
+
+    yield _create_client, clock, tmp_path
+
+    for app in apps:
+        with app.app_context():
+            db.engine.dispose()
+        app.extensions["database_replicas"].dispose()
+
+
+def _device_names(client, user="alice"):
+    """Gets the names of the devices read by a user."""
+
+    response = client.get(
+        "/devices", headers={"Authorization": f"Bearer {user}"}
+    )
+    assert response.status_code == 200, response.json
+
+    return [device["name"] for device in response.json["devices"]]
+
+
+def test_reads_use_replica_until_client_writes(create_client):
+    """Tests that reads go to the replica and writes to the primary, and that
+    a client reads from the primary for a while after it writes."""
+
+    create_client, clock, _ = create_client
+    client, _ = create_client(1)
+
+    assert _device_names(client) == ["Replica 0"]
+
+    response = client.post(
+        "/devices",
+        json={
+            "name": "New",
+            "city": "Leeds",
+            "country": "United Kingdom",
+            "status": "Online",
+            "battery_level": 90,
+        },
+        headers={"Authorization": "Bearer alice"},
+    )
+    assert response.status_code == 201
+
+    assert _device_names(client) == ["Primary", "New"]
+    assert _device_names(client, "bob") == ["Replica 0"]
+
+    clock.monotonic.return_value += 5
+    assert _device_names(client) == ["Replica 0"]
+
+    # Work outside a request, e.g. the ingest queue, uses the primary.
+    with client.application.app_context():
+        names = [device.name for device in Device.query]
+    assert names == ["Primary", "New"]
+
+
+def test_cache_bypassed_after_write(create_client):
+    """Tests that a client that has just written isn't served a response that
+    another client read from a lagging replica and cached."""
+
+    create_client, clock, _ = create_client
+    client, _ = create_client(1, cache_size=100)
+
+    response = client.post(
+        "/devices",
+        json={
+            "name": "New",
+            "city": "Leeds",
+            "country": "United Kingdom",
+            "status": "Online",
+            "battery_level": 90,
+        },
+        headers={"Authorization": "Bearer alice"},
+    )
+    assert response.status_code == 201
+
+    assert _device_names(client, "bob") == ["Replica 0"]
+    assert _device_names(client) == ["Primary", "New"]
+
+    # The writer's response wasn't cached for other clients either.
+    clock.monotonic.return_value += 5
+    assert _device_names(client, "carol") == ["Replica 0"]
+
+
+def test_replicas_take_turns(create_client):
+    """Tests that requests are spread across the replicas in turn."""
+
+    create_client, _, _ = create_client
+    client, _ = create_client(2)
+
+    assert [_device_names(client)[0] for _ in range(4)] == [
+        "Replica 0",
+        "Replica 1",
+        "Replica 0",
+        "Replica 1",
+    ]
+
+
+def test_unhealthy_replica_ejected(create_client):
+    """Tests that a replica failing its health check isn't used until it
+    passes a later check, and that reads fall back to the primary."""
+
+    create_client, clock, tmp_path = create_client
+    client, replica_set = create_client(2)
+    replicas = [tmp_path / f"replica{index}.db" for index in range(2)]
+
+    replicas[0].rename(tmp_path / "moved.db")
+    assert [_device_names(client)[0] for _ in range(3)] == ["Replica 1"] * 3
+
+    # Simulate the replica going down, closing its pooled connections.
+    replicas[1].unlink()
+    replica_set.engines[1].dispose()
+    clock.monotonic.return_value += 10
+    assert _device_names(client) == ["Primary"]
+
+    (tmp_path / "moved.db").rename(replicas[0])
+    assert _device_names(client) == ["Primary"]
+
+    clock.monotonic.return_value += 10
+    assert _device_names(client) == ["Replica 0"]
@@ -1,12 +1,22 @@
 """Tests for the API routes."""
 
 import base64
+import csv
 import datetime
+import io
+import json
+from functools import partial
 
+import msgpack
 import pytest
 from flask import Flask
+from sqlalchemy import event
 
 from app import api_blueprint as api
+from conftest import AUTH_HEADERS, make_observation
+from ingest_queue import get_ingest_queue
+from models import Device, db
+from rollups import rebuild_rollups
 from schemas import ObservationSchema
 
 
@@ -116,8 +126,12 @@ def test_get_observations_success(client, mocker):
         },
     ]
 
+    # Only the serialised columns are selected, so rows come back as tuples.
     mock_query = mocker.patch("models.Observation.query")
-    mock_query.all.return_value = mock_observations
+    mock_query.with_entities.return_value.all.return_value = [
+        tuple(observation.get(name) for name in ObservationSchema.Meta.fields)
+        for observation in mock_observations
+    ]
 
     response = client.get(
         "/observations",
@@ -186,3 +200,1007 @@ def test_create_observation_invalid_data(client, mocker):
     )
 
     assert response.status_code == 400
+
+
+def test_get_observations_paginated(db_client):
+    """Tests that paging through observations with a cursor returns every
+    observation exactly once, in order."""
+
+    observations = [
+        make_observation(date_logged=f"2024-01-0{day}", time_logged=time)
+        for day in (3, 1, 2)
+        for time in ("12:00:00", "08:30:00")
+    ]
+    response = db_client.post(
+        "/observations/create-many", json=observations, headers=AUTH_HEADERS
+    )
+    assert response.status_code == 201
+
+    seen = []
+    cursor = None
+    while True:
+        query = {"limit": 4}
+        if cursor:
+            query["cursor"] = cursor
+        response = db_client.get(
+            "/observations", query_string=query, headers=AUTH_HEADERS
+        )
+        assert response.status_code == 200
+        assert len(response.json["observations"]) <= 4
+
+        seen.extend(response.json["observations"])
+        cursor = response.json["next_cursor"]
+        if cursor is None:
+            break
+
+    assert len(seen) == 6
+    assert len({observation["id"] for observation in seen}) == 6
+    assert [
+        (observation["date_logged"], observation["time_logged"])
+        for observation in seen
+    ] == sorted(
+        (observation["date_logged"], observation["time_logged"])
+        for observation in observations
+    )
+
+
+def test_get_observations_invalid_cursor(db_client):
+    """Tests that a malformed cursor is rejected."""
+
+    response = db_client.get(
+        "/observations",
+        query_string={"cursor": "not-a-cursor"},
+        headers=AUTH_HEADERS,
+    )
+
+    assert response.status_code == 400
+    assert response.json["message"] == "Invalid cursor"
+
+
+@pytest.mark.parametrize("path", ["/observations", "/devices"])
+@pytest.mark.parametrize("limit", ["abc", "1.5", "0", "-1", "1001"])
+def test_get_invalid_limit(db_client, path, limit):
+    """Tests that a limit that isn't a whole number in the allowed range is
+    rejected rather than ignored."""
+
+    response = db_client.get(
+        path, query_string={"limit": limit}, headers=AUTH_HEADERS
+    )
+
+    assert response.status_code == 400
+    assert response.json["message"] == (
+        "Limit must be a whole number between 1 and 1000"
+    )
+
+
+def test_get_observations_fields(db_client):
+    """Tests that only the requested fields are selected and output, with
+    and without pagination."""
+
+    observations = [
+        make_observation(date_logged=f"2024-01-0{day}", water_temp=day)
+        for day in range(1, 7)
+    ]
+    db_client.post(
+        "/observations/create-many", json=observations, headers=AUTH_HEADERS
+    )
+
+    statements = []
+    event.listen(
+        db.engine,
+        "before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement),
+    )
+
+    response = db_client.get(
+        "/observations",
+        query_string={"fields": "water_temp,id"},
+        headers=AUTH_HEADERS,
+    )
+
+    assert response.status_code == 200
+    assert [set(row) for row in response.json] == [{"id", "water_temp"}] * 6
+    assert "humidity" not in statements[-1]
+
+    seen = []
+    cursor = None
+    while True:
+        query = {"limit": 4, "fields": "water_temp"}
+        if cursor:
+            query["cursor"] = cursor
+        response = db_client.get(
+            "/observations", query_string=query, headers=AUTH_HEADERS
+        )
+        assert response.status_code == 200
+
+        seen.extend(response.json["observations"])
+        cursor = response.json["next_cursor"]
+        if cursor is None:
+            break
+
+    assert seen == [{"water_temp": day} for day in range(1, 7)]
+
+
+def test_get_observations_invalid_fields(db_client):
+    """Tests that unknown fields are rejected."""
+
+    response = db_client.get(
+        "/observations",
+        query_string={"fields": "water_temp,password"},
+        headers=AUTH_HEADERS,
+    )
+
+    assert response.status_code == 400
+    assert response.json["message"] == "Unknown fields: password"
+
+
+def test_export_observations_ndjson(db_client):
+    """Tests that the export route streams filtered observations as NDJSON."""
+
+    observations = [
+        make_observation(
+            time_logged=f"12:0{water_temp}:00", water_temp=water_temp
+        )
+        for water_temp in range(5)
+    ]
+    db_client.post(
+        "/observations/create-many", json=observations, headers=AUTH_HEADERS
+    )
+
+    response = db_client.get(
+        "/observations/export",
+        query_string={"min_water_temp": 2},
+        headers=AUTH_HEADERS,
+    )
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["water_temp"] for row in rows] == [2, 3, 4]
+    assert list(rows[0]) == list(ObservationSchema.Meta.fields)
+
+
+def test_export_observations_ndjson_first_row(db_client):
+    """Tests that the export route sends the first row on its own, before
+    fetching the rest of the first batch."""
+
+    observations = [
+        make_observation(time_logged=f"12:0{minute}:00") for minute in range(3)
+    ]
+    db_client.post(
+        "/observations/create-many", json=observations, headers=AUTH_HEADERS
+    )
+
+    response = db_client.get(
+        "/observations/export", headers=AUTH_HEADERS, buffered=False
+    )
+    chunks = [chunk.decode() for chunk in response.response if chunk]
+    response.close()
+
+    assert [chunk.count("\n") for chunk in chunks] == [1, 2]
+
+
+def test_export_observations_csv(db_client):
+    """Tests that the export route streams observations as CSV."""
+
+    db_client.post(
+        "/observations/create-many",
+        json=[make_observation(), make_observation(time_logged="13:00:00")],
+        headers=AUTH_HEADERS,
+    )
+
+    response = db_client.get(
+        "/observations/export",
+        query_string={"format": "csv"},
+        headers=AUTH_HEADERS,
+    )
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/csv"
+
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == 2
+    assert rows[0]["date_logged"] == "2024-01-01"
+
+
+def test_export_observations_csv_fields(db_client):
+    """Tests that the CSV columns follow the requested fields."""
+
+    db_client.post(
+        "/observations/create-many",
+        json=[make_observation()],
+        headers=AUTH_HEADERS,
+    )
+
+    response = db_client.get(
+        "/observations/export",
+        query_string={"format": "csv", "fields": "air_temp,date_logged"},
+        headers=AUTH_HEADERS,
+    )
+
+    assert response.status_code == 200
+    assert response.text.splitlines() == [
+        "date_logged,air_temp",
+        "2024-01-01,20",
+    ]
+
+
+def test_export_observations_invalid_format(db_client):
+    """Tests that an unsupported export format is rejected."""
+
+    response = db_client.get(
+        "/observations/export",
+        query_string={"format": "xml"},
+        headers=AUTH_HEADERS,
+    )
+
+    assert response.status_code == 400
+
+
+def test_create_multiple_observations_bulk(db_client):
+    """Tests that bulk mode inserts valid rows and reports invalid ones."""
+
+    observations = [
+        make_observation(),
+        make_observation(water_temp="warm"),
+        make_observation(time_logged="13:00:00"),
+        {"date_logged": "2024-01-01"},
+    ]
+
+    response = db_client.post(
+        "/observations/create-many",
+        query_string={"mode": "bulk"},
+        json=observations,
+        headers=AUTH_HEADERS,
+    )
+
+    assert response.status_code == 201
+    assert response.json["accepted"] == 2
+    assert response.json["rejected"] == 2
+    assert response.json["first_id"] == 1
+    assert response.json["last_id"] == 2
+    assert response.json["errors"]["1"] == {
+        "water_temp": ["Not a valid integer."]
+    }
+    assert "time_logged" in response.json["errors"]["3"]
+
+    response = db_client.get("/observations", headers=AUTH_HEADERS)
+    assert len(response.json) == 2
+
+
+def test_create_multiple_observations_bulk_all_invalid(db_client):
+    """Tests that bulk mode fails when no rows are valid."""
+
+    response = db_client.post(
+        "/observations/create-many",
+        query_string={"mode": "bulk"},
+        json=[{"unknown": 1}],
+        headers=AUTH_HEADERS,
+    )
+
+    assert response.status_code == 400
+    assert response.json["errors"]["0"]["unknown"] == ["Unknown field."]
+
+
+def _csv_upload(observations):
+    """Formats observations as a CSV upload with a header row."""
+
+    lines = [",".join(observations[0])]
+    lines += [
+        ",".join(str(value) for value in observation.values())
+        for observation in observations
+    ]
+
+    return "\n".join(lines) + "\n"
+
+
+def test_create_multiple_observations_bulk_csv(db_client, mocker):
+    """Tests that a CSV upload is parsed and inserted in chunks."""
+
+    # Read the body a few bytes at a time so lines span reads, and insert
+    # a couple of rows at a time.
+    mocker.patch("ingest.UPLOAD_READ_SIZE", 7)
+    mocker.patch("ingest.BULK_CHUNK_SIZE", 2)
+    insert_rows = mocker.spy(__import__("ingest"), "insert_rows")
+
+    observations = [
+        make_observation(time_logged=f"12:0{n}:00", water_temp=n)
+        for n in range(5)
+    ]
+    observations[2]["water_temp"] = "warm"
+    observations[3]["time_logged"] = ""
+    body = _csv_upload(observations) + "2024-01-01,12:00:00\n"
+
+    response = db_client.post(
+        "/observations/create-many",
+        query_string={"mode": "bulk"},
+        data=body.encode(),
+        content_type="text/csv",
+        headers=AUTH_HEADERS,
+    )
+
+    assert response.status_code == 201
+    assert response.json["accepted"] == 3
+    assert response.json["rejected"] == 3
+    assert (response.json["first_id"], response.json["last_id"]) == (1, 3)
+    assert response.json["errors"] == {
+        "2": {"water_temp": ["Not a valid integer."]},
+        "3": {"time_logged": ["Missing data for required field."]},
+        "5": {"_schema": ["Expected 14 values but found 2."]},
+    }
+    assert insert_rows.call_count == 2
+
+    response = db_client.get(
+        "/observations?fields=water_temp", headers=AUTH_HEADERS
+    )
+    assert sorted(o["water_temp"] for o in response.json) == [0, 1, 4]
+
+
+def test_create_multiple_observations_bulk_csv_invalid(db_client):
+    """Tests that the rows before the point where an upload can't be decoded
+    are kept, so that it can be sent again in full once fixed."""
+
+    body = _csv_upload(
+        [make_observation(time_logged=f"12:0{n}:00") for n in range(3)]
+    ).encode()
+    post = partial(
+        db_client.post,
+        "/observations/create-many",
+        query_string={"mode": "bulk"},
+        content_type="text/csv",
+        headers=AUTH_HEADERS,
+    )
+
+    response = post(data=body[:-40] + b"\xff\n")
+
+    assert response.status_code == 400
+    assert response.json["message"].startswith("Invalid CSV upload")
+    assert response.json["accepted"] == 2
+
+    response = post(data=body)
+
+    assert response.status_code == 201
+    assert response.json["accepted"] == 1
+    assert response.json["duplicates"] == 2
+    assert response.json["duplicate_rows"] == [0, 1]
+
+
+def test_create_multiple_observations_bulk_ndjson(db_client):
+    """Tests that an NDJSON upload rejects invalid lines individually."""
+
+    lines = [json.dumps(make_observation()), "{not json", "", "[]"]
+    lines.append(json.dumps(make_observation(time_logged="13:00:00")))
+
+    response = db_client.post(
+        "/observations/create-many",
+        query_string={"mode": "bulk"},
+        data="\n".join(lines),
+        content_type="application/x-ndjson",
+        headers=AUTH_HEADERS,
+    )
+
+    assert response.status_code == 201
+    assert response.json["accepted"] == 2
+    assert response.json["errors"] == {
+        "1": {"_schema": ["Invalid JSON."]},
+        "2": {"_schema": ["Invalid input type."]},
+    }
+
+
+def test_create_multiple_observations_bulk_msgpack(db_client):
+    """Tests that an upload of MessagePack maps is accepted."""
+
+    body = b"".join(
+        msgpack.packb(make_observation(time_logged=f"12:0{n}:00"))
+        for n in range(3)
+    )
+
+    response = db_client.post(
+        "/observations/create-many",
+        query_string={"mode": "bulk"},
+        data=body,
+        content_type="application/msgpack",
+        headers=AUTH_HEADERS,
+    )
+
+    assert response.status_code == 201
+    assert response.json["accepted"] == 3
+
+
+def test_create_observation_duplicate(db_client):
+    """Tests that a retried post returns the stored observation rather than
+    creating another."""
+
+    responses = [
+        db_client.post(
+            "/observations", json=make_observation(), headers=AUTH_HEADERS
+        )
+        for _ in range(2)
+    ]
+
+    assert [r.status_code for r in responses] == [201, 200]
+    assert responses[1].json == responses[0].json
+
+    # The same local time in another time zone is a different reading.
+    response = db_client.post(
+        "/observations",
+        json=make_observation(time_zone_offset="UTC+01:00"),
+        headers=AUTH_HEADERS,
+    )
+    assert response.status_code == 201
+
+    response = db_client.get("/observations", headers=AUTH_HEADERS)
+    assert len(response.json) == 2
+
+
+def test_create_multiple_observations_duplicates(db_client):
+    """Tests that create-many only inserts the observations not already
+    stored or repeated earlier in the batch."""
+
+    post = partial(
+        db_client.post, "/observations/create-many", headers=AUTH_HEADERS
+    )
+    first = make_observation(water_temp=1)
+    second = make_observation(time_logged="13:00:00", water_temp=2)
+
+    response = post(json=[first])
+    assert response.status_code == 201
+
+    response = post(json=[first, second, second])
+
+    assert response.status_code == 201
+    assert [o["id"] for o in response.json] == [1, 2, 2]
+
+    response = post(json=[second, first])
+
+    assert response.status_code == 200
+    assert [o["water_temp"] for o in response.json] == [2, 1]
+
+    response = db_client.get("/observations", headers=AUTH_HEADERS)
+    assert len(response.json) == 2
+
+
+def test_create_multiple_observations_duplicates_not_recent(db_client, mocker):
+    """Tests that duplicates of observations this worker hasn't ingested,
+    e.g. as another worker stored them, are caught by the unique index."""
+
+    find_duplicates = mocker.spy(__import__("ingest"), "find_duplicates")
+    post = partial(
+        db_client.post,
+        "/observations/create-many",
+        query_string={"mode": "bulk"},
+        headers=AUTH_HEADERS,
+    )
+    observations = [
+        make_observation(time_logged=f"12:0{n}:00") for n in range(3)
+    ]
+
+    assert post(json=observations[:2]).json["accepted"] == 2
+
+    # Forget the keys ingested so far.
+    db_client.application.extensions.pop("recent_observation_keys")
+    response = post(json=observations)
+
+    assert response.status_code == 201
+    assert response.json["accepted"] == 1
+    assert response.json["duplicates"] == 2
+    assert response.json["first_id"] == response.json["last_id"] == 3
+    assert find_duplicates.call_args.kwargs == {"check_all": True}
+
+    response = db_client.get("/observations", headers=AUTH_HEADERS)
+    assert len(response.json) == 3
+
+
+def test_get_observations_observed_at_utc_filter(db_client):
+    """Tests that observations are filtered on their UTC time regardless of
+    the time zone they were logged in."""
+
+    # 12:00 at +03:00 is 09:00 UTC, and 12:00 at -03:00 is 15:00 UTC.
+    db_client.post(
+        "/observations",
+        json=make_observation(time_zone_offset="+03:00", device_id=1),
+        headers=AUTH_HEADERS,
+    )
+    db_client.post(
+        "/observations/create-many",
+        query_string={"mode": "bulk"},
+        json=[make_observation(time_zone_offset="-03:00", device_id=1)],
+        headers=AUTH_HEADERS,
+    )
+
+    response = db_client.get(
+        "/observations",
+        query_string={
+            "device_id": 1,
+            "observed_from": "2024-01-01T12:00:00Z",
+        },
+        headers=AUTH_HEADERS,
+    )
+
+    assert response.status_code == 200
+    assert [row["time_zone_offset"] for row in response.json] == ["-03:00"]
+
+    response = db_client.get(
+        "/observations",
+        query_string={"observed_to": "2024-01-01T10:00:00+01:00"},
+        headers=AUTH_HEADERS,
+    )
+
+    assert [row["time_zone_offset"] for row in response.json] == ["+03:00"]
+
+
+def test_create_observation_invalid_time_zone_offset(db_client):
+    """Tests that observations with an unrecognised offset are rejected."""
+
+    response = db_client.post(
+        "/observations",
+        json=make_observation(time_zone_offset="Europe/London"),
+        headers=AUTH_HEADERS,
+    )
+
+    assert response.status_code == 400
+    assert response.json == {
+        "time_zone_offset": ["Not a valid time zone offset."]
+    }
+
+
+def test_aggregate_observations(db_client):
+    """Tests that observations are aggregated into buckets per device."""
+
+    observations = [
+        make_observation(time_logged="10:15:00", water_temp=10, device_id=1),
+        make_observation(time_logged="10:45:00", water_temp=20, device_id=1),
+        make_observation(time_logged="11:15:00", water_temp=30, device_id=1),
+        make_observation(time_logged="10:30:00", water_temp=40, device_id=2),
+    ]
+    db_client.post(
+        "/observations/create-many", json=observations, headers=AUTH_HEADERS
+    )
+
+    response = db_client.get(
+        "/observations/aggregate",
+        query_string={
+            "bucket": "hour",
+            "group_by": "device_id",
+            "metrics": "water_temp",
+        },
+        headers=AUTH_HEADERS,
+    )
+
+    assert response.status_code == 200
+    assert response.json == [
+        {
+            "bucket": "2024-01-01T10:00:00",
+            "count": 2,
+            "device_id": 1,
+            "water_temp": {"avg": 15.0, "max": 20, "min": 10},
+        },
+        {
+            "bucket": "2024-01-01T10:00:00",
+            "count": 1,
+            "device_id": 2,
+            "water_temp": {"avg": 40.0, "max": 40, "min": 40},
+        },
+        {
+            "bucket": "2024-01-01T11:00:00",
+            "count": 1,
+            "device_id": 1,
+            "water_temp": {"avg": 30.0, "max": 30, "min": 30},
+        },
+    ]
+
+    response = db_client.get(
+        "/observations/aggregate",
+        query_string={"bucket": "day", "max_water_temp": 30},
+        headers=AUTH_HEADERS,
+    )
+
+    assert len(response.json) == 1
+    assert response.json[0]["count"] == 3
+    assert response.json[0]["air_temp"]["avg"] == 20.0
+
+
+def test_aggregate_observations_invalid_metric(db_client):
+    """Tests that unknown metrics are rejected."""
+
+    response = db_client.get(
+        "/observations/aggregate",
+        query_string={"metrics": "water_temp,latitude"},
+        headers=AUTH_HEADERS,
+    )
+
+    assert response.status_code == 400
+    assert response.json["message"] == "Unknown metrics: latitude"
+
+
+def test_aggregate_observations_from_rollups(db_client):
+    """Tests that aggregates read from the rollups maintained on ingest match
+    those computed from the raw observations."""
+
+    db_client.post(
+        "/observations",
+        json=make_observation(
+            time_logged="23:30:00", time_zone_offset="-01:00"
+        ),
+        headers=AUTH_HEADERS,
+    )
+    db_client.post(
+        "/observations/create-many",
+        json=[
+            make_observation(water_temp=4),
+            make_observation(time_logged="12:10:00", air_temp=30),
+        ],
+        headers=AUTH_HEADERS,
+    )
+    db_client.post(
+        "/observations/create-many",
+        query_string={"mode": "bulk"},
+        json=[make_observation(water_temp=15, device_id=2)],
+        headers=AUTH_HEADERS,
+    )
+
+    for bucket in ("hour", "day", "month"):
+        query = {"bucket": bucket, "group_by": "device_id"}
+        from_rollups = db_client.get(
+            "/observations/aggregate", query_string=query, headers=AUTH_HEADERS
+        )
+        # Filtering on individual observations forces a raw aggregation.
+        from_raw = db_client.get(
+            "/observations/aggregate",
+            query_string={**query, "min_water_temp": -100},
+            headers=AUTH_HEADERS,
+        )
+
+        assert from_rollups.status_code == 200
+        assert from_rollups.json == from_raw.json
+
+    assert [row["count"] for row in from_rollups.json] == [3, 1]
+
+    # Rebuilding the rollups from scratch gives the same result.
+    assert rebuild_rollups() == 4
+    db.session.commit()
+
+    response = db_client.get(
+        "/observations/aggregate", query_string=query, headers=AUTH_HEADERS
+    )
+    assert response.json == from_rollups.json
+
+
+def test_get_observations_cached(client, mocker):
+    """Tests that repeated identical requests are served from the cache and
+    that conditional requests get a 304."""
+
+    mocker.patch("jwt.decode", return_value={"valid": "token"})
+    mock_query = mocker.patch("models.Observation.query")
+    mock_query.filter.return_value = mock_query
+    mock_query.with_entities.return_value = mock_query
+    mock_query.all.return_value = [
+        tuple(
+            {"id": 1, "humidity": 10}.get(name)
+            for name in ObservationSchema.Meta.fields
+        )
+    ]
+
+    first = client.get(
+        "/observations?min_humidity=1&max_humidity=50", headers=AUTH_HEADERS
+    )
+    # The same parameters in a different order share the cached response.
+    second = client.get(
+        "/observations?max_humidity=50&min_humidity=1", headers=AUTH_HEADERS
+    )
+
+    assert first.status_code == second.status_code == 200
+    assert first.data == second.data
+    assert first.headers["ETag"] == second.headers["ETag"]
+    mock_query.all.assert_called_once()
+
+    conditional = client.get(
+        "/observations?min_humidity=1&max_humidity=50",
+        headers={**AUTH_HEADERS, "If-None-Match": first.headers["ETag"]},
+    )
+
+    assert conditional.status_code == 304
+    assert conditional.data == b""
+    mock_query.all.assert_called_once()
+
+
+def test_get_observations_cache_invalidated_by_writes(db_client):
+    """Tests that creating an observation invalidates cached responses."""
+
+    first = db_client.get("/observations", headers=AUTH_HEADERS)
+    assert first.json == []
+
+    db_client.post(
+        "/observations", json=make_observation(), headers=AUTH_HEADERS
+    )
+
+    second = db_client.get(
+        "/observations",
+        headers={**AUTH_HEADERS, "If-None-Match": first.headers["ETag"]},
+    )
+
+    assert second.status_code == 200
+    assert len(second.json) == 1
+    assert second.headers["ETag"] != first.headers["ETag"]
+
+
+def test_get_observations_near(db_client):
+    """Tests that observations are filtered by their distance from a location,
+    including across the antimeridian."""
+
+    # Suva, Taveuni (on the other side of the antimeridian) and Auckland,
+    # labelled by water temperature.
+    locations = {
+        1: (-18.14, 178.44),
+        2: (-16.85, -179.97),
+        3: (-36.85, 174.76),
+    }
+    db_client.post(
+        "/observations/create-many",
+        query_string={"mode": "bulk"},
+        json=[
+            make_observation(
+                time_logged=f"12:0{label}:00",
+                latitude=latitude,
+                longitude=longitude,
+                water_temp=label,
+            )
+            for label, (latitude, longitude) in locations.items()
+        ],
+        headers=AUTH_HEADERS,
+    )
+    query = {"near": "-18.14,178.44", "radius_km": 250}
+
+    response = db_client.get(
+        "/observations", query_string=query, headers=AUTH_HEADERS
+    )
+
+    assert response.status_code == 200
+    assert sorted(row["water_temp"] for row in response.json) == [1, 2]
+
+
+def test_get_observations_bounding_box(db_client):
+    """Tests that bounding box filters still apply exactly within the grid
+    cells they are pruned to."""
+
+    db_client.post(
+        "/observations/create-many",
+        json=[
+            make_observation(
+                time_logged="12:00:00", latitude=51.49, longitude=-0.12
+            ),
+            make_observation(
+                time_logged="12:01:00", latitude=51.51, longitude=-0.12
+            ),
+            make_observation(
+                time_logged="12:02:00", latitude=51.6, longitude=-0.5
+            ),
+        ],
+        headers=AUTH_HEADERS,
+    )
+
+    response = db_client.get(
+        "/observations",
+        query_string={
+            "min_latitude": 51.5,
+            "max_latitude": 52,
+            "min_longitude": -0.2,
+            "max_longitude": 0,
+        },
+        headers=AUTH_HEADERS,
+    )
+
+    assert [row["latitude"] for row in response.json] == [51.51]
+
+
+def test_get_observations_near_invalid(db_client):
+    """Tests that a near filter without a radius is rejected."""
+
+    response = db_client.get(
+        "/observations",
+        query_string={"near": "51.5,-0.1"},
+        headers=AUTH_HEADERS,
+    )
+
+    assert response.status_code == 400
+    assert response.json["message"] == "radius_km must be a positive number"
+
+
+def test_create_observation_async(db_client):
+    """Tests that an observation created in async mode is written by the
+    background writer and its receipt reports it."""
+
+    response, retry = (
+        db_client.post(
+            "/observations",
+            query_string={"mode": "async"},
+            json=make_observation(),
+            headers=AUTH_HEADERS,
+        )
+        for _ in range(2)
+    )
+
+    assert response.status_code == 202
+    assert response.json["status"] == "queued"
+
+    # Shutting down waits for everything queued to be written.
+    get_ingest_queue().shutdown()
+
+    receipt = db_client.get(response.headers["Location"], headers=AUTH_HEADERS)
+
+    assert receipt.status_code == 200
+    assert receipt.json["status"] == "committed"
+    assert receipt.json["observation_id"] == 1
+
+    receipt = db_client.get(retry.headers["Location"], headers=AUTH_HEADERS)
+    assert receipt.json["status"] == "duplicate"
+
+    observations = db_client.get("/observations", headers=AUTH_HEADERS)
+    assert len(observations.json) == 1
+
+
+def test_create_observation_async_rejected(db_client):
+    """Tests that async observations are validated before being queued and
+    refused with a Retry-After when the queue can't accept them."""
+
+    response = db_client.post(
+        "/observations",
+        query_string={"mode": "async"},
+        json=make_observation(humidity="damp"),
+        headers=AUTH_HEADERS,
+    )
+
+    assert response.status_code == 400
+    assert response.json == {"humidity": ["Not a valid integer."]}
+
+    get_ingest_queue().shutdown()
+
+    response = db_client.post(
+        "/observations",
+        query_string={"mode": "async"},
+        json=make_observation(),
+        headers=AUTH_HEADERS,
+    )
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_get_receipt_not_found(db_client):
+    """Tests that an unknown receipt returns a 404."""
+
+    response = db_client.get("/observations/receipts/123", headers=AUTH_HEADERS)
+
+    assert response.status_code == 404
+
+
+def add_device(**overrides):
+    """Adds a device to the database, overriding any given fields."""
+
+    device_data = {
+        "name": "DV-002",
+        "city": "Paris",
+        "country": "France",
+        "status": "Offline",
+        "battery_level": 5,
+    }
+    device_data.update(overrides)
+
+    db.session.add(Device(**device_data))
+    db.session.commit()
+
+
+def test_get_devices_latest_observation(db_client):
+    """Tests that devices are listed with their latest observation by UTC
+    time, whichever way the observations were created."""
+
+    add_device()
+
+    # Created through the ORM. The second is earlier in local time, but
+    # later in UTC.
+    db_client.post(
+        "/observations",
+        json=make_observation(water_temp=1),
+        headers=AUTH_HEADERS,
+    )
+    db_client.post(
+        "/observations",
+        json=make_observation(
+            water_temp=2, time_logged="11:00:00", time_zone_offset="-02:00"
+        ),
+        headers=AUTH_HEADERS,
+    )
+    # Created through the bulk insert path, and older than the latest.
+    db_client.post(
+        "/observations/create-many",
+        query_string={"mode": "bulk"},
+        json=[make_observation(water_temp=3, date_logged="2023-12-31")],
+        headers=AUTH_HEADERS,
+    )
+
+    response = db_client.get(
+        "/devices?embed=latest_observation", headers=AUTH_HEADERS
+    )
+
+    assert response.status_code == 200
+    assert response.json["next_cursor"] is None
+
+    first, second = response.json["devices"]
+    assert first["name"] == "DV-001"
+    assert first["latest_observation"]["water_temp"] == 2
+    assert set(first["latest_observation"]) == set(
+        ObservationSchema.Meta.fields
+    )
+    assert second["name"] == "DV-002"
+    assert second["latest_observation"] is None
+
+    # Without embedding, only the device fields are returned.
+    response = db_client.get("/devices", headers=AUTH_HEADERS)
+    assert set(response.json["devices"][0]) == {
+        "id",
+        "name",
+        "city",
+        "country",
+        "status",
+        "battery_level",
+    }
+
+
+def test_get_devices_filters_and_pagination(db_client):
+    """Tests filtering devices and paging through them."""
+
+    for number in range(2, 6):
+        add_device(name=f"DV-00{number}", battery_level=number * 10)
+
+    response = db_client.get(
+        "/devices?status=Offline&country=France&min_battery_level=30&limit=2",
+        headers=AUTH_HEADERS,
+    )
+
+    assert response.status_code == 200
+    assert [d["name"] for d in response.json["devices"]] == [
+        "DV-003",
+        "DV-004",
+    ]
+
+    response = db_client.get(
+        "/devices?status=Offline&country=France&min_battery_level=30&limit=2"
+        f"&cursor={response.json['next_cursor']}",
+        headers=AUTH_HEADERS,
+    )
+
+    assert [d["name"] for d in response.json["devices"]] == ["DV-005"]
+    assert response.json["next_cursor"] is None
+
+    response = db_client.get("/devices?cursor=nonsense", headers=AUTH_HEADERS)
+    assert response.status_code == 400
+
+
+def test_get_devices_single_query(db_client):
+    """Tests that the latest observations are read in the same query as the
+    devices, however many devices there are."""
+
+    for number in range(2, 12):
+        add_device(name=f"DV-{number:03d}")
+    db_client.post(
+        "/observations/create-many",
+        query_string={"mode": "bulk"},
+        json=[make_observation(device_id=i) for i in range(1, 12)],
+        headers=AUTH_HEADERS,
+    )
+
+    statements = []
+    engine = db.engine
+    listener = lambda *args: statements.append(args[2])  # noqa: E731
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        response = db_client.get(
+            "/devices?embed=latest_observation", headers=AUTH_HEADERS
+        )
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    assert len(response.json["devices"]) == 11
+    assert all(d["latest_observation"] for d in response.json["devices"])
+    assert len(statements) == 1
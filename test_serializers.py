@@ -0,0 +1,134 @@
+"""Tests for the fast row serialisers."""
+
+import datetime
+import json
+
+import pytest
+from flask import jsonify
+
+from conftest import make_device, make_observation_row
+from models import Device, Observation, db
+from schemas import DeviceSchema, ObservationSchema
+from serializers import device_serializer, observation_serializer
+
+
+@pytest.fixture
+def num_devices():
+    """Fixture to start without devices, so the edge cases can be added."""
+
+    return 0
+
+
+@pytest.fixture
+def app(app):
+    """Fixture to set up an app whose database holds devices and observations
+    covering the edge cases of serialisation."""
+
+    db.session.add_all(
+        [
+            make_device(1),
+            make_device(
+                2,
+                name="DV-002 “Thames”",
+                city="Reading",
+                status="Offline",
+                battery_level=0,
+            ),
+        ]
+    )
+    db.session.add_all(
+        [
+            make_observation_row(),
+            make_observation_row(
+                date_logged=datetime.date(1999, 12, 31),
+                time_logged=datetime.time(23, 59, 59, 123456),
+                time_zone_offset="UTC-09:30",
+                latitude=-45.123456789,
+                longitude=179.999999,
+                water_temp=-3,
+                air_temp=-40,
+                wind_speed=0,
+                wind_direction=0,
+                humidity=100,
+                haze_percent=0,
+                precipitation_mm=250,
+                radiation_bq=0,
+                device_id=2,
+            ),
+        ]
+    )
+    db.session.commit()
+
+    return app
+
+
+def assert_same_response(expected, actual):
+    """Asserts that two serialisations produce byte-identical responses."""
+
+    assert actual == expected
+    assert jsonify(actual).get_data() == jsonify(expected).get_data()
+    assert json.dumps(actual) == json.dumps(expected)
+
+
+def test_observation_serializer_matches_schema(app):
+    """Tests that observations serialise exactly as ObservationSchema does."""
+
+    serializer = observation_serializer()
+    objects = Observation.query.order_by(Observation.id).all()
+    rows = (
+        Observation.query.with_entities(*serializer.columns)
+        .order_by(Observation.id)
+        .all()
+    )
+
+    assert_same_response(
+        ObservationSchema(many=True).dump(objects), serializer.dump(rows)
+    )
+
+
+def test_device_serializer_matches_schema(app):
+    """Tests that devices serialise exactly as DeviceSchema does."""
+
+    serializer = device_serializer()
+    objects = Device.query.order_by(Device.id).all()
+    rows = (
+        Device.query.with_entities(*serializer.columns)
+        .order_by(Device.id)
+        .all()
+    )
+
+    assert_same_response(
+        DeviceSchema(many=True).dump(objects), serializer.dump(rows)
+    )
+
+
+def test_observation_serializer_field_subset(app):
+    """Tests that a subset of fields serialises in the order given, matching
+    the schema restricted to those fields."""
+
+    field_names = ("time_logged", "id", "latitude")
+    serializer = observation_serializer(field_names)
+    objects = Observation.query.order_by(Observation.id).all()
+    rows = (
+        Observation.query.with_entities(*serializer.columns)
+        .order_by(Observation.id)
+        .all()
+    )
+
+    expected = ObservationSchema(many=True, only=field_names).dump(objects)
+    actual = serializer.dump(rows)
+
+    assert [list(row) for row in actual] == [list(field_names)] * 2
+    assert actual == expected
+
+
+def test_observation_serializer_none_values(app):
+    """Tests that missing values are output as null, as the schema does."""
+
+    serializer = observation_serializer()
+    observation = Observation(id=None, date_logged=None, latitude=None)
+    row = tuple(getattr(observation, name) for name in serializer.field_names)
+
+    assert_same_response(
+        ObservationSchema().dump(observation), serializer.dump_row(row)
+    )
@@ -0,0 +1,265 @@
+"""Tests for the KLL sketches and the stats served from them."""
+
+import bisect
+import random
+
+import pytest
+
+from conftest import AUTH_HEADERS, make_observation
+from kll import KLLSketch, rank_error
+from models import ObservationSketch, db
+from sketches import rebuild_sketches
+
+FRACTIONS = (0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99)
+
+
+def _rank_error(values, fraction, estimate):
+    """Gets how far the rank of an estimate is from the requested one, as a
+    fraction of the values, allowing for ties."""
+
+    lowest = bisect.bisect_left(values, estimate) / len(values)
+    highest = bisect.bisect_right(values, estimate) / len(values)
+
+    if lowest <= fraction <= highest:
+        return 0
+    return min(abs(fraction - lowest), abs(fraction - highest))
+
+
+def _assert_within_bound(values, sketch):
+    """Asserts that a sketch's quantiles are within its rank error."""
+
+    values = sorted(values)
+    assert sketch.n == len(values)
+    assert (sketch.min, sketch.max) == (values[0], values[-1])
+
+    for fraction, estimate in zip(FRACTIONS, sketch.quantiles(FRACTIONS)):
+        assert _rank_error(values, fraction, estimate) <= rank_error()
+
+
+@pytest.mark.parametrize(
+    "generate",
+    [
+        lambda rng, i: rng.gauss(0, 1),
+        lambda rng, i: rng.expovariate(0.1),
+        lambda rng, i: rng.randint(0, 20),
+        lambda rng, i: i,
+    ],
+    ids=["normal", "exponential", "ties", "sorted"],
+)
+def test_kll_sketch_error_bound(generate):
+    """Tests that quantiles of a large stream are within the documented rank
+    error of the exact ones, whether built in one sketch or merged."""
+
+    rng = random.Random(0)
+    values = [generate(rng, i) for i in range(50000)]
+
+    sketch = KLLSketch(rng=rng)
+    for value in values:
+        sketch.update(value)
+    _assert_within_bound(values, sketch)
+    assert sum(map(len, sketch.levels)) < 3 * sketch.k
+
+    merged = KLLSketch(rng=rng)
+    for start in range(0, len(values), 288):
+        part = KLLSketch(rng=rng)
+        for value in values[start : start + 288]:
+            part.update(value)
+        merged.merge(KLLSketch.from_bytes(part.to_bytes(), rng))
+    _assert_within_bound(values, merged)
+
+
+def test_kll_sketch_small_and_empty():
+    """Tests that sketches of fewer than k values are exact and that an empty
+    sketch survives serialisation."""
+
+    sketch = KLLSketch()
+    for value in (5, 1, 4, 2, 3):
+        sketch.update(value)
+
+    assert sketch.quantiles([0, 0.2, 0.5, 0.99, 1]) == [1, 1, 3, 5, 5]
+
+    empty = KLLSketch.from_bytes(KLLSketch().to_bytes())
+    assert empty.quantiles([0.5]) == [None]
+
+    with pytest.raises(ValueError):
+        KLLSketch.from_bytes(b"\x09" + sketch.to_bytes()[1:])
+
+
+def test_kll_sketch_update_many():
+    """Tests that adding values in batches builds the same sketch as adding
+    them one at a time."""
+
+    rng = random.Random(1)
+    values = [rng.gauss(0, 1) for _ in range(5000)]
+
+    one_at_a_time = KLLSketch(rng=random.Random(0))
+    for value in values:
+        one_at_a_time.update(value)
+
+    batched = KLLSketch(rng=random.Random(0))
+    for start in range(0, len(values), 700):
+        batched.update_many(values[start : start + 700])
+    batched.update_many([])
+
+    assert batched.to_bytes() == one_at_a_time.to_bytes()
+
+
+@pytest.fixture
+def num_devices():
+    """Fixture for the two devices the stats are grouped by."""
+
+    return 2
+
+
+@pytest.fixture
+def cache_responses():
+    """Fixture to disable response caching, so each read hits the sketches."""
+
+    return False
+
+
+def _observation(device_id, day, minute, radiation_bq, wind_speed):
+    """Builds observation request data at a minute past midnight UTC."""
+
+    return make_observation(
+        date_logged=f"2024-01-0{day}",
+        time_logged=f"{minute // 60:02d}:{minute % 60:02d}:00",
+        wind_speed=wind_speed,
+        radiation_bq=radiation_bq,
+        device_id=device_id,
+    )
+
+
+def _stats(client, **query_string):
+    """Gets the stats for a query, asserting that it succeeds."""
+
+    response = client.get(
+        "/observations/stats", query_string=query_string, headers=AUTH_HEADERS
+    )
+    assert response.status_code == 200, response.json
+
+    return response.json
+
+
+def test_stats_updated_on_create(db_client):
+    """Tests that sketches are updated by each create route and merged across
+    devices and days, or grouped by them."""
+
+    db_client.post(
+        "/observations",
+        json=_observation(1, 1, 0, radiation_bq=10, wind_speed=1),
+        headers=AUTH_HEADERS,
+    )
+    db_client.post(
+        "/observations/create-many",
+        json=[
+            _observation(1, 1, 1, radiation_bq=30, wind_speed=3),
+            _observation(2, 1, 0, radiation_bq=20, wind_speed=2),
+        ],
+        headers=AUTH_HEADERS,
+    )
+    db_client.post(
+        "/observations/create-many",
+        query_string={"mode": "bulk"},
+        json=[_observation(2, 2, 0, radiation_bq=40, wind_speed=4)],
+        headers=AUTH_HEADERS,
+    )
+
+    assert _stats(db_client, percentiles="0,50,100") == [
+        {
+            "count": 4,
+            "radiation_bq": {
+                "min": 10,
+                "max": 40,
+                "p0": 10,
+                "p50": 20,
+                "p100": 40,
+            },
+            "wind_speed": {"min": 1, "max": 4, "p0": 1, "p50": 2, "p100": 4},
+        }
+    ]
+
+    grouped = _stats(
+        db_client,
+        metrics="radiation_bq",
+        group_by="device_id,day",
+        percentiles="99.9",
+    )
+    assert [
+        (g["device_id"], g["day"], g["count"], g["radiation_bq"]["p99.9"])
+        for g in grouped
+    ] == [
+        (1, "2024-01-01", 2, 30),
+        (2, "2024-01-01", 1, 20),
+        (2, "2024-01-02", 1, 40),
+    ]
+
+    stats = _stats(db_client, device_id__in="2", date_from="2024-01-02")
+    assert [s["radiation_bq"]["max"] for s in stats] == [40]
+
+    assert _stats(db_client, date_from="2024-02-01") == []
+
+
+def test_stats_within_error_bound(db_client):
+    """Tests that percentiles merged from many devices and days are within the
+    documented rank error of the exact ones."""
+
+    # Make the random choices when compacting repeatable.
+    random.seed(0)
+    rng = random.Random(1)
+    observations = [
+        _observation(
+            1 + i // 4320,
+            1 + i // 1440 % 3,
+            i % 1440,
+            radiation_bq=int(rng.lognormvariate(3, 1)),
+            wind_speed=rng.randint(0, 60),
+        )
+        for i in range(8640)
+    ]
+    response = db_client.post(
+        "/observations/create-many",
+        query_string={"mode": "bulk"},
+        json=observations,
+        headers=AUTH_HEADERS,
+    )
+    assert response.json["accepted"] == len(observations)
+
+    percentiles = [p * 100 for p in FRACTIONS]
+    (stats,) = _stats(
+        db_client, percentiles=",".join(f"{p:g}" for p in percentiles)
+    )
+
+    for metric in ("radiation_bq", "wind_speed"):
+        values = sorted(o[metric] for o in observations)
+        for fraction, percentile in zip(FRACTIONS, percentiles):
+            estimate = stats[metric][f"p{percentile:g}"]
+            assert _rank_error(values, fraction, estimate) <= rank_error()
+
+    # Rebuilding gives sketches of the same observations.
+    sketches = db.session.query(ObservationSketch).count()
+    assert rebuild_sketches(chunk_size=1000) == len(observations)
+    assert db.session.query(ObservationSketch).count() == sketches
+    assert _stats(db_client)[0]["count"] == len(observations)
+
+
+@pytest.mark.parametrize(
+    "query_string, message",
+    [
+        ({"metrics": "air_temp"}, "Metrics must be among"),
+        ({"percentiles": "101"}, "Percentiles must be numbers"),
+        ({"percentiles": "p95"}, "Percentiles must be numbers"),
+        ({"group_by": "month"}, "Can only group by"),
+        ({"observed_from": "2024-01-01"}, "Unknown parameters"),
+        ({"date_from": "yesterday"}, "date_from must be a date"),
+    ],
+)
+def test_stats_invalid(db_client, query_string, message):
+    """Tests that invalid stats parameters are rejected."""
+
+    response = db_client.get(
+        "/observations/stats", query_string=query_string, headers=AUTH_HEADERS
+    )
+
+    assert response.status_code == 400
+    assert response.json["message"].startswith(message)
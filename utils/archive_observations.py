@@ -0,0 +1,26 @@
+"""Script to move months of observations older than ARCHIVE_AFTER_MONTHS out
+of the observation table into compressed files in ARCHIVE_DIRECTORY.
+
+It is safe to run repeatedly, e.g. daily from cron. Observations received late
+for a month that is already archived are merged into its file on the next run.
+
+Usage:
+    python utils/archive_observations.py
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from app import app
+from archive import archive_old_months, get_archive_catalog
+from models import db
+
+if __name__ == "__main__":
+    with app.app_context():
+        db.create_all()
+        archived = archive_old_months(get_archive_catalog())
+
+    for month, count in archived.items():
+        print(f"Archived {count} observations from {month:%Y-%m}.")
+    print(f"Archived {sum(archived.values())} observations in total.")
@@ -0,0 +1,308 @@
+"""Script to bring an existing database up to date with the current models.
+
+db.create_all() only creates missing tables, so columns and indexes added to
+existing tables have to be applied here. Every step is safe to run more than
+once.
+
+Usage:
+    python utils/migrate.py [database URI]
+
+If no URI is given, the one configured in the .env file is used.
+"""
+
+import os
+import sys
+
+from sqlalchemy import (
+    Column,
+    MetaData,
+    Table,
+    bindparam,
+    create_engine,
+    delete,
+    func,
+    inspect,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.schema import CreateTable, DropTable
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from devices import latest_observations_statement
+from models import NATURAL_KEY, Device, Observation, db, utc_timestamp
+from spatial import grid_cell
+
+# The number of rows updated in each transaction while backfilling.
+BACKFILL_CHUNK_SIZE = 5000
+
+
+def add_column(connection, table, column):
+    """Adds a nullable column to an existing table if it is missing.
+
+    Args:
+        connection: The database connection.
+        table: The table to add the column to.
+        column (Column): The column definition.
+    """
+
+    existing = {c["name"] for c in inspect(connection).get_columns(table.name)}
+    if column.name in existing:
+        return
+
+    column_type = column.type.compile(dialect=connection.dialect)
+    connection.execute(
+        text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+    )
+
+
+def backfill_column(engine, column_name, source_names, compute):
+    """Populates a derived observation column for rows created before it
+    existed.
+
+    Args:
+        engine: The database engine.
+        column_name (str): The name of the column to populate.
+        source_names (tuple): The names of the columns it is derived from.
+        compute (callable): Computes the value from the source columns.
+
+    Returns:
+        int: The number of observations updated.
+    """
+
+    table = Observation.__table__
+    column = table.c[column_name]
+    statement = (
+        update(table)
+        .where(table.c.id == bindparam("row_id"))
+        .values({column_name: bindparam("value")})
+    )
+    updated = 0
+
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                select(table.c.id, *(table.c[name] for name in source_names))
+                .where(column.is_(None))
+                .limit(BACKFILL_CHUNK_SIZE)
+            ).all()
+
+            if not rows:
+                return updated
+
+            connection.execute(
+                statement,
+                [
+                    {"row_id": row[0], "value": compute(*row[1:])}
+                    for row in rows
+                ],
+            )
+            updated += len(rows)
+
+
+def rebuild_table(connection, table):
+    """Recreates an existing table from its model definition, keeping its
+    rows.
+
+    SQLite can't change the constraints of an existing column, so the rows
+    are copied into a new table, which then replaces the old one. The table's
+    indexes are dropped with it, and need creating again afterwards.
+
+    Args:
+        connection: The database connection.
+        table: The model's table.
+    """
+
+    # The copy needs the tables it references to compile its foreign keys.
+    metadata = MetaData()
+    for other in db.metadata.sorted_tables:
+        other.to_metadata(metadata)
+    rebuilt = table.to_metadata(metadata, name=f"{table.name}_rebuilt")
+
+    names = [c["name"] for c in inspect(connection).get_columns(table.name)]
+    connection.execute(CreateTable(rebuilt))
+    connection.execute(
+        rebuilt.insert().from_select(
+            names, select(*(table.c[name] for name in names))
+        )
+    )
+    connection.execute(DropTable(table))
+    connection.execute(
+        text(f"ALTER TABLE {rebuilt.name} RENAME TO {table.name}")
+    )
+
+
+def require_columns(engine, table, column_names):
+    """Makes backfilled columns NOT NULL, as they are defined on the model.
+
+    Args:
+        engine: The database engine.
+        table: The table the columns are on.
+        column_names (list): The names of the columns.
+    """
+
+    with engine.begin() as connection:
+        nullable = {
+            c["name"]
+            for c in inspect(connection).get_columns(table.name)
+            if c["nullable"]
+        }
+        names = [name for name in column_names if name in nullable]
+        if not names:
+            return
+
+        if connection.dialect.name == "sqlite":
+            rebuild_table(connection, table)
+            return
+
+        for name in names:
+            column_type = table.c[name].type.compile(dialect=connection.dialect)
+            connection.execute(
+                text(
+                    f"ALTER TABLE {table.name} MODIFY COLUMN {name} "
+                    f"{column_type} NOT NULL"
+                )
+            )
+
+
+# Columns derived from other observation fields, along with the fields they
+# are derived from and the function that derives them.
+DERIVED_COLUMNS = (
+    (
+        "observed_at_utc",
+        ("date_logged", "time_logged", "time_zone_offset"),
+        utc_timestamp,
+    ),
+    ("grid_cell", ("latitude", "longitude"), grid_cell),
+)
+
+
+def remove_duplicates(engine):
+    """Deletes repeated observations of the same reading, keeping the first
+    stored, so that the natural key can be made unique.
+
+    Args:
+        engine: The database engine.
+
+    Returns:
+        int: The number of observations deleted.
+    """
+
+    table = Observation.__table__
+    columns = [table.c[name] for name in NATURAL_KEY]
+
+    # Selected from a derived table, as MySQL can't delete from a table that
+    # a subquery of the statement reads directly.
+    first_ids = (
+        select(func.min(table.c.id).label("id")).group_by(*columns).subquery()
+    )
+    first_ids = select(first_ids.c.id)
+
+    with engine.begin() as connection:
+        # Devices may point at a deleted observation as their latest, so
+        # their pointers are reset to be recomputed.
+        connection.execute(
+            update(Device.__table__)
+            .where(Device.__table__.c.last_observation_id.not_in(first_ids))
+            .values(last_observation_id=None)
+        )
+        return connection.execute(
+            delete(table).where(table.c.id.not_in(first_ids))
+        ).rowcount
+
+
+def drop_index(engine, table, name):
+    """Drops an index that is no longer defined on the models, if it exists.
+
+    Args:
+        engine: The database engine.
+        table: The table the index is on.
+        name (str): The name of the index.
+    """
+
+    with engine.begin() as connection:
+        # The index is reflected with its table rather than dropped by name
+        # alone, as some databases, e.g. MySQL, need the table to drop it.
+        reflected = Table(table.name, MetaData(), autoload_with=connection)
+        for index in reflected.indexes:
+            if index.name == name:
+                index.drop(connection)
+
+
+def create_indexes(engine):
+    """Creates any indexes defined on the models that don't exist yet.
+
+    Args:
+        engine: The database engine.
+    """
+
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+
+def migrate(database_uri):
+    """Applies all migration steps to the given database.
+
+    Args:
+        database_uri (str): The SQLAlchemy database URI.
+    """
+
+    engine = create_engine(database_uri)
+    db.metadata.create_all(engine)
+
+    table = Observation.__table__
+
+    for column_name, source_names, compute in DERIVED_COLUMNS:
+        with engine.begin() as connection:
+            add_column(
+                connection,
+                table,
+                Column(column_name, table.c[column_name].type),
+            )
+
+        updated = backfill_column(engine, column_name, source_names, compute)
+        print(f"Backfilled {column_name} for {updated} observations.")
+
+    require_columns(
+        engine, table, [column_name for column_name, *_ in DERIVED_COLUMNS]
+    )
+
+    # Removing duplicates resets device pointers, so the column must exist.
+    with engine.begin() as connection:
+        add_column(
+            connection,
+            Device.__table__,
+            Column("last_observation_id", Device.last_observation_id.type),
+        )
+
+    removed = remove_duplicates(engine)
+    print(f"Removed {removed} duplicate observations.")
+    if removed:
+        print("Run utils/rebuild_rollups.py to correct the rollups.")
+
+    # The unique natural key index replaces the plain one on the same columns.
+    drop_index(engine, table, "ix_observation_device_observed_at")
+    create_indexes(engine)
+
+    # Point devices at their latest observations, after the index used to
+    # find them has been created.
+    with engine.begin() as connection:
+        connection.execute(
+            latest_observations_statement().where(
+                Device.__table__.c.last_observation_id.is_(None)
+            )
+        )
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        uri = sys.argv[1]
+    else:
+        from config import config
+
+        uri = config.database_uri
+
+    migrate(uri)
+    print("Database migrated successfully.")
@@ -0,0 +1,27 @@
+"""Script to rebuild the observation rollup and sketch tables from the raw
+observations, including those in archived months, e.g. after backfilling
+observations or migrating an existing database.
+
+Usage:
+    python utils/rebuild_rollups.py
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from app import app
+from models import db
+from rollups import rebuild_rollups
+from sketches import rebuild_sketches
+
+if __name__ == "__main__":
+    with app.app_context():
+        db.create_all()
+        total = rebuild_rollups()
+        db.session.commit()
+        print(f"Rolled up {total} observations.")
+
+        total = rebuild_sketches()
+        db.session.commit()
+        print(f"Sketched {total} observations.")
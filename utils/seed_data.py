@@ -1,78 +1,437 @@
-"""Script to seed initial data for testing purposes."""
+"""Script to seed initial data for testing purposes.
 
+Data is generated deterministically from a seed, so the same arguments always
+produce the same dataset. Each device is placed near one of a handful of sites
+and reports a time series with seasonal and daily cycles, autocorrelated noise
+and spells of rain, rather than independent random values.
+
+Observations are generated a column at a time for every device at each time
+step, and bulk inserted in chunks, so datasets of tens of millions of rows can
+be seeded.
+
+Usage:
+    python utils/seed_data.py [--observations N] [--devices N] [--days N]
+        [--start YYYY-MM-DD] [--seed N] [--database URI]
+"""
+
+import argparse
 import datetime
+import math
 import os
 import random
 import sys
 
 from flask import Flask
+from sqlalchemy import func, insert, select
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from models import Device, Observation, db
+from ingest import insert_rows
+from models import Device, db
 
-app = Flask(__name__)
-# If using MySQL, just replace the following lines with the appropriate
-# connection string details
+# If using MySQL, just pass the appropriate connection string instead
 db_path = os.path.join(
     os.path.abspath(os.path.dirname(__file__)), "..", "instance", "api.db"
 )
-app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-db.init_app(app)
+DEFAULT_DATABASE_URI = f"sqlite:///{db_path}"
 
+# The number of observations generated and inserted in each transaction.
+SEED_CHUNK_SIZE = 10000
 
-def seed_data(num_devices=5, num_observations=20):
-    """Seed the database with some initial data for testing purposes. Note that
-    this doesn't really reflect real-world data - it's just to get some data in
-    to the database so that you can test the API without having to manually add
-    records."""
+# Sites that devices are placed around, as (city, country, latitude,
+# longitude).
+SITES = (
+    ("London", "United Kingdom", 51.51, -0.13),
+    ("Hartlepool", "United Kingdom", 54.69, -1.21),
+    ("Anglesey", "United Kingdom", 53.29, -4.37),
+    ("Flamanville", "France", 49.54, -1.88),
+    ("Oskarshamn", "Sweden", 57.26, 16.45),
+    ("Darlington", "Canada", 43.87, -78.72),
+    ("Kemmerer", "United States", 41.79, -110.54),
+    ("Oak Ridge", "United States", 35.93, -84.31),
+    ("Tsuruga", "Japan", 35.65, 136.06),
+    ("Chennai", "India", 13.08, 80.27),
+    ("Koeberg", "South Africa", -33.68, 18.43),
+    ("Angra dos Reis", "Brazil", -23.01, -44.32),
+)
 
-    with app.app_context():
-        db.create_all()
 
-        # Create devices
-        devices = []
+def create_seed_app(database_uri):
+    """Creates a Flask app connected to the database to seed.
+
+    Args:
+        database_uri (str): The SQLAlchemy database URI.
+
+    Returns:
+        Flask: The app.
+    """
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_uri
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+
+    return app
+
+
+def _clamp(value, low, high):
+    """Restricts a value to a range."""
+
+    return min(max(value, low), high)
+
+
+class _DeviceSeries:
+    """The fixed characteristics of the devices, and the current state of
+    each device's time series.
+
+    Every attribute is a list with an entry per device, so that each column of
+    a time step can be generated with a single list comprehension.
+    """
+
+    def __init__(self, rng, num_devices):
+        """Places the devices and picks their characteristics.
+
+        Args:
+            rng (Random): The random number generator.
+            num_devices (int): The number of devices.
+        """
+
+        self.rows = []
+        self.latitude = []
+        self.longitude = []
+        self.offset_hours = []
+        self.mean_temp = []
+        self.seasonal_temp = []
+        self.radiation = []
+
         for i in range(num_devices):
-            device = Device(
-                name=f"Device {i+1}",
-                city=f"City {i+1}",
-                country=f"Country {i+1}",
-                status="Online",
-                battery_level=random.randint(0, 100),
+            city, country, latitude, longitude = SITES[i % len(SITES)]
+            latitude = round(latitude + rng.uniform(-0.5, 0.5), 6)
+            longitude = round(longitude + rng.uniform(-0.5, 0.5), 6)
+
+            self.rows.append(
+                {
+                    "name": f"DV-{i + 1:03d}",
+                    "city": city,
+                    "country": country,
+                    "status": "Online" if rng.random() < 0.95 else "Offline",
+                    "battery_level": rng.randint(5, 100),
+                }
             )
-            db.session.add(device)
-            devices.append(device)
-        db.session.commit()
+            self.latitude.append(latitude)
+            self.longitude.append(longitude)
+            self.offset_hours.append(_clamp(round(longitude / 15), -12, 14))
 
-        # Create observations
-        for _ in range(num_observations):
-            device = random.choice(devices)
-            observation = Observation(
-                date_logged=datetime.date(
-                    2024, random.randint(1, 12), random.randint(1, 28)
-                ),
-                time_logged=datetime.time(
-                    random.randint(0, 23),
-                    random.randint(0, 59),
-                    random.randint(0, 59),
+            # Warmer and less seasonal towards the equator, with the seasons
+            # reversed in the southern hemisphere.
+            self.mean_temp.append(28 - 0.35 * abs(latitude) + rng.gauss(0, 1))
+            self.seasonal_temp.append(0.25 * latitude)
+            self.radiation.append(rng.uniform(5, 30))
+
+        self.air_noise = [0.0] * num_devices
+        self.water_noise = [0.0] * num_devices
+        self.haze_noise = [0.0] * num_devices
+        self.wind_speed = [rng.uniform(5, 25) for _ in range(num_devices)]
+        self.wind_direction = [rng.uniform(0, 360) for _ in range(num_devices)]
+        self.raining = [False] * num_devices
+
+    def step(self, rng, count, timestamps):
+        """Advances the first devices' time series by one reading each.
+
+        Args:
+            rng (Random): The random number generator.
+            count (int): The number of devices that take a reading.
+            timestamps (list): The UTC time of each device's reading.
+
+        Returns:
+            dict: A list of values for each observation column.
+        """
+
+        devices = range(count)
+        gauss = rng.gauss
+
+        # The time of year, peaking in mid July, and the local time of day,
+        # peaking mid afternoon.
+        season = math.cos(
+            2 * math.pi * (timestamps[0].timetuple().tm_yday - 200) / 365.25
+        )
+        local = [
+            timestamps[i] + datetime.timedelta(hours=self.offset_hours[i])
+            for i in devices
+        ]
+        diurnal = [
+            math.cos(2 * math.pi * (t.hour + t.minute / 60 - 15) / 24)
+            for t in local
+        ]
+
+        self.air_noise[:count] = [
+            0.9 * self.air_noise[i] + gauss(0, 1) for i in devices
+        ]
+        self.water_noise[:count] = [
+            0.98 * self.water_noise[i] + gauss(0, 0.2) for i in devices
+        ]
+        self.wind_speed[:count] = [
+            max(0.0, 0.85 * self.wind_speed[i] + 2.25 + gauss(0, 3))
+            for i in devices
+        ]
+        self.wind_direction[:count] = [
+            (self.wind_direction[i] + gauss(0, 15)) % 360 for i in devices
+        ]
+        self.raining[:count] = [
+            rng.random() < (0.7 if self.raining[i] else 0.05) for i in devices
+        ]
+        self.haze_noise[:count] = [
+            0.8 * self.haze_noise[i] + gauss(0, 3) for i in devices
+        ]
+
+        air_temp = [
+            self.mean_temp[i]
+            + self.seasonal_temp[i] * season
+            + 4 * diurnal[i]
+            + self.air_noise[i]
+            for i in devices
+        ]
+        humidity = [
+            _clamp(
+                round(
+                    65 - 15 * diurnal[i] + 25 * self.raining[i] + gauss(0, 5)
                 ),
-                time_zone_offset=f"+{random.randint(0, 12):02d}:00",
-                latitude=random.uniform(-90, 90),
-                longitude=random.uniform(-180, 180),
-                water_temp=random.randint(-10, 40),
-                air_temp=random.randint(-30, 50),
-                wind_speed=random.randint(0, 150),
-                wind_direction=random.randint(0, 360),
-                humidity=random.randint(0, 100),
-                haze_percent=random.randint(0, 100),
-                precipitation_mm=random.randint(0, 500),
-                radiation_bq=random.randint(0, 100),
-                device_id=device.id,
+                0,
+                100,
             )
-            db.session.add(observation)
+            for i in devices
+        ]
+
+        return {
+            "date_logged": [t.date() for t in local],
+            "time_logged": [t.time() for t in local],
+            "time_zone_offset": [
+                f"{self.offset_hours[i]:+03d}:00" for i in devices
+            ],
+            "latitude": [
+                round(self.latitude[i] + gauss(0, 0.0001), 6) for i in devices
+            ],
+            "longitude": [
+                round(self.longitude[i] + gauss(0, 0.0001), 6) for i in devices
+            ],
+            "water_temp": [
+                max(
+                    -2,
+                    round(
+                        0.8 * self.mean_temp[i]
+                        + 2
+                        + 0.6 * self.seasonal_temp[i] * season
+                        + self.water_noise[i]
+                    ),
+                )
+                for i in devices
+            ],
+            "air_temp": [round(value) for value in air_temp],
+            "wind_speed": [round(self.wind_speed[i]) for i in devices],
+            "wind_direction": [int(self.wind_direction[i]) for i in devices],
+            "humidity": humidity,
+            "haze_percent": [
+                _clamp(round(0.4 * humidity[i] + self.haze_noise[i]), 0, 100)
+                for i in devices
+            ],
+            "precipitation_mm": [
+                round(rng.expovariate(0.25)) if self.raining[i] else 0
+                for i in devices
+            ],
+            "radiation_bq": [
+                max(0, round(self.radiation[i] + gauss(0, 2))) for i in devices
+            ],
+        }
+
+
+def reading_interval(num_devices, num_observations, days):
+    """Gets the interval at which each device reports.
+
+    Observation times are whole seconds, and each device's must be unique, so
+    the interval can't be less than a second.
+
+    Args:
+        num_devices (int): The number of devices.
+        num_observations (int): The total number of observations.
+        days (float): The number of days the observations span.
+
+    Raises:
+        ValueError: If the observations would be less than a second apart.
+
+    Returns:
+        timedelta: The interval.
+    """
+
+    interval = datetime.timedelta(days=days) / math.ceil(
+        num_observations / num_devices
+    )
+
+    if interval < datetime.timedelta(seconds=1):
+        raise ValueError(
+            f"{num_observations} observations from {num_devices} devices "
+            f"over {days:g} days would be less than a second apart, so add "
+            "more devices or days"
+        )
+
+    return interval
+
+
+def generate_observations(
+    num_devices, num_observations, device_ids, start, days, seed=0
+):
+    """Generates observations in chunks.
+
+    Every device reports at the same regular interval, staggered so that the
+    devices don't all report at once, with the interval chosen to spread the
+    observations across the date span.
+
+    Args:
+        num_devices (int): The number of devices.
+        num_observations (int): The total number of observations.
+        device_ids (list): The ids of the devices, in the order they were
+            created.
+        start (datetime): The UTC time of the first observation.
+        days (float): The number of days the observations span.
+        seed (int): The seed for the random number generator.
+
+    Raises:
+        ValueError: If each device's observations would be less than a second
+            apart.
+
+    Yields:
+        list: Chunks of roughly SEED_CHUNK_SIZE observation rows.
+    """
+
+    interval = reading_interval(num_devices, num_observations, days)
+    rng = random.Random(seed)
+    series = _DeviceSeries(rng, num_devices)
+
+    steps = math.ceil(num_observations / num_devices)
+    stagger = [interval * i / num_devices for i in range(num_devices)]
+    steps_per_chunk = max(1, SEED_CHUNK_SIZE // num_devices)
+
+    for first_step in range(0, steps, steps_per_chunk):
+        columns = {}
+        ids = []
+
+        for step in range(first_step, min(first_step + steps_per_chunk, steps)):
+            count = min(num_devices, num_observations - step * num_devices)
+            step_start = start + interval * step
+            timestamps = [
+                (step_start + stagger[i]).replace(microsecond=0)
+                for i in range(count)
+            ]
+
+            for name, values in series.step(rng, count, timestamps).items():
+                columns.setdefault(name, []).extend(values)
+            ids.extend(device_ids[:count])
+
+        columns["device_id"] = ids
+        names = list(columns)
+
+        yield [dict(zip(names, values)) for values in zip(*columns.values())]
+
+
+def generate_devices(num_devices, seed=0):
+    """Generates the devices that generate_observations reports for.
+
+    Args:
+        num_devices (int): The number of devices.
+        seed (int): The seed for the random number generator.
+
+    Returns:
+        list: The device rows.
+    """
+
+    return _DeviceSeries(random.Random(seed), num_devices).rows
+
+
+def seed_data(
+    num_devices=5,
+    num_observations=20,
+    target_app=None,
+    start=datetime.date(2024, 1, 1),
+    days=365,
+    seed=0,
+):
+    """Seed the database with data for testing and benchmarking purposes.
+
+    Args:
+        num_devices (int): The number of devices to create.
+        num_observations (int): The number of observations to create.
+        target_app (Flask, optional): The app whose database is seeded.
+            Defaults to the instance database.
+        start (date): The UTC date of the first observation.
+        days (float): The number of days the observations span.
+        seed (int): The seed for the random number generator.
+
+    Raises:
+        ValueError: If each device's observations would be less than a second
+            apart.
+    """
+
+    # Checked before anything is written.
+    reading_interval(num_devices, num_observations, days)
+    target_app = target_app or create_seed_app(DEFAULT_DATABASE_URI)
+
+    with target_app.app_context():
+        db.create_all()
+
+        # Create devices, then look up their ids as not every database can
+        # return them from a multi-row insert.
+        first_id = db.session.scalar(select(func.max(Device.id))) or 0
+        db.session.execute(insert(Device), generate_devices(num_devices, seed))
         db.session.commit()
+        device_ids = db.session.scalars(
+            select(Device.id).where(Device.id > first_id).order_by(Device.id)
+        ).all()
+
+        # Create observations
+        start = datetime.datetime.combine(start, datetime.time())
+        for rows in generate_observations(
+            num_devices, num_observations, device_ids, start, days, seed
+        ):
+            insert_rows(rows)
+            db.session.commit()
 
 
 if __name__ == "__main__":
-    seed_data(num_devices=20, num_observations=200)
+    parser = argparse.ArgumentParser(
+        description="Seed the database with generated devices and "
+        "observations."
+    )
+    parser.add_argument("--observations", type=int, default=200)
+    parser.add_argument("--devices", type=int, default=20)
+    parser.add_argument(
+        "--days",
+        type=float,
+        default=365,
+        help="the number of days the observations span",
+    )
+    parser.add_argument(
+        "--start",
+        type=datetime.date.fromisoformat,
+        default=datetime.date(2024, 1, 1),
+        help="the UTC date of the first observation",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--database",
+        default=DEFAULT_DATABASE_URI,
+        help="SQLAlchemy URI of the database to seed",
+    )
+    args = parser.parse_args()
+
+    try:
+        reading_interval(args.devices, args.observations, args.days)
+    except ValueError as error:
+        parser.error(str(error))
+
+    seed_data(
+        args.devices,
+        args.observations,
+        create_seed_app(args.database),
+        args.start,
+        args.days,
+        args.seed,
+    )
     print("Data seeded successfully.")